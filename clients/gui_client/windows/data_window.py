@@ -131,11 +131,11 @@ class DataWindow(qtwindow.QTWindow):
         self._entries_model.clear()
         self._entry_map.clear()
         self._meta_tags.clear()
-        for i in self._browser.get_entries():
-            dir, fn = os.path.split(i.get_filename())
+        for fullfn in self._browser.get_filenames():
+            dir, fn = os.path.split(fullfn)
             self._entries_model.append([fn])
-            self._entry_map[fn] = i
-            self._meta_tags |= set(i.get_metadata().keys())
+            self._entry_map[fn] = fullfn
+        self._meta_tags |= set(self._browser.get_metadata_keys())
 
         tags = tuple(self._meta_tags)
         self._meta_dropdown.set_items(tags)
@@ -165,7 +165,10 @@ class DataWindow(qtwindow.QTWindow):
         self._cur_path = path
 
         fn = self._entries_model[path][0]
-        info = self._entry_map.get(fn, None)
+        fullfn = self._entry_map.get(fn, None)
+        if fullfn is None:
+            return
+        info = self._browser.get_entry(fullfn)
         if info is None:
             return
 
@@ -226,7 +229,7 @@ class DataWindow(qtwindow.QTWindow):
 
         self._plot2d_button.set_sensitive(False)
         for fn in files:
-            fullfn = self._entry_map[fn].get_filename()
+            fullfn = self._entry_map[fn]
             cmd = "qt.plot(qt.Data(%r), name=%r, style=%r, coorddim=%r, valdim=%r, ofs=%r, traceofs=%r, clear=%r, ret=False)" % (fullfn, name, style, coorddim, valdim, ofs, traceofs, clear);
             qt.interpreter.cmd(cmd, callback=lambda x: self._plot2d_button.set_sensitive(True))
 
@@ -248,7 +251,7 @@ class DataWindow(qtwindow.QTWindow):
 
         self._plot3d_button.set_sensitive(False)
         for fn in files:
-            fullfn = self._entry_map[fn].get_filename()
+            fullfn = self._entry_map[fn]
             cmd = "qt.plot3(qt.Data(%r), name=%r, style=%r, coorddim=%r, valdim=%r, ofs=%r, traceofs=%r, clear=%r, ret=False)" % (fullfn, name, style, coorddims, valdim, ofs, traceofs, clear);
             qt.interpreter.cmd(cmd, callback=lambda x: self._plot3d_button.set_sensitive(True))
 
@@ -30,7 +30,7 @@ import qtclient as qt
 
 class QTInstrumentFrame(gtk.VBox):
 
-    def __init__(self, ins, show_range, show_rate, **kwargs):
+    def __init__(self, ins, show_range, show_rate, options=None, **kwargs):
         gtk.VBox.__init__(self, **kwargs)
 
         self._label = gtk.Label()
@@ -62,7 +62,7 @@ class QTInstrumentFrame(gtk.VBox):
         # For formatting
         self._parameter_options = {}
 
-        self._add_parameters()
+        self._add_parameters(options)
 
         ins.connect('parameter-added', self._parameter_added_cb)
         ins.connect('parameter-changed', self._parameter_changed_cb)
@@ -76,11 +76,12 @@ class QTInstrumentFrame(gtk.VBox):
         # Update variables twice per second
         gobject.timeout_add(500, self._do_update_parameters_timer)
 
-    def _add_parameter_by_name(self, param):
+    def _add_parameter_by_name(self, param, popts=None):
         if param in self._label_name:
             return
 
-        popts = self._instrument.get_shared_parameter_options(param)
+        if popts is None:
+            popts = self._instrument.get_shared_parameter_options(param)
         self._parameter_options[param] = popts
         nrows = self._table.props.n_rows
         self._table.resize(nrows + 1, 5)
@@ -97,7 +98,7 @@ class QTInstrumentFrame(gtk.VBox):
         self._table.attach(plabel, 1, 2, nrows, nrows + 1)
 
         vlabel = gtk.Label()
-        val = self._instrument.get(param, query=False)
+        val = popts.get('value', None)
         self._cur_val[param] = val
         vlabel.set_markup('<b>%s</b>' % \
                 qt.format_parameter_value(self._parameter_options[param], val))
@@ -112,7 +113,7 @@ class QTInstrumentFrame(gtk.VBox):
         self._label_val[param] = vlabel
 
     def _add_range_info(self, param, rownum):
-        text = self._instrument.format_range(param)
+        text = qt.format_parameter_range(self._parameter_options[param])
         rlabel = gtk.Label(text)
         rlabel.set_justify(gtk.JUSTIFY_LEFT)
         rlabel.show()
@@ -121,7 +122,7 @@ class QTInstrumentFrame(gtk.VBox):
         self._label_range[param] = rlabel
 
     def _add_rate_info(self, param, rownum):
-        text = self._instrument.format_rate(param)
+        text = qt.format_parameter_rate(self._parameter_options[param])
         rlabel = gtk.Label(text)
         rlabel.set_justify(gtk.JUSTIFY_LEFT)
         rlabel.show()
@@ -129,11 +130,18 @@ class QTInstrumentFrame(gtk.VBox):
 
         self._label_rate[param] = rlabel
 
-    def _add_parameters(self):
-        parameters = self._instrument.get_parameter_names()
+    def _add_parameters(self, options=None):
+        '''
+        Add all parameters. 'options' is the parameter name -> options
+        dictionary as returned by Instrument.snapshot(options=True).
+        '''
+
+        if options is None:
+            options = self._instrument.snapshot(options=True)
+        parameters = options.keys()
         parameters.sort()
         for param in parameters:
-            self._add_parameter_by_name(param)
+            self._add_parameter_by_name(param, options[param])
 
         self.show()
 
@@ -228,9 +236,10 @@ class QTInstrumentFrame(gtk.VBox):
         if param not in self._label_range:
             return False
 
-        self._label_range[param].set_text(self._instrument.format_range(param))
-        self._label_rate[param].set_text(self._instrument.format_rate(param))
-        self._parameter_options[param] = self._instrument.get_shared_parameter_options(param)
+        popts = self._instrument.get_shared_parameter_options(param)
+        self._parameter_options[param] = popts
+        self._label_range[param].set_text(qt.format_parameter_range(popts))
+        self._label_rate[param].set_text(qt.format_parameter_rate(popts))
         self.update_parameter(param, self._instrument.get(param), force=True)
 
     def show_table(self, show):
@@ -307,11 +316,12 @@ class InstrumentWindow(qtwindow.QTWindow):
         self._rate_toggle.emit('toggled')
         self.add(self._outer_vbox)
 
-    def _add_instrument(self, ins):
+    def _add_instrument(self, ins, options=None):
         name = ins.get_name()
         self._ins_widgets[name] = QTInstrumentFrame(ins,
             self._range_toggle.get_active(),
-            self._rate_toggle.get_active())
+            self._rate_toggle.get_active(),
+            options=options)
         self._vbox.pack_start(self._ins_widgets[name], False, False)
 
     def _remove_instrument(self, insname):
@@ -326,9 +336,12 @@ class InstrumentWindow(qtwindow.QTWindow):
                 self._ins_widgets[insname].update_parameter(param, val)
 
     def _add_instruments(self):
-        for name in self._instruments.get_instrument_names():
+        snapshot = self._instruments.snapshot(options=True)
+        names = snapshot.keys()
+        names.sort()
+        for name in names:
             ins = qt.get_instrument_proxy(name)
-            self._add_instrument(ins)
+            self._add_instrument(ins, snapshot[name])
 
     def _delete_event_cb(self, widget, event, data=None):
         self.hide()
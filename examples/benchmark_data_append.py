@@ -0,0 +1,29 @@
+# Benchmark for adding points to an in-memory Data object.
+#
+# Adds N points one at a time and prints the time needed for every block of
+# N / 10 points. With amortized storage these times should stay constant,
+# i.e. the total time grows linearly with the number of points.
+
+import qt
+import time
+
+N = int(1e6)
+NREPORT = 10
+
+d = qt.Data(name='append_benchmark', inmem=True, infile=False)
+d.add_coordinate('x')
+d.add_value('y')
+
+start = time.time()
+last = start
+for i in xrange(N):
+    d.add_data_point(i, 0.5 * i)
+    if (i + 1) % (N / NREPORT) == 0:
+        now = time.time()
+        print '%8d points: %.03f sec (block %.03f sec)' % \
+                (i + 1, now - start, now - last)
+        last = now
+
+print 'Total: %.03f sec, %.02f us / point' % \
+        (time.time() - start, (time.time() - start) / N * 1e6)
+print 'Data shape: %r' % (d.get_data().shape, )
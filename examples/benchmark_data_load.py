@@ -0,0 +1,47 @@
+# Benchmark for loading data files.
+#
+# Writes a 2D sweep to a temporary data file and compares loading it with
+# the line-by-line parser and the bulk parser.
+
+import qt
+import os
+import time
+import numpy
+
+NX = 1000
+NY = 1000
+
+x, y = numpy.meshgrid(numpy.arange(NX), numpy.arange(NY))
+z = numpy.random.rand(NY, NX)
+arr = numpy.column_stack((y.ravel(), x.ravel(), z.ravel()))
+
+fn = os.path.join(qt.config['tempdir'], 'benchmark_data_load.dat')
+d = qt.Data(name='load_benchmark')
+d.add_coordinate('y')
+d.add_coordinate('x')
+d.add_value('z')
+d.create_file(filepath=fn, settings_file=False)
+for i in range(NY):
+    d.add_data_point(arr[i*NX:(i+1)*NX])
+    d.new_block()
+d.close_file()
+print 'File size: %.01f MB' % (os.path.getsize(fn) / 1e6, )
+
+d = qt.Data(fn, inmem=False)
+
+start = time.time()
+d._load_file(fast=False)
+t_lines = time.time() - start
+data_lines = d.get_data()
+blocks_lines = d._block_sizes
+print 'Line by line: %.03f sec' % t_lines
+
+start = time.time()
+d._load_file(fast=True)
+t_fast = time.time() - start
+print 'Bulk: %.03f sec (%.01fx faster)' % (t_fast, t_lines / t_fast)
+
+print 'Same data: %s, same blocks: %s' % \
+        (numpy.all(d.get_data() == data_lines), d._block_sizes == blocks_lines)
+
+os.remove(fn)
@@ -0,0 +1,42 @@
+# Benchmark for decimating long traces for plotting.
+#
+# Run from the qtlab directory:
+#   python examples/benchmark_decimate.py
+#
+# Adds a trace of N points with a few narrow peaks to a MinMaxPyramid in
+# chunks, then reduces the complete trace and a zoomed range to NBINS
+# pixel columns and checks that the peaks are still there.
+
+import os
+import sys
+import time
+import numpy
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'source'))
+from lib.decimate import MinMaxPyramid
+
+N = int(1e7)
+NCHUNK = int(1e5)
+NBINS = 1000
+
+y = numpy.random.randn(N)
+peaks = numpy.random.randint(0, N, 10)
+y[peaks] = 100
+x = numpy.arange(N) * 1e-3
+
+pyramid = MinMaxPyramid()
+start = time.time()
+for i in xrange(0, N, NCHUNK):
+    pyramid.append(x[i:i+NCHUNK], y[i:i+NCHUNK])
+print 'Append %d points: %.03f sec, %d levels' % \
+        (N, time.time() - start, pyramid.get_nlevels())
+
+start = time.time()
+xd, yd = pyramid.decimate(NBINS)
+print 'Decimate full trace: %.02f ms, %d points, %d peaks found' % \
+        ((time.time() - start) * 1e3, len(xd), numpy.sum(yd == 100))
+
+start = time.time()
+xd, yd = pyramid.decimate(NBINS, N / 3, N / 2)
+print 'Decimate zoomed range: %.02f ms, %d points' % \
+        ((time.time() - start) * 1e3, len(xd))
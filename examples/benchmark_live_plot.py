@@ -0,0 +1,48 @@
+# Benchmark for live plot updates of a growing data file.
+#
+# Writes NTOTAL points to a data file in chunks and updates a plot after
+# each chunk, both by letting gnuplot read the complete file and in
+# incremental mode (only the last maxpoints window sent as inline data).
+# The time of an update includes waiting until gnuplot is responding
+# again, i.e. until it finished drawing.
+
+import qt
+import os
+import time
+import numpy
+from plot_engines.qtgnuplot import get_gnuplot
+
+NTOTAL = int(5e6)
+NCHUNKS = 10
+
+def run(incremental):
+    fn = os.path.join(qt.config['tempdir'], 'benchmark_live_plot.dat')
+    d = qt.Data(name='live_plot_benchmark')
+    d.add_coordinate('x')
+    d.add_value('y')
+    d.create_file(filepath=fn, settings_file=False)
+
+    p = qt.Plot2D(d, name='live_plot_benchmark', incremental=incremental,
+            maxpoints=10000, update=False)
+    gnuplot = get_gnuplot('live_plot_benchmark')
+
+    n = NTOTAL / NCHUNKS
+    for i in range(NCHUNKS):
+        x = numpy.arange(i * n, (i + 1) * n)
+        d.add_data_point(numpy.column_stack((x, numpy.sin(x * 1e-4))))
+        d.flush()
+
+        gnuplot.flush_output()
+        start = time.time()
+        p.update()
+        gnuplot.cmd('print 0', retoutput=True, timeout=60)
+        print '%-11s %8d points, %6.01f MB: update %.03f sec' % \
+                (incremental and 'incremental' or 'full file',
+                d.get_npoints(), os.path.getsize(fn) / 1e6,
+                time.time() - start)
+
+    d.close_file()
+    qt.plots.remove('live_plot_benchmark')
+
+run(False)
+run(True)
@@ -0,0 +1,108 @@
+# Benchmark for the timing jitter of a measurement loop while remote
+# clients are busy.
+#
+# Run from the qtlab directory:
+#   python examples/benchmark_network_jitter.py
+#
+# For both network backends ('gtk' and 'thread', see
+# config['network_backend']) a sharing server is started in a separate
+# process. It runs a measurement loop with a fixed period, handling main
+# loop events between the steps like qt.msleep() does, while 5 client
+# processes continuously request small values and 1 MB arrays from it.
+# Prints how late the steps of the measurement loop were.
+
+import os
+import sys
+import time
+import subprocess
+import logging
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'source'))
+from lib.network import object_sharer as objsh
+import numpy
+
+PORT = objsh.PORT + 11
+NCLIENTS = 5
+PERIOD = 0.01
+NSTEPS = 1000
+ARRAY_SIZE = int(1e6)
+
+class DataServer(objsh.SharedObject):
+
+    def __init__(self):
+        objsh.SharedObject.__init__(self, 'data_server')
+        self._array = numpy.ones(ARRAY_SIZE / 8, dtype=numpy.float64)
+
+    def get_value(self):
+        return 1.0
+
+    def get_array(self):
+        return self._array
+
+def get_backend(name):
+    if name == 'thread':
+        from lib.network import share_thread
+        return share_thread
+    else:
+        from lib.network import share_gtk
+        return share_gtk
+
+def run_events(tend):
+    '''Handle main loop events until time tend, like qt.msleep().'''
+    import gobject
+    ctx = gobject.main_context_default()
+    while True:
+        while ctx.pending() and time.time() < tend:
+            ctx.iteration(False)
+        dt = tend - time.time()
+        if dt <= 0:
+            return
+        time.sleep(min(dt, 0.001))
+
+def run_server(backend):
+    objsh.root.set_instance_name('jitter_server')
+    DataServer()
+    get_backend(backend).start_server('localhost', port=PORT)
+
+    # Wait for the clients to connect
+    run_events(time.time() + 3)
+
+    lates = []
+    tstart = time.time()
+    for i in xrange(NSTEPS):
+        tstep = tstart + i * PERIOD
+        lates.append(time.time() - tstep)
+        run_events(tstep + PERIOD)
+
+    lates = numpy.array(lates) * 1000
+    print '%-6s: %d clients, late by mean %.02f ms, std %.02f ms, 99%% %.02f ms, max %.02f ms' % \
+            (backend, len(objsh.helper.get_clients()), lates.mean(),
+            lates.std(), numpy.percentile(lates, 99), lates.max())
+
+def run_client():
+    from lib.network import share_gtk
+    client = share_gtk.start_client('localhost', port=PORT, nretry=5)
+    info = client.get_object_info('data_server')
+    srv = objsh.ObjectProxy(client.get_connection(), info)
+    while True:
+        for i in xrange(10):
+            srv.get_value()
+        if srv.get_array(timeout=10) is None:
+            # Server finished
+            break
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    if '--server' in sys.argv:
+        run_server(sys.argv[-1])
+    elif '--client' in sys.argv:
+        run_client()
+    else:
+        for backend in ('gtk', 'thread'):
+            srv = subprocess.Popen([sys.executable, __file__, '--server', backend])
+            time.sleep(1)
+            clients = [subprocess.Popen([sys.executable, __file__, '--client']) \
+                    for i in range(NCLIENTS)]
+            srv.wait()
+            for c in clients:
+                c.terminate()
@@ -0,0 +1,104 @@
+# Benchmark for transferring numpy arrays with the object sharer.
+#
+# Run from the qtlab directory:
+#   python examples/benchmark_object_sharer.py
+#
+# Starts a sharing server in a separate process on localhost and measures
+# the time to receive arrays of 1 MB and 100 MB from it and to send them to
+# it. Large arrays are sent as raw buffers when both sides support it.
+#
+# Also measures the round-trip latency of small calls, both blocking and
+# pipelined with call_async().
+
+import os
+import sys
+import time
+import subprocess
+import logging
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'source'))
+from lib.network import object_sharer as objsh
+from lib.network import share_gtk
+import numpy
+
+PORT = objsh.PORT + 10
+SIZES_MB = (1, 100)
+NREPEAT = 3
+NCALLS = 2000
+
+class ArrayServer(objsh.SharedObject):
+
+    def __init__(self):
+        objsh.SharedObject.__init__(self, 'array_server')
+
+    def get_array(self, nbytes):
+        return numpy.ones(nbytes / 8, dtype=numpy.float64)
+
+    def put_array(self, arr):
+        return arr.nbytes
+
+    def ping(self):
+        return 1
+
+def run_server():
+    import gobject
+    objsh.root.set_instance_name('benchmark_server')
+    ArrayServer()
+    share_gtk.start_server('localhost', port=PORT)
+    gobject.MainLoop().run()
+
+def run_client():
+    srv = subprocess.Popen([sys.executable, __file__, '--server'])
+    try:
+        time.sleep(1)
+        client = share_gtk.start_client('localhost', port=PORT, nretry=5)
+        conn = client.get_connection()
+        print 'Pickle protocol %d, raw buffers: %s' % \
+                (objsh.helper._protocols.get(conn, 0),
+                objsh.helper._raw_buffers.get(conn, False))
+
+        arrsrv = objsh.helper.find_object('benchmark_server:array_server')
+
+        start = time.time()
+        for i in xrange(NCALLS):
+            arrsrv.ping()
+        t = time.time() - start
+        print 'Blocking calls: %.01f us / call' % (t / NCALLS * 1e6, )
+
+        start = time.time()
+        calls = [arrsrv.ping.call_async() for i in xrange(NCALLS)]
+        for c in calls:
+            c.result()
+        t = time.time() - start
+        print 'Pipelined calls: %.01f us / call' % (t / NCALLS * 1e6, )
+
+        for mb in SIZES_MB:
+            nbytes = int(mb * 1e6)
+            arr = numpy.ones(nbytes / 8, dtype=numpy.float64)
+
+            best_get = best_put = None
+            for i in range(NREPEAT):
+                start = time.time()
+                arrsrv.get_array(nbytes, timeout=600)
+                t = time.time() - start
+                if best_get is None or t < best_get:
+                    best_get = t
+
+                start = time.time()
+                arrsrv.put_array(arr, timeout=600)
+                t = time.time() - start
+                if best_put is None or t < best_put:
+                    best_put = t
+
+            print '%4d MB: receive %.03f sec (%.01f MB/s), send %.03f sec (%.01f MB/s)' % \
+                    (mb, best_get, mb / best_get, best_put, mb / best_put)
+
+    finally:
+        srv.terminate()
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    if '--server' in sys.argv:
+        run_server()
+    else:
+        run_client()
@@ -0,0 +1,88 @@
+# Stress test for reassembling object sharer packets.
+#
+# Run from the qtlab directory:
+#   python examples/benchmark_packet_reader.py
+#
+# Sends 500 MB of packets with mixed sizes (from a few bytes to 50 MB, some
+# with raw buffers) through a local socket pair and reassembles them with a
+# PacketReader. Prints the throughput and the peak memory use; the increase
+# while receiving should stay a small multiple of the largest packet.
+
+import os
+import sys
+import time
+import math
+import random
+import socket
+import struct
+import threading
+
+sys.path.insert(0, os.path.join(os.getcwd(), 'source'))
+from lib.network import object_sharer as objsh
+
+TOTAL = 500e6
+MAXSIZE = 50e6
+
+def make_packets():
+    packets = []
+    total = 0
+    random.seed(0)
+    while total < TOTAL:
+        # log-uniform distribution between 10 bytes and MAXSIZE
+        size = int(10 ** random.uniform(1, math.log10(MAXSIZE)))
+        body = 'x' * size
+        if random.random() < 0.2:
+            buf = 'y' * size
+            hdr = 'QB' + struct.pack('>IIQ', len(body), 1, len(buf))
+            packets.append((hdr + body, buf))
+            total += 2 * size
+        else:
+            hdr = 'QT' + struct.pack('>I', len(body))
+            packets.append((hdr + body, None))
+            total += size
+    return packets, total
+
+def writer(sock, packets):
+    for data, buf in packets:
+        sock.sendall(data)
+        if buf is not None:
+            sock.sendall(buf)
+    sock.close()
+
+def get_peak_memory():
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    except ImportError:
+        return None
+
+if __name__ == '__main__':
+    packets, total = make_packets()
+    print 'Sending %d packets, %.01f MB' % (len(packets), total / 1e6)
+    mem_start = get_peak_memory()
+
+    a, b = socket.socketpair()
+    t = threading.Thread(target=writer, args=(a, packets))
+    t.start()
+
+    reader = objsh.PacketReader()
+    npackets = 0
+    nbytes = 0
+    start = time.time()
+    while True:
+        ret = reader.receive(b)
+        if ret is None:
+            break
+        for data, buffers in ret:
+            npackets += 1
+            nbytes += len(data) + sum([len(buf) for buf in buffers])
+    t.join()
+    duration = time.time() - start
+
+    print 'Received %d packets, %.01f MB in %.03f sec (%.01f MB/s)' % \
+            (npackets, nbytes / 1e6, duration, nbytes / 1e6 / duration)
+    if npackets != len(packets) or nbytes != total:
+        print 'ERROR: data lost'
+    if mem_start is not None:
+        print 'Peak memory: %.01f MB (%.01f MB before receiving)' % \
+                (get_peak_memory(), mem_start)
@@ -81,3 +81,23 @@ print dat['/my_data/lab air pressure']
 print dat['/my_data/overnight lab volume increase']
 
 dat.close()
+
+
+### Streaming data during a measurement, in the same way as with qtlab Data
+### objects. Points are appended to chunked, resizable data sets.
+dat = h5.HDF5Data(name='data_number_three')
+grp = dat.create_streaming_group('sweep', chunk_size=1024,
+        compression='gzip', flush_interval=1.0)
+grp.add_coordinate('x', unit='V')
+grp.add_coordinate('y', unit='V')
+grp.add_value('current', unit='A')
+
+for x in np.linspace(0, 1, 11):
+    for y in np.linspace(0, 1, 101):
+        grp.add_data_point(x, y, x * y)
+    grp.new_block()
+
+print dat['/sweep/current']
+print dat['/sweep/block_sizes'].value
+
+dat.close()
@@ -1,32 +1,48 @@
-# Script to test overhead of QTLab framework
+# Benchmark for the overhead of the QTLab Instrument framework.
+#
+# Compares calling the driver function directly (ins._ins.do_get_wave())
+# with the get_/set_ wrapper functions created by add_parameter. The
+# wrappers use precompiled getter / setter closures; the target is an
+# overhead of at most 2x the raw driver call for get_wave(fast=True).
 
 import qt
 import time
 
 ins = qt.instruments['dsgen']
-N = 1e6
+N = int(1e6)
+NREPEAT = 3
+TARGET = 2.0
 
-start = time.time()
-i = 0
-while i < N:
-    v = ins._ins.do_get_wave()
-    i += 1
-stop = time.time()
-print 'do_get_wave: %s sec' % (stop - start, )
+def timeit(func, *args, **kwargs):
+    '''Return the best time out of NREPEAT runs of N calls to func.'''
+    best = None
+    for j in xrange(NREPEAT):
+        start = time.time()
+        for i in xrange(N):
+            func(*args, **kwargs)
+        t = time.time() - start
+        if best is None or t < best:
+            best = t
+    return best
 
-start = time.time()
-i = 0
-while i < N:
-    v = ins.get_wave(fast=True)
-    i += 1
-stop = time.time()
-print 'get_wave(fast=True): %s sec' % (stop - start, )
+def report(name, t, ref):
+    print '%-28s %.03f sec, %.03f us / call, %.02fx' % \
+            (name, t, t / N * 1e6, t / ref)
 
-start = time.time()
-i = 0
-while i < N:
-    v = ins.get_wave()
-    i += 1
-stop = time.time()
-print 'get_wave: %s sec' % (stop - start, )
+t_raw = timeit(ins._ins.do_get_wave)
+report('do_get_wave()', t_raw, t_raw)
+t_fast = timeit(ins.get_wave, fast=True)
+report('get_wave(fast=True)', t_fast, t_raw)
+report('get_wave()', timeit(ins.get_wave), t_raw)
+report('get_wave(query=False)', timeit(ins.get_wave, query=False), t_raw)
 
+t_rawset = timeit(ins._ins.do_set_amplitude, 1.0)
+report('do_set_amplitude(1.0)', t_rawset, t_rawset)
+report('set_amplitude(1.0, fast=True)',
+        timeit(ins.set_amplitude, 1.0, fast=True), t_rawset)
+report('set_amplitude(1.0)', timeit(ins.set_amplitude, 1.0), t_rawset)
+
+if t_fast / t_raw <= TARGET:
+    print 'get overhead within target (%.01fx)' % TARGET
+else:
+    print 'get overhead above target (%.01fx)' % TARGET
@@ -37,8 +37,13 @@ from lib.network import object_sharer as objsh
 iname = _cfg.get('instance_name', '')
 objsh.root.set_instance_name(iname)
 print 'Setting instance name to %s' % iname
-from lib.network import share_gtk
-share_gtk.start_server('localhost', port=_cfg.get('port', objsh.PORT))
+for _signame, _interval in _cfg.get('signal_rate_limits', {}).iteritems():
+    objsh.helper.set_signal_rate_limit(_signame, _interval)
+if _cfg.get('network_backend', 'gtk') == 'thread':
+    from lib.network import share_thread as _share
+else:
+    from lib.network import share_gtk as _share
+_share.start_server('localhost', port=_cfg.get('port', objsh.PORT))
 for _ipaddr in _cfg['allowed_ips']:
     objsh.SharedObject.server.add_allowed_ip(_ipaddr)
 objsh.PythonInterpreter('python_server', globals())
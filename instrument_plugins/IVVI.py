@@ -175,12 +175,10 @@ class IVVI(Instrument):
             None
         '''
         logging.info('Get all')
-        for i in range(self._numdacs):
-            self.get('dac%d' % (i+1))
+        self.get(['dac%d' % (i+1) for i in range(self._numdacs)])
 
     def set_dacs_zero(self):
-        for i in range(self._numdacs):
-            self.set('dac%d' % (i+1), 0)
+        self.set(dict([('dac%d' % (i+1), 0) for i in range(self._numdacs)]))
 
     # Conversion of data
     def _mvoltage_to_bytes(self, mvoltage):
@@ -236,11 +234,48 @@ class IVVI(Instrument):
             reply (string) : errormessage
         '''
         logging.debug('Setting dac%s to %.02f mV', channel, mvoltage)
-        (DataH, DataL) = self._mvoltage_to_bytes(mvoltage - self.pol_num[channel-1])
-        message = "%c%c%c%c%c%c%c" % (7, 0, 2, 1, channel, DataH, DataL)
+        message = self._set_dac_message(mvoltage, channel)
         reply = self._send_and_read(message)
         return reply
 
+    def do_get_dac_many(self, channels):
+        '''
+        Returns the values of the specified dacs, using a single read
+
+        Input:
+            channels (int[]) : 1 based indices of the dacs
+
+        Output:
+            voltages (float[]) : dacvalues in mV
+        '''
+        logging.debug('Reading dacs %s', channels)
+        mvoltages = self._get_dacs()
+        return [mvoltages[ch - 1] for ch in channels]
+
+    def do_set_dac_many(self, mvoltages, channels):
+        '''
+        Sets the specified dacs to the specified voltages. All messages
+        are written at once, after which the replies are read.
+
+        Input:
+            mvoltages (float[]) : output voltages in mV
+            channels (int[])    : 1 based indices of the dacs
+
+        Output:
+            replies (list) : replies for each dac
+        '''
+        logging.debug('Setting dacs %s to %s mV', channels, mvoltages)
+        messages = [self._set_dac_message(mv, ch) \
+                for mv, ch in zip(mvoltages, channels)]
+        return self._send_and_read_many(messages)
+
+    def _set_dac_message(self, mvoltage, channel):
+        '''
+        Returns the message to set dac <channel> to <mvoltage>
+        '''
+        (DataH, DataL) = self._mvoltage_to_bytes(mvoltage - self.pol_num[channel-1])
+        return "%c%c%c%c%c%c%c" % (7, 0, 2, 1, channel, DataH, DataL)
+
     def _get_dacs(self):
         '''
         Reads from device and returns all dacvoltages in a list
@@ -281,6 +316,31 @@ class IVVI(Instrument):
 #            logging.error('Failed to receive reply from IVVI rack')
 #            return False
 
+        return self._read_reply()
+
+    def _send_and_read_many(self, messages):
+        '''
+        Send a list of messages to the device in a single write and read
+        the answers.
+
+        Input:
+            messages (string[]) : strings conform the IVVI protocol
+
+        Output:
+            replies (int[][]) : return messages
+        '''
+        logging.debug('Sending %r', messages)
+
+        visafunc.read_all(self._vi)
+        vpp43.write(self._vi, ''.join(messages))
+        return [self._read_reply() for message in messages]
+
+    def _read_reply(self):
+        '''
+        Read one answer from the device.
+        Raises an error if one occurred
+        Returns a list of bytes
+        '''
         data1 = visafunc.readn(self._vi, 2)
         data1 = [ord(s) for s in data1]
 
@@ -85,9 +85,7 @@ class example(Instrument):
         self.set_status('off')
         self.set_speed('slow')
 
-        self.set_chA_output(0)
-        self.set_chB_output(0)
-        self.set_chC_output(0)
+        self.set({'chA_output': 0, 'chB_output': 0, 'chC_output': 0})
 
         self.set_gain(20)
 
@@ -100,14 +98,9 @@ class example(Instrument):
         self.get_status()
         self.get_speed()
 
-        self.get_input1()
-        self.get_input2()
-        self.get_input3()
-        self.get_input4()
-
-        self.get_chA_output()
-        self.get_chB_output()
-        self.get_chC_output()
+        # channels are read with a single call to do_get_<name>_many
+        self.get(['input1', 'input2', 'input3', 'input4'])
+        self.get(['chA_output', 'chB_output', 'chC_output'])
 
         self.get_gain()
 
@@ -145,6 +138,18 @@ class example(Instrument):
             val *= 2
         self._dummy_output[channel] = val
 
+    # bulk functions, used when several channels are accessed at once
+
+    def do_get_input_many(self, channels):
+        return [self._dummy_input[ch-1] for ch in channels]
+
+    def do_get_output_many(self, channels):
+        return [self._dummy_output[ch] for ch in channels]
+
+    def do_set_output_many(self, vals, channels, times2=False):
+        for val, ch in zip(vals, channels):
+            self.do_set_output(val, ch, times2=times2)
+
     def do_set_gain(self, val):
         self._dummy_gain = val
 
@@ -30,6 +30,10 @@ import shutil
 from gettext import gettext as _L
 
 from lib import namedlist, temp
+from lib.databuffer import DataBuffer, MappedDataBuffer
+from lib.file_support.datawriter import DataWriter
+from lib.file_support import datareader, datacache
+from lib.file_support.settingsfile import SettingsTracker, write_settings_file
 from lib.misc import dict_to_ordered_tuples, get_arg_type
 from lib.config import get_config
 config = get_config()
@@ -151,6 +155,14 @@ class _DataList(namedlist.NamedList):
         else:
             return name
 
+_settings_tracker = None
+
+def _get_settings_tracker():
+    global _settings_tracker
+    if _settings_tracker is None:
+        _settings_tracker = SettingsTracker(qt.instruments)
+    return _settings_tracker
+
 class Data(SharedGObject):
     '''
     Data class
@@ -200,16 +212,18 @@ class Data(SharedGObject):
         },
     }
 
+    # Attributes stored in the cache of a loaded data file
+    _CACHE_ATTRS = (
+        '_dimensions', '_comment', '_block_sizes',
+        '_ncoordinates', '_nvalues',
+        '_npoints_last_block', '_npoints_max_block',
+        '_loopdims', '_loopshape', '_complete',
+    )
+
     _META_STEPRE = re.compile('^#.*[ \t](\d+) steps', re.I)
     _META_COLRE = re.compile('^#.*Column ?(\d+)', re.I)
     _META_COMMENTRE = re.compile('^#(.*)', re.I)
 
-    _INT_TYPES = (
-            types.IntType, types.LongType,
-            numpy.int, numpy.int0, numpy.int8,
-            numpy.int16, numpy.int32, numpy.int64,
-    )
-
     def __init__(self, *args, **kwargs):
         '''
         Create data object. There are three different uses:
@@ -231,10 +245,23 @@ class Data(SharedGObject):
         kwargs input:
             name (string), default will be 'data<n>'
             infile (bool), default True
-            inmem (bool), default False if no file specified, True otherwise
+            inmem (bool or 'mmap'), default False if no file specified, True
+                otherwise. With 'mmap' new data points are stored in a
+                memory mapped temporary file, preallocated for the size of
+                the coordinates, instead of in memory.
             tempfile (bool), default False. If True create a temporary file
                 for the data.
             binary (bool), default True. Whether tempfile should be binary.
+            flush_lines (int), flush the data file after this many lines,
+                default is 'data_flush_lines' from config, or 1 if not
+                defined. None to only flush at new blocks / closing.
+            flush_interval (float), flush pending data lines after this
+                many seconds, default is 'data_flush_interval' from config.
+            cache (bool), whether to use a binary cache when loading a
+                file, default is 'data_cache' from config, or False. The
+                cache files are stored in 'data_cache_dir' from config, or
+                next to the data file if that is not defined. Default True
+                for inmem='mmap'.
         '''
 
         # Init SharedGObject a bit lower
@@ -244,11 +271,22 @@ class Data(SharedGObject):
         inmem = kwargs.get('inmem', False)
 
         self._inmem = inmem
+        self._mmap = (inmem == 'mmap')
+        self._mmap_file = None
         self._tempfile = kwargs.get('tempfile', False)
         self._temp_binary = kwargs.get('binary', True)
+        self._temp_dirty = False
         self._options = kwargs
         self._file = None
         self._stop_req_hid = None
+        self._data_buffer = None
+        self._writer = None
+        self._flush_lines = kwargs.get('flush_lines',
+                config.get('data_flush_lines', 1))
+        self._flush_interval = kwargs.get('flush_interval',
+                config.get('data_flush_interval'))
+        self._cache = kwargs.get('cache',
+                self._mmap or config.get('data_cache', False))
 
         # Dimension info
         self._dimensions = []
@@ -480,6 +518,13 @@ class Data(SharedGObject):
         return self._dir
 
     def get_filepath(self):
+        '''
+        Return the path of the data file. A temporary file is written
+        first if the data changed since it was last written.
+        '''
+
+        if self._tempfile and self._temp_dirty:
+            self.rewrite_tempfile()
         return os.path.join(self._dir, self._filename)
 
     def get_name(self):
@@ -503,6 +548,14 @@ class Data(SharedGObject):
         else:
             return False
 
+    def is_inmem(self):
+        '''Return whether the data is kept in memory.'''
+        return bool(self._inmem)
+
+    def is_tempfile(self):
+        '''Return whether the data is stored in a temporary file.'''
+        return self._tempfile
+
 ### Measurement info
 
     def add_coordinate(self, name, **kwargs):
@@ -605,6 +658,10 @@ class Data(SharedGObject):
         Close open data file.
         '''
 
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
         if self._file is not None:
             self._file.close()
             self._file = None
@@ -614,19 +671,22 @@ class Data(SharedGObject):
             self._stop_req_hid = None
 
     def _write_settings_file(self):
-        fn = self.get_settings_filepath()
-        f = open(fn, 'w+')
-        f.write('Filename: %s\n' % self._filename)
-        f.write('Timestamp: %s\n\n' % self._timestamp)
-
-        inslist = dict_to_ordered_tuples(qt.instruments.get_instruments())
-        for (iname, ins) in inslist:
-            f.write('Instrument: %s\n' % iname)
-            parlist = dict_to_ordered_tuples(ins.get_parameters())
-            for (param, popts) in parlist:
-                f.write('\t%s: %s\n' % (param, ins.get(param, query=False)))
+        '''
+        Write the settings file. config['settings_file_mode'] can be:
+        - 'direct' (default): get all parameter values from the instruments
+        - 'delta': write only the changes with respect to the last full
+          settings file, which is referred to by a relative path and
+          usually is in the directory of an earlier measurement
+        '''
 
-        f.close()
+        fn = self.get_settings_filepath()
+        mode = config.get('settings_file_mode', 'direct')
+        if mode == 'delta':
+            _get_settings_tracker().write(fn, self._filename,
+                    self._timestamp)
+        else:
+            write_settings_file(fn, self._filename, self._timestamp,
+                    qt.instruments.snapshot())
 
     def _write_header(self):
         self._file.write('# Filename: %s\n' % self._filename)
@@ -643,21 +703,18 @@ class Data(SharedGObject):
 
         self._file.write('\n')
 
-    def _format_data_value(self, val, colnum):
-        if type(val) in self._INT_TYPES:
-            return '%d' % val
-
-        if colnum < len(self._dimensions):
-            opts = self._dimensions[colnum]
-            if 'format' in opts:
-                return opts['format'] % val
-            elif 'precision' in opts:
-                format = '%%.%de' % opts['precision']
-                return format % val
+    def _get_writer(self):
+        '''
+        Return the DataWriter for the current file, creating it if the
+        file changed.
+        '''
 
-        precision = config.get('default_precision', 12)
-        format = '%%.%de' % precision
-        return format % val
+        if self._writer is None or self._writer.get_file() is not self._file:
+            self._writer = DataWriter(self._file, self._dimensions,
+                    precision=config.get('default_precision', 12),
+                    flush_lines=self._flush_lines,
+                    flush_interval=self._flush_interval)
+        return self._writer
 
     def _write_data_line(self, args):
         '''
@@ -665,25 +722,34 @@ class Data(SharedGObject):
         Args can be a single value or a 1d numpy.array / list / tuple.
         '''
 
-        if hasattr(args, '__len__'):
-            if len(args) > 0:
-                line = self._format_data_value(args[0], 0)
-                for colnum in range(1, len(args)):
-                    line += '\t%s' % \
-                            self._format_data_value(args[colnum], colnum)
-            else:
-                line = ''
-        else:
-            line = self._format_data_value(args, 0)
+        if self._file is None:
+            logging.info('File not opened yet, doing now')
+            self.create_file()
 
-        line += '\n'
+        self._get_writer().write_point(args)
+
+    def _write_data_lines(self, args):
+        '''
+        Write multiple lines of data.
+        Args should be a 2d numpy.array / list, or a 1d array for a single
+        column.
+        '''
 
         if self._file is None:
             logging.info('File not opened yet, doing now')
             self.create_file()
 
-        self._file.write(line)
-        self._file.flush()
+        self._get_writer().write_points(args)
+
+    def flush(self):
+        '''
+        Flush pending data lines to the data file and, for inmem='mmap',
+        changes in the mapped data to disk.
+        '''
+        if self._writer is not None:
+            self._writer.flush()
+        if isinstance(self._data_buffer, MappedDataBuffer):
+            self._data_buffer.flush()
 
     def _get_block_columns(self):
         blockcols = []
@@ -697,22 +763,63 @@ class Data(SharedGObject):
 
         return blockcols
 
+    def _get_block_starts(self):
+        '''
+        Find the blocks in the in-memory data from the coordinate columns
+        that only change value at the start of a block.
+
+        Output: (starts, nchanged), the row index where each block starts
+        (except the first) and the number of block columns that change
+        there.
+        '''
+
+        data = self._data
+        blockcols = self._get_block_columns()
+        cols = [i for i in range(len(blockcols)) if blockcols[i]]
+        if len(cols) > 0 and len(data) > 1:
+            nchanged = numpy.sum(data[1:, cols] != data[:-1, cols], axis=1)
+            starts = numpy.nonzero(nchanged)[0] + 1
+        else:
+            nchanged = numpy.array([], dtype=int)
+            starts = []
+        return starts, nchanged
+
+    def get_detected_block_sizes(self):
+        '''
+        Return the sizes of the blocks in the in-memory data, as they are
+        separated when writing it to a file. This also works for data set
+        with set_data() or update_data(), which does not keep track of
+        blocks.
+        '''
+
+        if not self._inmem or self._data.ndim != 2 or len(self._data) == 0:
+            return []
+        starts, nchanged = self._get_block_starts()
+        bounds = [0] + list(starts) + [len(self._data)]
+        return [bounds[i + 1] - bounds[i] for i in range(len(bounds) - 1)]
+
     def _write_data(self):
         if not self._inmem:
             logging.warning('Unable to _write_data() without having it memory')
             return False
 
-        blockcols = self._get_block_columns()
-
-        lastvals = None
-        for vals in self._data:
-            if type(vals) is numpy.ndarray and lastvals is not None:
-                for i in range(len(vals)):
-                    if blockcols[i] and vals[i] != lastvals[i]:
-                        self._file.write('\n')
+        data = self._data
+        writer = self._get_writer()
+        if data.ndim != 2:
+            writer.write_points(data)
+            writer.flush()
+            return True
 
-            self._write_data_line(vals)
-            lastvals = vals
+        # Insert a blank line for every block column that changes value
+        starts, nchanged = self._get_block_starts()
+        prev = 0
+        for start in starts:
+            writer.write_points(data[prev:start])
+            writer.write('\n' * int(nchanged[start - 1]))
+            prev = start
+        writer.write_points(data[prev:])
+        writer.flush()
+        return True
 
     def _write_binary(self):
         if not self._inmem:
@@ -738,24 +845,24 @@ class Data(SharedGObject):
     def create_tempfile(self, path=None):
         '''
         Create a temporary file, optionally called <path>.
+
+        The data is not written until the file is used, see get_filepath();
+        plot engines that read the data from memory never write it.
         '''
 
         if self._temp_binary:
             mode = 'wb'
         else:
             mode = 'w'
-        self._file = temp.File(path, mode=mode, binary=self._temp_binary)
         try:
-            if self._temp_binary:
-                ret = self._write_binary()
-            else:
-                self._write_data()
-
+            self._file = temp.File(path, mode=mode, binary=self._temp_binary)
             self._dir, self._filename = os.path.split(self._file.name)
             self._file.close()
             self._tempfile = True
+            self._temp_dirty = True
         except Exception, e:
             logging.warning('Error creating temporary file: %s', e)
+            self._file = None
             self._dir = ''
             self._filename = ''
             self._tempfile = False
@@ -769,11 +876,15 @@ class Data(SharedGObject):
             logging.warning('Data object has no temporary file to rewrite')
             return
 
-        self._file.reopen()
-        if self._temp_binary:
-            self._write_binary()
-        else:
-            self._write_data()
+        try:
+            self._file.reopen()
+            if self._temp_binary:
+                self._write_binary()
+            else:
+                self._write_data()
+            self._temp_dirty = False
+        except Exception, e:
+            logging.warning('Error writing temporary file: %s', e)
         self._file.close()
 
     def copy_file(self, fn):
@@ -878,17 +989,13 @@ class Data(SharedGObject):
         #   - a 1d tuple of numbers, for adding a single data point
         #   - a 2d tuple/list/array, for adding >1 data points
         if self._inmem:
-            if len(self._data) == 0:
-                self._data = numpy.atleast_2d(args)
-            else:
-                self._data = numpy.append(self._data, [args], axis=0)
+            self._append_data(numpy.reshape(args, (npoints, ncols)))
 
         if self._infile:
             if npoints == 1:
                 self._write_data_line(args)
             elif npoints > 1:
-                for i in range(npoints):
-                    self._write_data_line(args[i])
+                self._write_data_lines(args)
 
         self._npoints += npoints
         self._npoints_last_block += npoints
@@ -900,11 +1007,54 @@ class Data(SharedGObject):
         else:
             self.emit('new-data-point')
 
+    def _append_data(self, rows):
+        '''
+        Append rows to the in-memory data. The rows are stored in an
+        over-allocated buffer and self._data is a view on the filled part.
+        If self._data was replaced (e.g. by set_data()), a new buffer is
+        started from it.
+        '''
+
+        if self._data_buffer is None or \
+                not self._data_buffer.holds(self._data):
+            self._data_buffer = self._create_data_buffer()
+        self._data = self._data_buffer.append(rows)
+
+    def _get_expected_npoints(self):
+        '''
+        Return the number of points expected from the coordinate sizes,
+        or 0 if not all sizes are known.
+        '''
+
+        npoints = 1
+        for info in self.get_coordinates():
+            if info.get('size', 0) <= 0:
+                return 0
+            npoints *= info['size']
+        return npoints
+
+    def _create_data_buffer(self):
+        '''Create a buffer for new data, containing the current data.'''
+
+        if not self._mmap:
+            return DataBuffer(self._data)
+
+        # Use a new file so that views on an older buffer stay valid; the
+        # temporary file is removed when it is no longer referenced.
+        self._mmap_file = temp.File(mode='w+b')
+        self._mmap_file.close()
+
+        capacity = max(self._get_expected_npoints(), len(self._data))
+        buf = MappedDataBuffer(self._mmap_file.name, capacity)
+        if numpy.size(self._data) > 0:
+            buf.append(self._data)
+        return buf
+
     def new_block(self):
         '''Start a new data block.'''
 
         if self._infile:
-            self._file.write('\n')
+            self._get_writer().new_block()
 
         self._block_sizes.append(self._npoints_last_block)
         self._npoints_last_block = 0
@@ -931,6 +1081,9 @@ class Data(SharedGObject):
             self._ncoordinates = nfields - 1
             self._nvalues = 1
 
+        if self._writer is not None:
+            self._writer.set_dimensions(self._dimensions)
+
 ### Set array data
 
     def set_data(self, data):
@@ -985,11 +1138,12 @@ class Data(SharedGObject):
         '''
         Update this Data object with a new data set.
         No checks are performed on dimensions etc.
-        If the data is associated with a temporary file, it will be updated.
+        If the data is associated with a temporary file, it will be
+        rewritten when it is used next.
         '''
         self._data = data
         if self._tempfile:
-            self.rewrite_tempfile()
+            self._temp_dirty = True
 
 ### File reading
 
@@ -1005,28 +1159,127 @@ class Data(SharedGObject):
             self._nvalues = 1
             self._ncoordinates -= 1
 
-    def _load_file(self):
+    def _load_file(self, fast=True):
         """
         Load data from file and store internally.
+
+        If fast is True the numerical data is parsed in bulk, falling back
+        to parsing line by line if the file can not be handled that way.
+        If caching is enabled, a valid cache file is used instead of parsing
+        and a new one is written after parsing.
         """
 
+        if fast and self._cache and self._load_cache():
+            return True
+
         try:
             f = file(self.get_filepath(), 'r')
         except:
             logging.warning('Unable to open file %s' % self.get_filepath())
             return False
 
+        try:
+            ret = False
+            if fast:
+                try:
+                    ret = self._load_file_fast(f)
+                except Exception, e:
+                    logging.warning('Fast loading failed: %s', e)
+                if not ret:
+                    logging.info('Parsing file %s line by line',
+                            self.get_filepath())
+                    f.seek(0)
+
+            if not ret:
+                ret = self._load_file_lines(f)
+        finally:
+            f.close()
+
+        if ret and self._cache:
+            self._save_cache()
+
+        return ret
+
+    def _load_cache(self):
+        ret = datacache.load(self.get_filepath(),
+                config.get('data_cache_dir'))
+        if ret is None:
+            return False
+
+        data, meta = ret
+        self._reset_loaded_info()
+        for attr in self._CACHE_ATTRS:
+            setattr(self, attr, meta[attr])
+
+        self._data = data
+        self._npoints = len(self._data)
+        self._inmem = True
+        logging.debug('Loaded %s from cache', self.get_filepath())
+        return True
+
+    def _save_cache(self):
+        meta = {}
+        for attr in self._CACHE_ATTRS:
+            meta[attr] = getattr(self, attr)
+        return datacache.save(self.get_filepath(), self._data, meta,
+                config.get('data_cache_dir'))
+
+    def _reset_loaded_info(self):
         self._dimensions = []
         self._values = []
         self._comment = []
-        data = []
-        nfields = 0
-
         self._block_sizes = []
         self._npoints = 0
         self._npoints_last_block = 0
         self._npoints_max_block = 0
+        self._reshaped_data = None
+
+    def _set_loaded_data(self, data, nfields, blocksize):
+        self._add_missing_dimensions(nfields)
+        self._count_coord_val_dims()
+
+        self._data = data
+        self._npoints = len(self._data)
+        self._inmem = True
 
+        self._npoints_last_block = blocksize
+
+        try:
+            self._detect_dimensions_size()
+        except Exception, e:
+            logging.warning('Error while detecting dimension size')
+
+    def _load_file_fast(self, f):
+        """
+        Load data from open file f: parse the header line by line and the
+        data in bulk. Returns False if the file could not be parsed this way.
+        """
+
+        self._reset_loaded_info()
+        datareader.read_header(f, self._parse_meta_data)
+        ret = datareader.read_body(f)
+        if ret is None:
+            return False
+
+        data, self._block_sizes, blocksize = ret
+        if len(self._block_sizes) > 0:
+            self._npoints_max_block = max(self._block_sizes)
+
+        if len(data) > 0:
+            nfields = data.shape[1]
+        else:
+            nfields = 0
+        self._set_loaded_data(data, nfields, blocksize)
+        return True
+
+    def _load_file_lines(self, f):
+        """
+        Load data from open file f, parsing it line by line.
+        """
+
+        self._reset_loaded_info()
+        data = []
+        nfields = 0
         blocksize = 0
 
         for line in f:
@@ -1054,20 +1307,7 @@ class Data(SharedGObject):
                 data.append(fields)
                 blocksize += 1
 
-        self._add_missing_dimensions(nfields)
-        self._count_coord_val_dims()
-
-        self._data = numpy.array(data)
-        self._npoints = len(self._data)
-        self._inmem = True
-
-        self._npoints_last_block = blocksize
-
-        try:
-            self._detect_dimensions_size()
-        except Exception, e:
-            logging.warning('Error while detecting dimension size')
-
+        self._set_loaded_data(numpy.array(data), nfields, blocksize)
         return True
 
     def _type_added(self, name):
@@ -23,6 +23,8 @@ Module providing handling of HDF5 data within qtlab.
 Contains:
 - a data class (HDF5Data) which is essentially a wrapper of a h5py data
   object, adapted for usage with qtlab
+- a data group (StreamingDataGroup) to which data can be appended point by
+  point during a measurement, like a qtlab Data object
 - name generators in the style of qtlab Data objects
 - functions to create standard data sets
 """
@@ -70,7 +72,7 @@ class DataGroup(SharedGObject):
         self._folder = hdf5_data.get_folder()
 
         if self.name in self.h5d[base].keys():
-            self.group = self.h5d[base]
+            self.group = self.h5d[self.groupname]
         else:
             self.group = self.h5d.create_group(self.groupname)
 
@@ -84,8 +86,20 @@ class DataGroup(SharedGObject):
     def __setitem__(self, name, val):
         if name in self.group.keys():
 
+            # overwrite in place if the data fits in the existing data set
+            dset = self.group[name]
+            val = np.asarray(val)
+            if np.can_cast(val.dtype, dset.dtype):
+                if dset.shape == val.shape:
+                    dset[...] = val
+                    return True
+                elif _can_resize(dset, val.shape):
+                    dset.resize(val.shape)
+                    dset[...] = val
+                    return True
+
             # store old attributes
-            attrs = dict(self.group[name].attrs)
+            attrs = dict(dset.attrs)
 
             # delete and re-create; overwrite doesn't work with hdf5
             del self.group[name]
@@ -160,6 +174,211 @@ class DataGroup(SharedGObject):
         kwargs['group'] = self
         return loop2d_data(*args, **kwargs)
 
+class StreamingDataGroup(DataGroup):
+    '''
+    A data group to which data can be added during a measurement, in the
+    same way as to a qtlab Data object: define the columns with
+    add_coordinate() / add_value() and call add_data_point() and
+    new_block().
+
+    Every column is stored in a chunked, resizable one-dimensional data set.
+    Points are collected in memory and appended to the data sets in chunks
+    of 'chunk_size' points. The file is flushed at most every
+    'flush_interval' seconds, at every new block and when calling flush().
+    The sizes of the blocks are stored in the 'block_sizes' data set.
+
+    If the group already exists as a streaming data group, its columns are
+    taken from the file and new points are appended.
+
+    Groups created with HDF5Data.create_streaming_group() are flushed when
+    the file is closed; close other groups by calling flush() first.
+    '''
+
+    def __init__(self, name, hdf5_data, base='/', chunk_size=1024,
+            compression=None, compression_opts=None, flush_interval=1.0,
+            dtype=np.float64, **kw):
+        '''
+        Input:
+            name (string): name of the group
+            hdf5_data (HDF5Data): container
+            chunk_size (int): HDF5 chunk size and number of points to buffer
+            compression (string): HDF5 compression filter, e.g. 'gzip'
+            compression_opts: options for the compression filter
+            flush_interval (float): maximum time (in seconds) between
+                flushes of the file, None to only flush at new blocks
+            dtype: data type of the columns
+            kw: meta data
+        '''
+
+        DataGroup.__init__(self, name, hdf5_data, base=base, **kw)
+
+        self._hdf5_data = hdf5_data
+        self._chunk_size = chunk_size
+        self._compression = compression
+        self._compression_opts = compression_opts
+        self._flush_interval = flush_interval
+        self._dtype = dtype
+
+        self._columns = []
+        self._pending = []
+        self._npending = 0
+        self._npoints = 0
+        self._npoints_last_block = 0
+        self._last_flush = time.time()
+
+        if 'block_sizes' in self.group:
+            self._resume()
+        else:
+            self._block_sizes = self.group.create_dataset('block_sizes',
+                    shape=(0, ), maxshape=(None, ), dtype=np.int64,
+                    chunks=(256, ))
+            self._block_sizes.attrs['dim_type'] = 'meta'
+
+    def _resume(self):
+        '''Continue a streaming data group that already exists in the file.'''
+
+        self._block_sizes = self.group['block_sizes']
+        columns = []
+        for name, dset in self.group.iteritems():
+            if 'column' in dset.attrs:
+                columns.append((dset.attrs['column'], name))
+        columns.sort()
+        self._columns = [name for col, name in columns]
+
+        if len(self._columns) > 0:
+            self._npoints = self.group[self._columns[0]].shape[0]
+        self._npoints_last_block = self._npoints - \
+                int(np.sum(self._block_sizes[...]))
+
+    def __getitem__(self, name):
+        # Include the buffered points
+        self._write_pending()
+        return DataGroup.__getitem__(self, name)
+
+    def get_columns(self):
+        '''Return the names of the columns, in order.'''
+        return self._columns
+
+    def get_npoints(self):
+        '''Return the number of points added.'''
+        return self._npoints
+
+    def add_dimension(self, name, dim_type, data=None, **meta):
+        '''
+        Add a column to the data group. Extra keywords are added as meta
+        data. Initial data is not supported, use add_data_point().
+        '''
+
+        if data is not None:
+            logging.error('Initial data not supported for streaming groups')
+            return False
+        if self._npoints > 0:
+            logging.error('Unable to add column after adding data')
+            return False
+        if name in self.group.keys():
+            logging.error("Dimension '%s' already exists in data set '%s'" \
+                    % (name, self.name))
+            return False
+
+        dim = self.group.create_dataset(name, shape=(0, ), maxshape=(None, ),
+                dtype=self._dtype, chunks=(self._chunk_size, ),
+                compression=self._compression,
+                compression_opts=self._compression_opts)
+        dim.attrs['dim_type'] = dim_type
+        dim.attrs['column'] = len(self._columns)
+        for k in meta:
+            dim.attrs[k] = meta[k]
+
+        self._columns.append(name)
+        return True
+
+    def add_data_point(self, *args, **kwargs):
+        '''
+        Add new data point(s), see Data.add_data_point(). Provide either
+        one number per column, one 1d array per column or a single 2d
+        array.
+
+        kwargs:
+            newblock (bool): start a new block after these points
+        '''
+
+        ncols = len(self._columns)
+        if len(args) == 0:
+            logging.warning('add_data_point(): no data specified')
+            return
+        elif len(args) == 1:
+            rows = np.asarray(args[0], dtype=self._dtype)
+            if rows.ndim == 0 or (rows.ndim == 1 and ncols > 1):
+                rows = rows.reshape((1, -1))
+            elif rows.ndim == 1:
+                rows = rows.reshape((-1, 1))
+        else:
+            rows = np.column_stack([np.atleast_1d(np.asarray(a, \
+                    dtype=self._dtype)) for a in args])
+
+        if rows.ndim != 2 or rows.shape[1] != ncols:
+            logging.warning('add_data_point(): data does not match columns (%r, %d columns)' % \
+                    (rows.shape, ncols))
+            return
+
+        self._pending.append(rows)
+        self._npending += len(rows)
+        self._npoints += len(rows)
+        self._npoints_last_block += len(rows)
+
+        if kwargs.get('newblock', False):
+            self.new_block()
+            return
+
+        if self._npending >= self._chunk_size:
+            self._write_pending()
+        if self._flush_interval is not None and \
+                time.time() - self._last_flush >= self._flush_interval:
+            self.flush()
+
+    def _append(self, dset, data):
+        n = dset.shape[0]
+        dset.resize((n + len(data), ))
+        dset[n:] = data
+
+    def _write_pending(self):
+        '''Append the buffered points to the data sets.'''
+
+        if self._npending == 0:
+            return
+
+        if len(self._pending) == 1:
+            data = self._pending[0]
+        else:
+            data = np.concatenate(self._pending)
+        self._pending = []
+        self._npending = 0
+
+        for i, name in enumerate(self._columns):
+            self._append(self.group[name], data[:, i])
+
+    def new_block(self):
+        '''Start a new data block.'''
+        self._append(self._block_sizes, [self._npoints_last_block])
+        self._npoints_last_block = 0
+        self.flush()
+
+    def flush(self):
+        '''Write buffered points and flush the file.'''
+        self._write_pending()
+        self._hdf5_data.flush()
+        self._last_flush = time.time()
+
+def _can_resize(dset, shape):
+    '''Return whether data set dset can be resized to shape.'''
+
+    if dset.chunks is None or len(dset.maxshape) != len(shape):
+        return False
+    for maxsize, size in zip(dset.maxshape, shape):
+        if maxsize is not None and maxsize < size:
+            return False
+    return True
+
 class HDF5Data:
 
     _data_list = data.Data._data_list
@@ -179,6 +398,9 @@ class HDF5Data:
         name = data.Data._data_list.new_item_name(self, name)
         self._name = name
 
+        # Streaming groups to flush when closing the file
+        self._streaming_groups = []
+
         filepath = kwargs.get('filepath, None')
         if filepath:
             self._filepath = filepath
@@ -223,10 +445,20 @@ class HDF5Data:
         '''Create a DataGroup object.'''
         return DataGroup(name, self, **kwargs)
 
+    def create_streaming_group(self, name, **kwargs):
+        '''Create a StreamingDataGroup object.'''
+        group = StreamingDataGroup(name, self, **kwargs)
+        self._streaming_groups.append(group)
+        return group
+
     def flush(self):
         self._file.flush()
 
     def close(self):
+        '''Write the buffered points of all streaming groups and close.'''
+        for group in self._streaming_groups:
+            group.flush()
+        self._streaming_groups = []
         self._file.close()
 
 def loop1d_data(xs, ynames=('ys', ), name='data', xname='xs', data=None, group=None):
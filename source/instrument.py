@@ -23,6 +23,7 @@ import math
 import inspect
 from gettext import gettext as _L
 from lib import calltimer
+from lib.ramp import get_ramp_engine, Ramp, RampHandle
 from lib.network.object_sharer import SharedGObject, cache_result
 
 import numpy as np
@@ -100,7 +101,11 @@ class Instrument(SharedGObject):
             self._options['tags'] = []
 
         self._parameters = {}
+        self._static_options = {}
         self._parameter_groups = {}
+        self._getters = {}
+        self._checkers = {}
+        self._setters = {}
         self._functions = {}
         self._added_methods = []
         self._probe_ids = []
@@ -115,6 +120,10 @@ class Instrument(SharedGObject):
             self._access_lock = calltimer.TimedLock(2.0)
             self._lock_classes[self._lock_class] = self._access_lock
 
+        self._ramp_engine = get_ramp_engine()
+        # Keep the GUI responsive while waiting for a ramp
+        self._ramp_engine.set_idle_func(qt.msleep)
+
     def __str__(self):
         return "Instrument '%s'" % (self.get_name())
 
@@ -195,6 +204,7 @@ class Instrument(SharedGObject):
         Output: None
         '''
 
+        self.abort_ramps()
         self._remove_parameters()
         self.emit('removed', self.get_name())
 
@@ -256,6 +266,12 @@ class Instrument(SharedGObject):
                     parameter. Useful for a parameter that depends on one
                     (or more) other parameters.
 
+        For parameters with channels the driver can implement
+        'do_get_<name>_many(channels)', returning a list of values, and
+        'do_set_<name>_many(values, channels)'. These are used when several
+        channels are requested in one get() or set() call, so that they can
+        be handled in a single instrument transaction.
+
         Output: None
         '''
 
@@ -299,22 +315,12 @@ class Instrument(SharedGObject):
             return
 
         self._parameters[name] = options
-
-        if 'channel' in options:
-            ch = options['channel']
-        else:
-            ch = None
+        self._static_options.pop(name, None)
 
         base_name = kwargs.get('base_name', name)
 
         if options['flags'] & Instrument.FLAG_GET:
-            if ch is not None:
-                func = lambda query=True, **lopts: \
-                    self.get(name, query=query, channel=ch, **lopts)
-            else:
-                func = lambda query=True, **lopts: \
-                    self.get(name, query=query, **lopts)
-
+            func = self._make_get_method(name)
             self._add_options_to_doc(options)
             func.__doc__ = 'Get variable %s' % name
             if 'doc' in options:
@@ -336,23 +342,22 @@ class Instrument(SharedGObject):
                     self._get_not_implemented(base_name)
                 self._get_not_implemented(base_name)
 
+            # Bulk function do_get_%s_many for channels, if available
+            if 'channel' in options and 'get_many_func' not in options:
+                many_func = getattr(self, 'do_get_%s_many' % base_name, \
+                    getattr(self, '_do_get_%s_many' % base_name, None))
+                if many_func is not None:
+                    options['get_many_func'] = many_func
+
         if options['flags'] & Instrument.FLAG_SOFTGET:
-            if ch is not None:
-                func = lambda query=True, **lopts: \
-                    self.get(name, query=False, channel=ch, **lopts)
-            else:
-                func = lambda query=True, **lopts: \
-                    self.get(name, query=False, **lopts)
+            func = self._make_get_method(name, query=False)
 
             func.__doc__ = 'Get variable %s (internal stored value)' % name
             setattr(self, 'get_%s' % name,  func)
             self._added_methods.append('get_%s' % name)
 
         if options['flags'] & Instrument.FLAG_SET:
-            if ch is not None:
-                func = lambda val, **lopts: self.set(name, val, channel=ch, **lopts)
-            else:
-                func = lambda val, **lopts: self.set(name, val, **lopts)
+            func = self._make_set_method(name)
 
             func.__doc__ = 'Set variable %s' % name
             if 'doc' in options:
@@ -373,6 +378,13 @@ class Instrument(SharedGObject):
                     self._set_not_implemented(base_name)
                 self._set_not_implemented(base_name)
 
+            # Bulk function do_set_%s_many for channels, if available
+            if 'channel' in options and 'set_many_func' not in options:
+                many_func = getattr(self, 'do_set_%s_many' % base_name, \
+                    getattr(self, '_do_set_%s_many' % base_name, None))
+                if many_func is not None:
+                    options['set_many_func'] = many_func
+
 #        setattr(self, name,
 #            property(lambda: self.get(name), lambda x: self.set(name, x)))
 
@@ -382,6 +394,8 @@ class Instrument(SharedGObject):
         else:
             options['value'] = None
 
+        self._compile_parameter(name)
+
         if 'probe_interval' in options:
             interval = int(options['probe_interval'])
             self._probe_ids.append(gobject.timeout_add(interval,
@@ -416,6 +430,10 @@ class Instrument(SharedGObject):
                 if hasattr(self, fname):
                     delattr(self, fname)
         self._parameters = {}
+        self._static_options = {}
+        self._getters = {}
+        self._checkers = {}
+        self._setters = {}
 
     def remove_parameter(self, name):
         if name not in self._parameters:
@@ -426,6 +444,10 @@ class Instrument(SharedGObject):
                 delattr(self, func)
 
         del self._parameters[name]
+        self._static_options.pop(name, None)
+        del self._getters[name]
+        del self._checkers[name]
+        del self._setters[name]
         self.emit('parameter-removed', name)
 
     def has_parameter(self, name):
@@ -438,14 +460,36 @@ class Instrument(SharedGObject):
         '''
         Return list of options for paramter.
 
+        The options are compiled into the get and set functions of the
+        parameter, so a copy is returned; use set_parameter_options() to
+        change them.
+
         Input: name (string)
         Output: dictionary of options
         '''
         if self._parameters.has_key(name):
-            return self._parameters[name]
+            return dict(self._parameters[name])
         else:
             return None
 
+    def _get_static_parameter_options(self, name):
+        '''
+        Return the shareable options of a parameter, except 'value'. They
+        are kept until the parameter options change.
+        '''
+
+        options = self._static_options.get(name, None)
+        if options is None:
+            options = dict(self._parameters[name])
+            for i in ('get_func', 'set_func', 'get_many_func',
+                    'set_many_func', 'value'):
+                if i in options:
+                    del options[i]
+            if 'type' in options and options['type'] is types.NoneType:
+                options['type'] = None
+            self._static_options[name] = options
+        return options
+
     def get_shared_parameter_options(self, name):
         '''
         Return list of options for paramter.
@@ -454,19 +498,18 @@ class Instrument(SharedGObject):
         Output: dictionary of options
         '''
         if self._parameters.has_key(name):
-            options = dict(self._parameters[name])
-            for i in ('get_func', 'set_func'):
-                if i in options:
-                    del options[i]
-            if 'type' in options and options['type'] is types.NoneType:
-                options['type'] = None
+            options = copy.deepcopy(self._get_static_parameter_options(name))
+            if 'value' in self._parameters[name]:
+                options['value'] = self._parameters[name]['value']
             return options
         else:
             return None
 
     def set_parameter_options(self, name, **kwargs):
         '''
-        Change parameter options.
+        Change parameter options. The get and set functions of the
+        parameter are compiled again, which is required for changed
+        options to take effect.
 
         Input:  name of parameter (string)
         Ouput:  None
@@ -477,6 +520,8 @@ class Instrument(SharedGObject):
 
         for key, val in kwargs.iteritems():
             self._parameters[name][key] = val
+        self._static_options.pop(name, None)
+        self._compile_parameter(name)
 
         self.emit('parameter-changed', name)
 
@@ -506,6 +551,7 @@ class Instrument(SharedGObject):
             return
 
         self._parameters[name]['tags'].append(tag)
+        self._static_options.pop(name, None)
 
     def set_parameter_bounds(self, name, minval, maxval):
         '''
@@ -549,6 +595,7 @@ class Instrument(SharedGObject):
         '''
         self.set_parameter_options(name, maxstep=stepsize, stepdelay=stepdelay)
 
+    @cache_result(invalidate=('parameter-added', 'parameter-removed'))
     def get_parameter_names(self):
         '''
         Returns a list of parameter names.
@@ -580,6 +627,26 @@ class Instrument(SharedGObject):
             params[key] = self.get_shared_parameter_options(key)
         return params
 
+    def snapshot(self, options=False):
+        '''
+        Return the stored values of all parameters, without querying the
+        instrument.
+
+        Input:
+            options (bool): if True return the shared parameter options
+                (including 'value') instead of only the values
+        Output: dictionary of parameter name -> value or options
+        '''
+
+        ret = {}
+        if options:
+            for name in self._parameters:
+                ret[name] = self.get_shared_parameter_options(name)
+        else:
+            for name, getter in self._getters.iteritems():
+                ret[name] = getter(False)
+        return ret
+
     def get_parameter_groups(self):
         '''
         Return a dictionary with parameter group name -> group members.
@@ -670,6 +737,130 @@ class Instrument(SharedGObject):
 
         return text
 
+    _GET_CAST_MAP = {
+            types.IntType: int,
+            types.FloatType: float,
+            types.BooleanType: bool,
+            np.ndarray: np.array,
+    }
+
+    def _compile_parameter(self, name):
+        '''
+        (Re)build the getter and setter closures for parameter 'name'.
+
+        The closures have the parameter options (type, flags, bounds,
+        channel etc.) bound as local variables, so that a get or set does
+        not need to look them up again. They should be rebuilt whenever the
+        options change, which set_parameter_options() does.
+        '''
+
+        p = self._parameters[name]
+        self._getters[name] = self._compile_getter(name, p)
+        self._checkers[name], self._setters[name] = \
+                self._compile_setter(name, p)
+
+    def _make_get_method(self, name, query=True):
+        '''
+        Create the get_<name> function. Plain calls go directly to the
+        compiled getter; calls with extra options or when the access lock
+        is in use go through get().
+        '''
+
+        getters = self._getters
+        if query:
+            def get_func(query=True, fast=False, **lopts):
+                if lopts or Instrument.USE_ACCESS_LOCK:
+                    return self.get(name, query=query, fast=fast, **lopts)
+                value = getters[name](query)
+                if query and not fast:
+                    self._queue_changed({name: value})
+                return value
+        else:
+            def get_func(query=True, fast=False, **lopts):
+                if lopts or Instrument.USE_ACCESS_LOCK:
+                    return self.get(name, query=False, fast=fast, **lopts)
+                return getters[name](False)
+
+        return get_func
+
+    def _make_set_method(self, name):
+        '''
+        Create the set_<name> function. Plain calls go directly to the
+        compiled setter; calls with extra options, on a locked instrument
+        or when the access lock is in use go through set().
+        '''
+
+        setters = self._setters
+        def set_func(val, fast=False, **lopts):
+            if lopts or self._locked or Instrument.USE_ACCESS_LOCK:
+                return self.set(name, val, fast=fast, **lopts)
+            ramps = []
+            value = setters[name](val, _ramps=ramps)
+            if len(ramps) > 0:
+                # The ramp emits 'changed' when it is finished
+                self._ramp_engine.wait(ramps)
+                ramps[0].raise_error()
+                return ramps[0].get_state() == Ramp.STATE_DONE
+            if value is None:
+                return False
+            if not fast:
+                self._queue_changed({name: value})
+            return True
+
+        return set_func
+
+    def _compile_getter(self, name, p):
+        '''
+        Return a function getter(query=True, **kwargs) for parameter 'name',
+        specialized on the options in 'p'.
+        '''
+
+        flags = p['flags']
+        ch = p.get('channel', None)
+        ptype = p.get('type', None)
+        is_array = (ptype == np.ndarray)
+
+        def get_stored():
+            value = p.get('value', None)
+            if is_array and value is not None:
+                return np.array(value)
+            return value
+
+        if flags & Instrument.FLAG_SOFTGET:
+            def getter(query=True, **kwargs):
+                return get_stored()
+            return getter
+
+        if not flags & Instrument.FLAG_GET:
+            def getter(query=True, **kwargs):
+                if not query:
+                    return get_stored()
+                print 'Instrument does not support getting of %s' % name
+                return None
+            return getter
+
+        func = p['get_func']
+        cast = self._GET_CAST_MAP.get(ptype, None)
+
+        def getter(query=True, **kwargs):
+            if not query:
+                return get_stored()
+
+            if ch is not None and 'channel' not in kwargs:
+                kwargs['channel'] = ch
+            value = func(**kwargs)
+            if cast is not None and value is not None:
+                try:
+                    value = cast(value)
+                except:
+                    logging.warning('Unable to cast value "%s" to %s',
+                            value, ptype)
+
+            p['value'] = value
+            return value
+
+        return getter
+
     def _get_value(self, name, query=True, **kwargs):
         '''
         Private wrapper function to get a value.
@@ -681,56 +872,12 @@ class Instrument(SharedGObject):
         '''
 
         try:
-            p = self._parameters[name]
+            getter = self._getters[name]
         except:
             print 'Could not retrieve options for parameter %s' % name
             return None
 
-        if 'channel' in p and 'channel' not in kwargs:
-            kwargs['channel'] = p['channel']
-
-        flags = p['flags']
-        if not query or flags & 8: #self.FLAG_SOFTGET:
-            if 'value' in p:
-                if p['type'] == np.ndarray:
-                    return np.array(p['value'])
-                else:
-                    return p['value']
-            else:
-#                logging.debug('Trying to access cached value, but none available')
-                return None
-
-        # Check this here; getting of cached values should work
-        if not flags & 1: #Instrument.FLAG_GET:
-            print 'Instrument does not support getting of %s' % name
-            return None
-
-        if 'base_name' in p:
-            base_name = p['base_name']
-        else:
-            base_name = name
-
-        func = p['get_func']
-        value = func(**kwargs)
-        if 'type' in p and value is not None:
-            try:
-                if p['type'] == types.IntType:
-                    value = int(value)
-                elif p['type'] == types.FloatType:
-                    value = float(value)
-                elif p['type'] == types.StringType:
-                    pass
-                elif p['type'] == types.BooleanType:
-                    value = bool(value)
-                elif p['type'] == types.NoneType:
-                    pass
-                elif p['type'] == np.ndarray:
-                    value = np.array(value)
-            except:
-                logging.warning('Unable to cast value "%s" to %s', value, p['type'])
-
-        p['value'] = value
-        return value
+        return getter(query, **kwargs)
 
     def get(self, name, query=True, fast=False, **kwargs):
         '''
@@ -760,13 +907,18 @@ class Instrument(SharedGObject):
             return ret
 
         if type(name) in (types.ListType, types.TupleType):
-            changed = {}
+            groups = []
+            if query and 'channel' not in kwargs:
+                groups, name = self._group_parameters(name, 'get_many_func')
+
             result = {}
             for key in name:
                 val = self._get_value(key, query, **kwargs)
                 if val is not None:
                     result[key] = val
-                    changed[key] = val
+            for names in groups:
+                result.update(self._get_values_many(names, **kwargs))
+            changed = dict(result)
 
         else:
             result = self._get_value(name, query, **kwargs)
@@ -877,111 +1029,361 @@ class Instrument(SharedGObject):
 
         return value
 
-    def _set_value(self, name, value, **kwargs):
+    def _compile_setter(self, name, p):
         '''
-        Private wrapper function to set a value.
+        Return functions check(value) and setter(value, **kwargs) for
+        parameter 'name', specialized on the options in 'p'.
 
-        Input:  (1) name of parameter (string)
-                (2) value of parameter (whatever type the parameter supports).
-                    Type casting is performed if necessary.
-                (3) Optional keyword args that will be passed on.
-        Output: Value returned by the _do_set_<name> function,
-                or result of get in FLAG_GET_AFTER_SET specified.
+        check() validates and converts a value, setter() also sends it to
+        the instrument. Both return the new value, or None on failure.
         '''
-        if self._parameters.has_key(name):
-            p = self._parameters[name]
-        else:
-            return None
 
-        if not p['flags'] & Instrument.FLAG_SET:
-            print 'Instrument does not support setting of %s' % name
-            return None
+        flags = p['flags']
+        if not flags & Instrument.FLAG_SET:
+            def setter(value, **kwargs):
+                print 'Instrument does not support setting of %s' % name
+                return None
+            return setter, setter
+
+        ch = p.get('channel', None)
+        format_map = p.get('format_map', None)
+        option_list = p.get('option_list', None)
+        has_type = 'type' in p
+        ptype = p.get('type', None)
+        convert = self._CONVERT_MAP.get(ptype, None)
+        check_bool = (ptype is not types.BooleanType)
+        has_minval = 'minval' in p
+        minval = p.get('minval', None)
+        has_maxval = 'maxval' in p
+        maxval = p.get('maxval', None)
+        maxstep = p.get('maxstep', None)
+        stepdelay = p.get('stepdelay', 50)
+        need_done = flags & (Instrument.FLAG_GET_AFTER_SET | \
+                Instrument.FLAG_PERSIST)
+        func = p['set_func']
 
-        if 'channel' in p and 'channel' not in kwargs:
-            kwargs['channel'] = p['channel']
-
-        # If a format map is available the key should be found.
-        if 'format_map' in p:
-            newval = self._val_from_option_dict(p['format_map'], value)
-            if newval is None:
-                logging.error('Value %s is not a valid option for "%s", valid options: %r',
-                    value, name, repr(p['format_map']))
-                return
-            value = newval
-
-        # If an option list is available check whether the value is in there
-        if 'option_list' in p:
-            newval = self._val_from_option_list(p['option_list'], value)
-            if newval is None:
-                logging.error('Value %s is not a valid option for "%s", valid: %r',
-                    value, name, repr(p['option_list']))
-                return
-            value = newval
-
-        if 'type' in p:
-            try:
-                value = self._convert_value(value, p['type'])
-            except:
+        def check(value):
+            # If a format map is available the key should be found.
+            if format_map is not None:
+                newval = self._val_from_option_dict(format_map, value)
+                if newval is None:
+                    logging.error('Value %s is not a valid option for "%s", valid options: %r',
+                        value, name, repr(format_map))
+                    return
+                value = newval
+
+            # If an option list is available check whether the value is in there
+            if option_list is not None:
+                newval = self._val_from_option_list(option_list, value)
+                if newval is None:
+                    logging.error('Value %s is not a valid option for "%s", valid: %r',
+                        value, name, repr(option_list))
+                    return
+                value = newval
+
+            if has_type:
+                if convert is None or \
+                        (check_bool and type(value) is types.BooleanType):
+                    # Let _convert_value report the problem
+                    try:
+                        value = self._convert_value(value, ptype)
+                    except:
+                        return None
+                else:
+                    try:
+                        value = convert(value)
+                    except:
+                        logging.warning('Conversion of %r to type %s failed',
+                                value, ptype)
+                        return None
+
+            if has_minval and value < minval:
+                print 'Trying to set too small value: %s' % value
                 return None
 
-        if 'minval' in p and value < p['minval']:
-            print 'Trying to set too small value: %s' % value
-            return None
+            if has_maxval and value > maxval:
+                print 'Trying to set too large value: %s' % value
+                return None
 
-        if 'maxval' in p and value > p['maxval']:
-            print 'Trying to set too large value: %s' % value
-            return None
+            return value
 
-        if 'base_name' in p:
-            base_name = p['base_name']
-        else:
-            base_name = name
+        def setter(value, _ramps=None, **kwargs):
+            value = check(value)
+            if value is None:
+                return None
 
-        func = p['set_func']
-        if 'maxstep' in p and p['maxstep'] is not None:
-            curval = p['value']
-            if curval is None:
-                logging.warning('Current value not available, ignoring maxstep')
-                curval = value + 0.01 * p['maxstep']
-
-            delta = curval - value
-            if delta < 0:
-                sign = 1
-            else:
-                sign = -1
+            if ch is not None and 'channel' not in kwargs:
+                kwargs['channel'] = ch
 
-            if 'stepdelay' in p:
-                delay = p['stepdelay']
+            if maxstep is not None:
+                steps = self._get_steps(p['value'], value, maxstep)
+                if len(steps) > 1:
+                    return self._ramp_to_value(name, func, value, steps,
+                            stepdelay, kwargs, _ramps)
+                for val in steps:
+                    func(val, **kwargs)
             else:
-                delay = 50
+                func(value, **kwargs)
 
-            while math.fabs(delta) > 0:
-                if math.fabs(delta) > p['maxstep']:
-                    curval += sign * p['maxstep']
-                    delta += sign * p['maxstep']
-                else:
-                    curval = value
-                    delta = 0
+            if need_done:
+                return self._set_value_done(name, value, **kwargs)
+            p['value'] = value
+            return value
+
+        return check, setter
+
+    def _get_steps(self, curval, value, maxstep):
+        '''
+        Return the list of values to go from 'curval' to 'value' in steps
+        of at most 'maxstep'. The last item is 'value'.
+        '''
 
-                ret = func(curval, **kwargs)
+        if curval is None:
+            logging.warning('Current value not available, ignoring maxstep')
+            return [value]
 
-                if delta != 0:
-                    time.sleep(delay / 1000.0)
+        nsteps = int(math.ceil(math.fabs(value - curval) / maxstep))
+        if nsteps == 0:
+            return []
+        elif nsteps == 1:
+            return [value]
 
+        if value > curval:
+            sign = 1
         else:
-            ret = func(value, **kwargs)
+            sign = -1
+        steps = [curval + sign * i * maxstep for i in xrange(1, nsteps)]
+        steps.append(value)
+        return steps
+
+    def _ramp_to_value(self, name, func, value, steps, delay, kwargs,
+            ramps=None):
+        '''
+        Ramp parameter 'name' through 'steps' to 'value' using the ramp
+        engine, calling 'func' for each step with 'delay' ms in between.
+
+        If 'ramps' is a list the Ramp is appended to it and 'value' is
+        returned immediately. Otherwise wait for the ramp to finish and
+        return the new value, or None if the ramp was aborted or failed.
+        '''
 
+        p = self._parameters[name]
+
+        def step(val):
+            func(val, **kwargs)
+            p['value'] = val
+
+        def done(ramp):
+            if ramp.get_state() == Ramp.STATE_DONE:
+                self._set_value_done(name, value, **kwargs)
+            self._queue_changed({name: p['value']})
+
+        ramp = self._ramp_engine.add([(self._name, name)], step, steps,
+                delay, done)
+        if ramps is not None:
+            ramps.append(ramp)
+            return value
+
+        self._ramp_engine.wait([ramp])
+        ramp.raise_error()
+        if ramp.get_state() != Ramp.STATE_DONE:
+            return None
+        return p['value']
+
+    def abort_ramps(self):
+        '''
+        Abort all running ramps of this instrument. The parameters keep
+        the value of the last step.
+
+        Input: None
+        Output: None
+        '''
+
+        for ramp in self._ramp_engine.get_ramps():
+            for insname, name in ramp.get_keys():
+                if insname == self._name:
+                    self._ramp_engine.abort(ramp)
+                    break
+
+    def is_ramping(self, name):
+        '''
+        Return whether parameter 'name' is being ramped.
+        '''
+        return self._ramp_engine.is_ramping((self._name, name))
+
+    def _set_value_done(self, name, value, **kwargs):
+        '''
+        Finish setting parameter 'name' to 'value' after the driver
+        function was called: perform a get if FLAG_GET_AFTER_SET is
+        specified, store the value in the config file if FLAG_PERSIST is
+        specified and remember the value.
+        '''
+
+        p = self._parameters[name]
         if p['flags'] & self.FLAG_GET_AFTER_SET:
             value = self._get_value(name, **kwargs)
 
         if p['flags'] & self.FLAG_PERSIST:
-            config.set('persist_%s_%s' % (self._name, name), value)
-            config.save()
+            config.persist('persist_%s_%s' % (self._name, name), value)
 
         p['value'] = value
         return value
 
-    def set(self, name, value=None, fast=False, **kwargs):
+    def _group_parameters(self, names, funckey):
+        '''
+        Split parameter names in groups of channels that can be handled
+        with a single call of the bulk function stored under 'funckey'
+        ('get_many_func' or 'set_many_func').
+
+        Output: (list of lists of names, list of remaining names)
+        '''
+
+        groups = {}
+        for name in names:
+            p = self._parameters.get(name, None)
+            if p is None or p.get(funckey, None) is None or \
+                    'channel' not in p:
+                continue
+            if funckey == 'get_many_func' and \
+                    (p['flags'] & Instrument.FLAG_SOFTGET or \
+                    not p['flags'] & Instrument.FLAG_GET):
+                continue
+            key = (p.get('base_name', name), p[funckey])
+            groups.setdefault(key, []).append(name)
+
+        groups = [group for group in groups.values() if len(group) > 1]
+        grouped = set([name for group in groups for name in group])
+        rest = [name for name in names if name not in grouped]
+        return groups, rest
+
+    def _get_values_many(self, names, **kwargs):
+        '''
+        Get the channels 'names' of one parameter using its bulk function.
+
+        Output: dictionary of name -> value, without None values
+        '''
+
+        params = [self._parameters[name] for name in names]
+        func = params[0]['get_many_func']
+        values = func([p['channel'] for p in params], **kwargs)
+
+        result = {}
+        for name, p, value in zip(names, params, values):
+            cast = self._GET_CAST_MAP.get(p['type'], None)
+            if cast is not None and value is not None:
+                try:
+                    value = cast(value)
+                except:
+                    logging.warning('Unable to cast value "%s" to %s',
+                            value, p['type'])
+            p['value'] = value
+            if value is not None:
+                result[name] = value
+
+        return result
+
+    def _set_values_many(self, names, values, _ramps=None, **kwargs):
+        '''
+        Set the channels 'names' of one parameter to 'values' using its
+        bulk function. When ramping with maxstep, all channels are
+        stepped together in a single ramp.
+
+        If '_ramps' is a list, a ramp is appended to it and not waited for.
+
+        Output: dictionary of name -> new value (None if failed)
+        '''
+
+        result = {}
+        todo = []
+        for name, value in zip(names, values):
+            value = self._checkers[name](value)
+            if value is None:
+                result[name] = None
+            else:
+                todo.append((name, value))
+        if len(todo) == 0:
+            return result
+
+        func = self._parameters[todo[0][0]]['set_many_func']
+        delay = 0
+        steplist = []
+        for name, value in todo:
+            p = self._parameters[name]
+            if p.get('maxstep', None) is not None:
+                steps = self._get_steps(p['value'], value, p['maxstep'])
+                delay = max(delay, p.get('stepdelay', 50))
+            else:
+                steps = [value]
+            steplist.append((name, p, steps))
+
+        # Per step a tuple (values, channels, parameter options)
+        nsteps = max([len(steps) for name, p, steps in steplist])
+        allsteps = []
+        for i in xrange(nsteps):
+            items = [(steps[i], p) for name, p, steps in steplist \
+                    if i < len(steps)]
+            allsteps.append(([val for val, p in items],
+                    [p['channel'] for val, p in items],
+                    [p for val, p in items]))
+
+        def step(item):
+            vals, channels, params = item
+            func(vals, channels, **kwargs)
+            for val, p in zip(vals, params):
+                p['value'] = val
+
+        def done(ramp=None):
+            ok = (ramp is None or ramp.get_state() == Ramp.STATE_DONE)
+            for name, value in todo:
+                chkwargs = dict(kwargs)
+                chkwargs['channel'] = self._parameters[name]['channel']
+                if ok:
+                    result[name] = self._set_value_done(name, value,
+                            **chkwargs)
+                else:
+                    result[name] = None
+            if ramp is not None:
+                self._queue_changed(dict([(name, self._parameters[name]['value']) \
+                        for name, value in todo]))
+
+        if nsteps <= 1:
+            for item in allsteps:
+                step(item)
+            done()
+            return result
+
+        ramp = self._ramp_engine.add([(self._name, name) for name, v in todo],
+                step, allsteps, delay, done)
+        if _ramps is not None:
+            _ramps.append(ramp)
+            for name, value in todo:
+                result[name] = value
+            return result
+
+        self._ramp_engine.wait([ramp])
+        ramp.raise_error()
+        return result
+
+    def _set_value(self, name, value, **kwargs):
+        '''
+        Private wrapper function to set a value.
+
+        Input:  (1) name of parameter (string)
+                (2) value of parameter (whatever type the parameter supports).
+                    Type casting is performed if necessary.
+                (3) Optional keyword args that will be passed on.
+        Output: Value returned by the _do_set_<name> function,
+                or result of get in FLAG_GET_AFTER_SET specified.
+        '''
+
+        if name in self._setters:
+            setter = self._setters[name]
+        else:
+            return None
+
+        return setter(value, **kwargs)
+
+    def set(self, name, value=None, fast=False, wait=True, **kwargs):
         '''
         Set one or more Instrument parameter values.
 
@@ -994,10 +1396,16 @@ class Instrument(SharedGObject):
             value (any): the value to set
             fast (bool): if True perform as fast as possible, e.g. don't
                 emit a signal to update the GUI.
+            wait (bool): if False, do not wait for parameters with a
+                maxstep to finish ramping, but return a RampHandle.
             kwargs: Optional keyword args that will be passed on.
 
         Output: True or False whether the operation succeeded.
                 For multiple sets return False if any of the parameters failed.
+                With wait=False a RampHandle, which can be used to wait for
+                or abort the ramps, or False if setting failed.
+
+        Several parameters in a dictionary are ramped at the same time.
         '''
 
         if self._locked:
@@ -1012,16 +1420,31 @@ class Instrument(SharedGObject):
 
         result = True
         changed = {}
+        ramps = []
         if type(name) == types.DictType:
-            for key, val in name.iteritems():
-                val = self._set_value(key, val, **kwargs)
+            groups = []
+            keys = name.keys()
+            if 'channel' not in kwargs:
+                groups, keys = self._group_parameters(keys, 'set_many_func')
+
+            for key in keys:
+                val = self._set_value(key, name[key], _ramps=ramps, **kwargs)
                 if val is not None:
                     changed[key] = val
                 else:
                     result = False
 
+            for names in groups:
+                vals = self._set_values_many(names,
+                        [name[key] for key in names], _ramps=ramps, **kwargs)
+                for key, val in vals.iteritems():
+                    if val is not None:
+                        changed[key] = val
+                    else:
+                        result = False
+
         else:
-            val = self._set_value(name, value, **kwargs)
+            val = self._set_value(name, value, _ramps=ramps, **kwargs)
             if val is not None:
                 changed[name] = val
             else:
@@ -1030,10 +1453,24 @@ class Instrument(SharedGObject):
         if Instrument.USE_ACCESS_LOCK:
             self._access_lock.release()
 
+        # Ramped parameters emit a change when the ramp is finished
+        for ramp in ramps:
+            for insname, key in ramp.get_keys():
+                if key in changed:
+                    del changed[key]
+
         if not fast and len(changed) > 0:
             self._queue_changed(changed)
 
-        return result
+        handle = RampHandle(self._ramp_engine, ramps)
+        if not wait:
+            if not result:
+                return False
+            return handle
+
+        handle.wait()
+        handle.raise_error()
+        return result and handle.succeeded()
 
     def update_value(self, name, value):
         '''
@@ -1142,6 +1579,18 @@ class Instrument(SharedGObject):
         '''
         self._locked = False
 
+    def get_lock_stats(self):
+        '''
+        Return the statistics of the access lock, which is shared by all
+        instruments in the same lock class. Shows how often and how long
+        threads (measurement, get_threaded calls, probe timers) had to wait
+        for each other.
+
+        Input: None
+        Output: dictionary, see calltimer.TimedLock.get_stats()
+        '''
+        return self._access_lock.get_stats()
+
     def set_default_read_var(self, name):
         '''
         For future use.
@@ -25,7 +25,7 @@ import sys
 import instrument
 from lib.config import get_config
 from insproxy import Proxy
-from lib.network.object_sharer import SharedGObject
+from lib.network.object_sharer import SharedGObject, cache_result
 
 from lib.misc import get_traceback
 TB = get_traceback()()
@@ -170,6 +170,7 @@ class Instruments(SharedGObject):
         else:
             return None
 
+    @cache_result(invalidate=('instrument-added', 'instrument-removed'))
     def get_instrument_names(self):
         keys = self._instruments.keys()
         keys.sort()
@@ -181,6 +182,23 @@ class Instruments(SharedGObject):
         '''
         return self._instruments
 
+    def snapshot(self, options=False):
+        '''
+        Return the stored parameter values of all instruments in one
+        structure, without querying the instruments.
+
+        Input:
+            options (bool): if True return the shared parameter options
+                (including 'value') instead of only the values
+        Output: dictionary of instrument name -> Instrument.snapshot()
+        '''
+
+        ret = {}
+        for name, ins in self._instruments.iteritems():
+            ret[name] = ins.snapshot(options=options)
+        return ret
+
+    @cache_result(ttl=10)
     def get_types(self):
         '''
         Return list of supported instrument types
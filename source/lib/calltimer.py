@@ -49,20 +49,147 @@ class GObjectThread(threading.Thread, ThreadSafeGObject):
         self.stop = ThreadVariable(False)
 
 class TimedLock():
+    '''
+    Lock with a timeout on acquire.
+
+    An uncontended acquire only tries the underlying lock. A thread that
+    has to wait blocks until release() hands the lock over to it (in
+    order of arrival), or until a timer expires; there is no polling.
+
+    Wait times are recorded per thread name, see get_stats().
+    '''
+
     def __init__(self, delay=1.0):
         self._lock = threading.Lock()
         self._delay = delay
 
-    def acquire(self):
-        n = int(self._delay / 0.01)
-        for i in range(n):
-            if self._lock.acquire(False):
-                return True
-            time.sleep(0.01)
-        return False
+        # Protects the waiter list and the statistics
+        self._state_lock = threading.Lock()
+        self._waiters = []
+
+        # Successful acquires, only changed by the thread holding the lock.
+        # reset_stats() sets the base instead of clearing the count.
+        self._nacquire = 0
+        self._nacquire_base = 0
+        self._stats = {}
+
+    def acquire(self, timeout=None):
+        '''
+        Acquire the lock.
+
+        Input:
+            timeout (float): maximum time to wait in seconds, default is
+                the delay specified when creating the lock
+
+        Output: True if the lock was acquired, False on timeout
+        '''
+
+        if self._lock.acquire(False):
+            self._nacquire += 1
+            return True
+
+        if timeout is None:
+            timeout = self._delay
+        start = exact_time()
+
+        # Each waiter blocks on its own lock, released by release() or
+        # by the timer. entry[1] is set when the lock is handed over.
+        waiter = threading.Lock()
+        waiter.acquire()
+        entry = [waiter, False]
+        self._state_lock.acquire()
+        try:
+            self._waiters.append(entry)
+        finally:
+            self._state_lock.release()
+
+        # The lock might have been released before we were added
+        if self._lock.acquire(False):
+            self._nacquire += 1
+            self._remove_waiter(entry)
+            self._add_wait(exact_time() - start, True)
+            return True
+
+        timer = threading.Timer(timeout, self._remove_waiter, (entry, True))
+        timer.start()
+        waiter.acquire()
+        timer.cancel()
+        if entry[1]:
+            self._nacquire += 1
+
+        self._add_wait(exact_time() - start, entry[1])
+        return entry[1]
+
+    def _remove_waiter(self, entry, wakeup=False):
+        self._state_lock.acquire()
+        try:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                if wakeup:
+                    entry[0].release()
+        finally:
+            self._state_lock.release()
+
+    def _add_wait(self, dt, acquired):
+        name = threading.currentThread().getName()
+        self._state_lock.acquire()
+        try:
+            if name not in self._stats:
+                self._stats[name] = {
+                    'nwait': 0,
+                    'ntimeout': 0,
+                    'total_wait': 0.0,
+                    'max_wait': 0.0,
+                }
+            stats = self._stats[name]
+            stats['nwait'] += 1
+            if not acquired:
+                stats['ntimeout'] += 1
+            stats['total_wait'] += dt
+            stats['max_wait'] = max(stats['max_wait'], dt)
+        finally:
+            self._state_lock.release()
 
     def release(self):
-        self._lock.release()
+        self._state_lock.acquire()
+        try:
+            if len(self._waiters) > 0:
+                # Hand over to the first waiter, keeping self._lock locked
+                entry = self._waiters.pop(0)
+                entry[1] = True
+                entry[0].release()
+            else:
+                self._lock.release()
+        finally:
+            self._state_lock.release()
+
+    def get_stats(self):
+        '''
+        Return lock statistics: a dictionary with the number of acquires
+        ('nacquire') and per thread name a dictionary with the number of
+        times a thread had to wait ('nwait'), the number of timeouts
+        ('ntimeout') and the total and maximum wait time in seconds.
+        '''
+
+        self._state_lock.acquire()
+        try:
+            n = self._nacquire - self._nacquire_base
+            threads = {}
+            for name, stats in self._stats.iteritems():
+                threads[name] = dict(stats)
+                n += stats['ntimeout']
+        finally:
+            self._state_lock.release()
+
+        return {'nacquire': n, 'threads': threads}
+
+    def reset_stats(self):
+        self._state_lock.acquire()
+        try:
+            self._nacquire_base = self._nacquire
+            self._stats = {}
+        finally:
+            self._state_lock.release()
 
 class ThreadVariable():
     def __init__(self, value=None):
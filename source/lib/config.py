@@ -27,6 +27,17 @@ except:
 
 import logging
 
+# Default time in seconds between writing persisted values to disk
+PERSIST_INTERVAL = 5
+
+def _replace_file(src, dst):
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows does not allow renaming onto an existing file
+        os.remove(dst)
+        os.rename(src, dst)
+
 class Config(gobject.GObject):
     '''
     Class to manage settings for the QTLab environment.
@@ -45,6 +56,8 @@ class Config(gobject.GObject):
         self._config = {}
         self._defaults = {}
         self._save_hid = None
+        # Persisted values that have not been written yet
+        self._dirty = {}
 
         self.load_defaults()
         self.load()
@@ -118,21 +131,43 @@ class Config(gobject.GObject):
         '''
 
         if delay == 0:
+            if self._save_hid is not None:
+                gobject.source_remove(self._save_hid)
             self._do_save()
         elif self._save_hid is None:
-            self._save_hid = gobject.timeout_add(delay * 1000, self._do_save)
+            self._save_hid = gobject.timeout_add(int(delay * 1000),
+                    self._do_save)
+
+    def flush(self):
+        '''Save settings now if a save is pending.'''
+        if self._save_hid is None and len(self._dirty) == 0:
+            return
+        self.save(delay=0)
 
     def _do_save(self):
+        '''
+        Write the settings to a temporary file and rename it, so that the
+        config file is never partly written. Emits one 'changed' signal
+        for the values stored with persist() since the last save.
+        '''
+
         self._save_hid = None
         try:
             filename = self._get_filename()
             logging.debug('Saving settings to %s', filename)
-            f = file(filename, 'w+')
+            tmpname = filename + '.tmp'
+            f = file(tmpname, 'w')
             json.dump(self._config, f, indent=4, sort_keys=True)
             f.close()
+            _replace_file(tmpname, filename)
         except Exception, e:
             logging.warning('Unable to save config file')
 
+        if len(self._dirty) > 0:
+            changed = self._dirty
+            self._dirty = {}
+            self.emit('changed', changed)
+
     def __getitem__(self, key):
         return self.get(key)
 
@@ -183,6 +218,23 @@ class Config(gobject.GObject):
 
         self.emit('changed', {key: val})
 
+    def persist(self, key, val):
+        '''
+        Set a configuration variable that changes often, such as a
+        persistent instrument parameter. Values are written to disk at most
+        once every config['persist_interval'] seconds, and when QTLab
+        exits. A single 'changed' signal for all keys is emitted when
+        writing.
+
+        Input:
+            key (string): variable name
+            val (any type): variable value
+        '''
+
+        self._config[key] = val
+        self._dirty[key] = val
+        self.save(delay=self.get('persist_interval', PERSIST_INTERVAL))
+
     def get_all(self):
         return self._config
 
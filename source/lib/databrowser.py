@@ -1,15 +1,32 @@
 import os
 import re
+import logging
+import sqlite3
+try:
+    import cPickle as pickle
+except:
+    import pickle
 
 class DataInfo:
 
     RE_META = re.compile('\A\s*#\s*(\w+)\s*:\s*([\w\s,.:;]+)')
     RE_META_KEY = re.compile('\A\s*#\s*(\w+)\s*:')
 
-    def __init__(self, fn):
+    def __init__(self, fn, index=None):
+        '''
+        Create info object for data file fn. If a DataIndex is given the
+        meta data is retrieved from the index when needed, otherwise the
+        file is read directly.
+        '''
+
         self._filename = None
         self._metadata = {}
-        self.set_filename(fn)
+        self._index = index
+        if index is not None:
+            self._filename = fn
+            self._metadata = None
+        else:
+            self.set_filename(fn)
 
     def set_filename(self, fn):
         self._filename = fn
@@ -19,6 +36,10 @@ class DataInfo:
         return self._filename
 
     def get_metadata(self):
+        if self._metadata is None:
+            self._metadata = self._index.get_metadata(self._filename)
+            if self._metadata is None:
+                self._metadata = {}
         return self._metadata
 
     def read_info(self):
@@ -52,22 +73,313 @@ class DataInfo:
                 line = line.rstrip('\r\n')
                 self._metadata['settings'].append(line)
 
+# Seconds to wait for a database that is locked by another process
+LOCK_TIMEOUT = 5.0
+
+def _get_settings_mtime(fn):
+    setfn = os.path.splitext(fn)[0] + '.set'
+    try:
+        return os.stat(setfn).st_mtime
+    except OSError:
+        return None
+
+class DataIndex:
+    '''
+    Persistent index of the meta data of data files, stored in an sqlite
+    database.
+
+    The index is updated incrementally: a directory is only listed again if
+    its modification time changed, and a data file is only read again if
+    the modification time of the file or its settings file changed.
+
+    Several processes can share an index. If it stays locked by another
+    process for more than LOCK_TIMEOUT seconds, an update is skipped and
+    the existing index is used.
+    '''
+
+    FILENAME = '.qtlab_index.sqlite'
+
+    _SCHEMA = (
+        '''CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            parent TEXT,
+            mtime REAL)''',
+        '''CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)''',
+        '''CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            dir TEXT,
+            parent TEXT,
+            name TEXT,
+            mtime REAL,
+            set_mtime REAL,
+            metadata BLOB)''',
+        '''CREATE INDEX IF NOT EXISTS files_dir ON files (dir)''',
+        '''CREATE INDEX IF NOT EXISTS files_parent ON files (parent)''',
+        '''CREATE TABLE IF NOT EXISTS meta (
+            path TEXT,
+            key TEXT,
+            value TEXT)''',
+        '''CREATE INDEX IF NOT EXISTS meta_path ON meta (path)''',
+        '''CREATE INDEX IF NOT EXISTS meta_key ON meta (key, value)''',
+    )
+
+    def __init__(self, filename):
+        '''
+        Open (or create) index database 'filename'. If that is not possible
+        an index in memory will be used.
+        '''
+
+        try:
+            self._db = sqlite3.connect(filename, timeout=LOCK_TIMEOUT)
+            self._create_tables()
+        except sqlite3.Error, e:
+            logging.warning('Unable to open index %s (%s), using memory',
+                    filename, e)
+            self._db = sqlite3.connect(':memory:')
+            self._create_tables()
+
+    def _create_tables(self):
+        # Return paths as str, like os.listdir()
+        self._db.text_factory = str
+        for sql in self._SCHEMA:
+            self._db.execute(sql)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def update(self, dir, depth=1, rescan=False):
+        '''
+        Update the index for directory 'dir' and its subdirectories up to
+        'depth' levels deep. If rescan is True the modification times of all
+        files are checked, also in unchanged directories.
+
+        Output: True if the index was updated
+        '''
+
+        try:
+            self._update_dir(os.path.normpath(dir), None, depth, rescan)
+            self._db.commit()
+        except sqlite3.OperationalError, e:
+            logging.warning('Unable to update index for %s: %s', dir, e)
+            self._db.rollback()
+            return False
+        return True
+
+    def _update_dir(self, dir, parent, depth, rescan):
+        try:
+            mtime = os.stat(dir).st_mtime
+        except OSError:
+            self._remove_dir(dir)
+            return
+
+        row = self._db.execute('SELECT mtime FROM dirs WHERE path=?',
+                (dir, )).fetchone()
+
+        if row is not None and row[0] == mtime and not rescan:
+            subdirs = [r[0] for r in self._db.execute(
+                    'SELECT path FROM dirs WHERE parent=?', (dir, ))]
+        else:
+            subdirs = []
+            datafiles = []
+            for name in os.listdir(dir):
+                fullfn = os.path.join(dir, name)
+                if os.path.isdir(fullfn):
+                    subdirs.append(fullfn)
+                elif os.path.splitext(name)[1] == '.dat':
+                    datafiles.append(fullfn)
+
+            self._update_files(dir, datafiles)
+
+            known = [r[0] for r in self._db.execute(
+                    'SELECT path FROM dirs WHERE parent=?', (dir, ))]
+            for subdir in known:
+                if subdir not in subdirs:
+                    self._remove_dir(subdir)
+
+            # Subdirectories are listed when they are visited
+            for subdir in subdirs:
+                self._db.execute('INSERT OR IGNORE INTO dirs VALUES (?,?,?)',
+                        (subdir, dir, None))
+
+            if row is None:
+                self._db.execute('INSERT INTO dirs VALUES (?,?,?)',
+                        (dir, parent, mtime))
+            else:
+                self._db.execute('UPDATE dirs SET mtime=? WHERE path=?',
+                        (mtime, dir))
+
+        if depth > 0:
+            for subdir in subdirs:
+                self._update_dir(subdir, dir, depth - 1, rescan)
+
+    def _update_files(self, dir, datafiles):
+        known = {}
+        for path, mtime, set_mtime in self._db.execute(
+                'SELECT path, mtime, set_mtime FROM files WHERE dir=?',
+                (dir, )):
+            known[path] = (mtime, set_mtime)
+
+        for fn in datafiles:
+            try:
+                stat = (os.stat(fn).st_mtime, _get_settings_mtime(fn))
+            except OSError:
+                continue
+            if known.pop(fn, None) == stat:
+                continue
+
+            try:
+                info = DataInfo(fn)
+            except Exception, e:
+                logging.warning('Unable to read info from %s: %s', fn, e)
+                continue
+            self._store(fn, dir, stat, info.get_metadata())
+
+        for fn in known:
+            self._remove_file(fn)
+
+    def _store(self, fn, dir, stat, metadata):
+        self._remove_file(fn)
+        blob = sqlite3.Binary(pickle.dumps(metadata, pickle.HIGHEST_PROTOCOL))
+        self._db.execute('INSERT INTO files VALUES (?,?,?,?,?,?,?)',
+                (fn, dir, os.path.dirname(dir), os.path.basename(fn),
+                stat[0], stat[1], blob))
+
+        rows = []
+        for key, val in metadata.iteritems():
+            if isinstance(val, basestring):
+                rows.append((fn, key, val.strip()))
+            else:
+                rows.append((fn, key, None))
+        self._db.executemany('INSERT INTO meta VALUES (?,?,?)', rows)
+
+    def _remove_file(self, fn):
+        self._db.execute('DELETE FROM files WHERE path=?', (fn, ))
+        self._db.execute('DELETE FROM meta WHERE path=?', (fn, ))
+
+    def _remove_dir(self, dir):
+        for r in self._db.execute('SELECT path FROM dirs WHERE parent=?',
+                (dir, )).fetchall():
+            self._remove_dir(r[0])
+        for r in self._db.execute('SELECT path FROM files WHERE dir=?',
+                (dir, )).fetchall():
+            self._remove_file(r[0])
+        self._db.execute('DELETE FROM dirs WHERE path=?', (dir, ))
+
+    def get_metadata(self, fn):
+        '''Return the meta data dictionary for data file fn.'''
+        row = self._db.execute('SELECT metadata FROM files WHERE path=?',
+                (os.path.normpath(fn), )).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(str(row[0]))
+
+    def has_file(self, fn):
+        row = self._db.execute('SELECT 1 FROM files WHERE path=?',
+                (os.path.normpath(fn), )).fetchone()
+        return row is not None
+
+    def find(self, dir, match='', starttime=None, endtime=None,
+            metadata=None):
+        '''
+        Return the sorted paths of data files in directory 'dir' and its
+        direct subdirectories, see Browser.get_filenames().
+        '''
+
+        dir = os.path.normpath(dir)
+        sql = 'SELECT path FROM files WHERE (dir=? OR parent=?)'
+        args = [dir, dir]
+
+        if match != '':
+            sql += ' AND instr(name, ?) > 0'
+            args.append(match)
+        if starttime is not None:
+            sql += ' AND substr(name, 1, 6) >= ?'
+            args.append(starttime)
+        if endtime is not None:
+            sql += ' AND substr(name, 1, 6) <= ?'
+            args.append(endtime)
+
+        if metadata is not None:
+            for key, val in metadata.iteritems():
+                sql += ' AND path IN (SELECT path FROM meta WHERE key=?'
+                args.append(key)
+                if val is not None:
+                    sql += ' AND value=?'
+                    args.append(val)
+                sql += ')'
+
+        sql += ' ORDER BY path'
+        return [r[0] for r in self._db.execute(sql, args)]
+
+    def get_metadata_keys(self, dir):
+        '''Return the meta data keys of files in 'dir' (see find()).'''
+        dir = os.path.normpath(dir)
+        rows = self._db.execute('SELECT DISTINCT key FROM meta WHERE path IN '
+                '(SELECT path FROM files WHERE dir=? OR parent=?)',
+                (dir, dir))
+        return [r[0] for r in rows]
+
 class Browser:
 
-    def __init__(self, dir=None):
+    def __init__(self, dir=None, index=True, index_file=None):
+        '''
+        Create a data browser for directory 'dir'.
+
+        If index is True, the meta data is kept in a persistent DataIndex
+        (stored as 'index_file', default in 'dir'), so that only new or
+        changed files have to be read.
+        '''
+
         self._dir = None
         self._entries = []
+        self._use_index = index
+        self._index_file = index_file
+        self._index = None
         self.set_dir(dir)
 
-    def set_dir(self, dir):
+    def set_dir(self, dir, rescan=False):
+        '''
+        Set the directory to browse. Rescan can be set to check all files
+        in the index for modifications, not only those in changed
+        directories.
+        '''
+
         self._dir = dir
         self._entries = []
-        self._walk_dir(self._dir, recurse=True)
+        if dir is None:
+            return
+
+        if not self._use_index:
+            self._walk_dir(self._dir, recurse=True)
+            return
+
+        if self._index is None:
+            fn = self._index_file
+            if fn is None:
+                fn = os.path.join(dir, DataIndex.FILENAME)
+            self._index = DataIndex(fn)
+        self._index.update(dir, depth=1, rescan=rescan)
 
     def get_entries(self):
-        return self._entries
+        if self._index is None:
+            return self._entries
+        return [DataInfo(fn, index=self._index) \
+                for fn in self.get_filenames()]
+
+    def get_metadata_keys(self):
+        '''Return the meta data keys available for the entries.'''
+
+        if self._index is not None:
+            return self._index.get_metadata_keys(self._dir)
+
+        keys = set([])
+        for info in self._entries:
+            keys |= set(info.get_metadata().keys())
+        return list(keys)
 
-    def get_filenames(self, match='', starttime=None, endtime=None):
+    def get_filenames(self, match='', starttime=None, endtime=None,
+            metadata=None):
         '''
         Return filenames of entries matching 'match'. If match is an empty
         string it returns all filenames.
@@ -75,6 +387,8 @@ class Browser:
         a specific range of the matched data files, based on the 6-digit
         timestamp at the front of a filename. 'starttime' and 'endtime' must
         be specified as a 6-digit string.
+        With an index, 'metadata' can be a dictionary of header tags that
+        the files should have; a value of None matches any value.
         '''
 
         usetimes = False
@@ -85,6 +399,10 @@ class Browser:
             if endtime is None:
                 endtime = '240000'
 
+        if self._index is not None:
+            return self._index.find(self._dir, match, starttime, endtime,
+                    metadata)
+
         ret = []
         for info in self._entries:
             fn = info.get_filename()
@@ -97,6 +415,11 @@ class Browser:
         return ret
 
     def get_entry(self, fn):
+        if self._index is not None:
+            if self._index.has_file(fn):
+                return DataInfo(os.path.normpath(fn), index=self._index)
+            return None
+
         for i in self._entries:
             if i.get_filename() == fn:
                 return i
@@ -116,4 +439,3 @@ class Browser:
 
     def _add_data_entry(self, fn):
         self._entries.append(DataInfo(fn))
-
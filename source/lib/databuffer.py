@@ -0,0 +1,152 @@
+# databuffer.py, growable in-memory storage for measurement data
+# Reinier Heeres <reinier@heeres.eu>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import numpy
+
+class DataBuffer():
+    '''
+    Row based array storage that over-allocates its backing array, so that
+    appending rows takes amortized constant time. The capacity is doubled
+    whenever it runs out.
+
+    get_data() returns a contiguous view of the rows that have been added,
+    which can be used as a normal numpy.array.
+    '''
+
+    MIN_CAPACITY = 1024
+
+    def __init__(self, data=None):
+        '''
+        Create a new buffer, optionally filled with the rows in 'data'.
+        '''
+
+        self._array = None
+        self._nrows = 0
+
+        if data is not None and numpy.size(data) > 0:
+            self.append(data)
+
+    def __len__(self):
+        return self._nrows
+
+    def get_capacity(self):
+        '''Return the number of rows that fit without reallocating.'''
+        if self._array is None:
+            return 0
+        return len(self._array)
+
+    def get_data(self):
+        '''Return a view of the rows stored in the buffer.'''
+        if self._array is None:
+            return numpy.array([])
+        return self._array[:self._nrows]
+
+    def holds(self, data):
+        '''Return whether 'data' is a view created by this buffer.'''
+        if self._array is None or not isinstance(data, numpy.ndarray):
+            return False
+        return data.base is self._array and len(data) == self._nrows
+
+    def _get_dtype(self, dtype):
+        '''Return the data type needed to store rows of type dtype.'''
+        if self._array is None:
+            return dtype
+        return numpy.promote_types(self._array.dtype, dtype)
+
+    def _grow(self, nrows, rowshape, dtype):
+        capacity = max(self.get_capacity(), self.MIN_CAPACITY)
+        while capacity < nrows:
+            capacity *= 2
+
+        newarray = numpy.empty((capacity, ) + rowshape, dtype=dtype)
+        if self._nrows > 0:
+            newarray[:self._nrows] = self._array[:self._nrows]
+        self._array = newarray
+
+    def append(self, rows):
+        '''
+        Append rows to the buffer. 'rows' should be a 2d array (or nested
+        list) with one data point per row, or a 1d array for a single row.
+        The data type will be promoted if necessary.
+        '''
+
+        rows = numpy.asarray(rows)
+        if rows.ndim < 2:
+            rows = numpy.atleast_2d(rows)
+
+        nrows = self._nrows + len(rows)
+        dtype = self._get_dtype(rows.dtype)
+        if self._array is None:
+            self._grow(nrows, rows.shape[1:], dtype)
+        else:
+            if self._array.shape[1:] != rows.shape[1:]:
+                raise ValueError('Row shape %r does not match buffer %r' % \
+                        (rows.shape[1:], self._array.shape[1:]))
+            if dtype != self._array.dtype or nrows > len(self._array):
+                self._grow(nrows, rows.shape[1:], dtype)
+
+        self._array[self._nrows:nrows] = rows
+        self._nrows = nrows
+        return self.get_data()
+
+    def clear(self):
+        '''Remove all rows, keeping the allocated storage.'''
+        self._nrows = 0
+
+class MappedDataBuffer(DataBuffer):
+    '''
+    DataBuffer that stores its rows in a memory mapped file instead of in
+    memory. The file is preallocated for 'capacity' rows (if given) and
+    extended when more rows are added; existing rows are never copied.
+
+    All rows are stored with the data type given at creation.
+    '''
+
+    def __init__(self, filename, capacity=0, dtype=numpy.float64):
+        self._filename = filename
+        self._initial_capacity = capacity
+        self._dtype = numpy.dtype(dtype)
+        DataBuffer.__init__(self)
+
+    def get_filename(self):
+        return self._filename
+
+    def _get_dtype(self, dtype):
+        return self._dtype
+
+    def _grow(self, nrows, rowshape, dtype):
+        capacity = self.get_capacity()
+        if capacity == 0:
+            capacity = self._initial_capacity
+        if capacity <= 0:
+            capacity = self.MIN_CAPACITY
+        while capacity < nrows:
+            capacity *= 2
+
+        # Mapping the file with a larger shape extends it
+        if self._array is None:
+            mode = 'w+'
+        else:
+            self._array.flush()
+            mode = 'r+'
+        self._array = numpy.memmap(self._filename, dtype=self._dtype,
+                mode=mode, shape=(capacity, ) + rowshape)
+
+    def flush(self):
+        '''Write changes in the mapped region to disk.'''
+        if self._array is not None:
+            self._array.flush()
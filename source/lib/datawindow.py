@@ -0,0 +1,339 @@
+# datawindow.py, the most recent part of a Data object for live plotting
+# Reinier Heeres <reinier@heeres.eu>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import numpy
+
+# Maximum number of bytes of the data file read at once
+CHUNK_BYTES = 1024 * 1024
+
+class DataWindow():
+    '''
+    Keep the most recent part of a Data object: at most 'maxtraces' blocks
+    with at most 'maxpoints' points each.
+
+    update() only reads the points that were added since the previous
+    call, from memory if the Data object keeps its data in memory, or
+    else from the end of its data file. The cost of an update therefore
+    depends on the number of new points and the window size, not on the
+    total size of the data set. The first update after a reset scans the
+    data file backwards to the start of the window, and the file is read
+    in chunks of at most CHUNK_BYTES.
+
+    Subclasses can store the points differently by overriding _add_rows(),
+    _new_block(), _get_block_npoints() and get_blocks().
+    '''
+
+    def __init__(self, data, maxpoints=10000, maxtraces=5, cols=None):
+        '''
+        Input:
+            data (Data): the data object
+            maxpoints (int): maximum number of points per block
+            maxtraces (int): maximum number of blocks
+            cols (list of int): columns to keep, default all
+        '''
+
+        self._data = data
+        self._maxpoints = maxpoints
+        self._maxtraces = maxtraces
+        self._cols = cols
+        self._inmem = None
+        self.reset()
+
+    def reset(self):
+        '''Forget all points, the next update() reads everything again.'''
+
+        # List of [list of row arrays, number of rows] for each block
+        self._blocks = [[[], 0]]
+
+        # Last plotted point in memory: number of rows, current block and
+        # number of rows in that block
+        self._nrows = 0
+        self._block = 0
+        self._block_rows = 0
+
+        # Last plotted position in the data file
+        self._filepath = None
+        self._offset = 0
+
+    def set_limits(self, maxpoints, maxtraces):
+        '''
+        Set the window size. If it grows, points that were dropped before
+        are needed again, so the window is reset.
+        '''
+
+        if maxpoints > self._maxpoints or maxtraces > self._maxtraces:
+            self.reset()
+        self._maxpoints = maxpoints
+        self._maxtraces = maxtraces
+
+    def get_last_index(self):
+        '''
+        Return the number of points of the Data object read so far. When
+        reading from the data file, the points before the window are not
+        counted.
+        '''
+        return self._nrows
+
+    def _get_block_npoints(self):
+        '''Return the number of points in the current block.'''
+        return self._blocks[-1][1]
+
+    def _new_block(self):
+        self._blocks.append([[], 0])
+        # Keep one extra block, the last one can still be empty
+        if len(self._blocks) > self._maxtraces + 1:
+            del self._blocks[:-self._maxtraces - 1]
+
+    def _consolidate(self, block, maxrows):
+        rows = block[0]
+        if len(rows) > 1:
+            rows = [numpy.concatenate(rows)]
+        if len(rows) > 0 and len(rows[0]) > maxrows:
+            rows = [rows[0][-maxrows:]]
+        block[0] = rows
+        block[1] = sum([len(r) for r in rows])
+
+    def _add_rows(self, rows):
+        block = self._blocks[-1]
+        block[0].append(rows)
+        block[1] += len(rows)
+        # Trim lazily to keep the number of copies low
+        if block[1] > 2 * self._maxpoints:
+            self._consolidate(block, self._maxpoints)
+
+    def update(self):
+        '''
+        Read the points added to the Data object since the last update.
+
+        Output: number of new points
+        '''
+
+        inmem = self._data.is_inmem()
+        if inmem != self._inmem:
+            self.reset()
+            self._inmem = inmem
+
+        if inmem:
+            return self._update_memory()
+        else:
+            return self._update_file()
+
+    def _update_memory(self):
+        npoints = self._data.get_npoints()
+        if npoints < self._nrows:
+            self.reset()
+        if npoints == self._nrows:
+            return 0
+
+        rows = self._data.get_data()
+        if rows is None:
+            return 0
+        if rows.ndim == 1:
+            rows = rows.reshape((len(rows), 1))
+        # Copy, a view would keep the complete data buffer alive
+        if self._cols is not None:
+            rows = numpy.take(rows[self._nrows:npoints], self._cols, axis=1)
+        else:
+            rows = rows[self._nrows:npoints].copy()
+        self._nrows = npoints
+
+        # Split the new rows over the blocks they belong to
+        i = 0
+        while True:
+            if self._block < self._data.get_nblocks_complete():
+                left = self._data.get_block_size(self._block) - \
+                        self._block_rows
+                if left <= 0:
+                    self._block += 1
+                    self._block_rows = 0
+                    self._new_block()
+                    continue
+            else:
+                left = len(rows) - i
+            if i >= len(rows):
+                break
+
+            n = min(left, len(rows) - i)
+            self._add_rows(rows[i:i+n])
+            self._block_rows += n
+            i += n
+
+        return len(rows)
+
+    def _update_file(self):
+        filepath = self._data.get_filepath()
+        if filepath != self._filepath:
+            self.reset()
+            self._filepath = filepath
+
+        try:
+            f = open(filepath, 'rb')
+        except IOError, e:
+            return 0
+
+        npoints = 0
+        try:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size < self._offset:
+                self.reset()
+                self._filepath = filepath
+            if self._offset == 0:
+                self._offset = self._get_start(f, size)
+
+            # Read in chunks to bound the memory used for the text
+            while self._offset < size:
+                f.seek(self._offset)
+                text = f.read(min(size - self._offset, CHUNK_BYTES))
+                if not text.endswith('\n'):
+                    text += f.readline()
+
+                # Only use complete lines, the rest might still be written
+                end = text.rfind('\n')
+                if end == -1:
+                    break
+                self._offset += end + 1
+                npoints += self._add_text(text[:end])
+        finally:
+            f.close()
+
+        self._nrows += npoints
+        return npoints
+
+    def _get_start(self, f, size):
+        '''
+        Return the offset in the data file from which the window should
+        be filled: the start of the last 'maxpoints' points of the last
+        'maxtraces' blocks.
+        '''
+        return self._find_start(f, size, self._maxtraces, self._maxpoints)
+
+    def _find_start(self, f, size, maxblocks, maxpoints=None):
+        '''
+        Scan the data file 'f' of 'size' bytes backwards in chunks and
+        return the offset of the first line needed for the last
+        'maxblocks' blocks, of which at most 'maxpoints' points are kept
+        in the first one (all if None).
+        '''
+
+        nblocks = 0
+        npoints = 0
+        inblock = False
+        pos = size
+        rest = ''
+        while pos > 0:
+            start = max(0, pos - CHUNK_BYTES)
+            f.seek(start)
+            text = f.read(pos - start) + rest
+            pos = start
+
+            # Skip the last line if it is not complete yet
+            idx = len(text)
+            if start + idx == size:
+                idx = text.rfind('\n')
+                if idx == -1:
+                    rest = text
+                    continue
+
+            while True:
+                i = text.rfind('\n', 0, idx)
+                if i == -1 and pos > 0:
+                    # The first line might continue in the previous chunk
+                    rest = text[:idx]
+                    break
+
+                line = text[i+1:idx].strip()
+                if line == '':
+                    inblock = False
+                elif not line.startswith('#'):
+                    if not inblock:
+                        inblock = True
+                        nblocks += 1
+                        npoints = 0
+                        if nblocks > maxblocks:
+                            return pos + idx + 1
+                    npoints += 1
+                    if nblocks == maxblocks and maxpoints is not None and \
+                            npoints >= maxpoints:
+                        return pos + i + 1
+
+                if i == -1:
+                    break
+                idx = i
+
+        return 0
+
+    def _add_text(self, text):
+        '''
+        Add the points in 'text', consisting of complete lines.
+
+        Output: number of points added
+        '''
+
+        npoints = 0
+        lines = []
+        for line in text.split('\n'):
+            line = line.strip()
+            if line.startswith('#'):
+                continue
+            if line == '':
+                npoints += self._add_lines(lines)
+                lines = []
+                if self._get_block_npoints() > 0:
+                    self._new_block()
+                continue
+            lines.append(line)
+        npoints += self._add_lines(lines)
+        return npoints
+
+    def _add_lines(self, lines):
+        if len(lines) == 0:
+            return 0
+
+        ncols = self._data.get_ndimensions()
+        if ncols == 0:
+            ncols = len(lines[0].split())
+        vals = numpy.fromstring(' '.join(lines), sep=' ')
+        if len(vals) != len(lines) * ncols:
+            # Lines with a different number of columns or non-numbers
+            rows = []
+            for line in lines:
+                try:
+                    row = [float(v) for v in line.split()]
+                except ValueError, e:
+                    continue
+                if len(row) == ncols:
+                    rows.append(row)
+            if len(rows) == 0:
+                return 0
+            vals = numpy.array(rows)
+
+        vals = vals.reshape((-1, ncols))
+        if self._cols is not None:
+            vals = vals[:, self._cols]
+        self._add_rows(vals)
+        return len(vals)
+
+    def get_blocks(self):
+        '''Return the blocks in the window as a list of 2D arrays.'''
+
+        for block in self._blocks:
+            self._consolidate(block, self._maxpoints)
+
+        blocks = [b[0][0] for b in self._blocks if b[1] > 0]
+        return blocks[-self._maxtraces:]
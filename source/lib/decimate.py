@@ -0,0 +1,340 @@
+# decimate.py, reduce large data sets to the resolution of a plot
+# Reinier Heeres <reinier@heeres.eu>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import numpy
+
+from lib.databuffer import DataBuffer
+from lib.datawindow import DataWindow
+
+class MinMaxPyramid():
+    '''
+    Multi-resolution min/max summary of a trace, for drawing it with a
+    bounded number of points without losing peaks.
+
+    Level 0 holds the points (x, y). Level k holds for every bin of
+    factor**k points the indices and values of its minimum and maximum;
+    bins are added as soon as they are complete, so appending points
+    takes time proportional to the number of new points.
+
+    decimate() returns for every pixel column of a range the minimum and
+    maximum point, using the coarsest level with bins that are not wider
+    than a pixel column.
+    '''
+
+    def __init__(self, factor=8):
+        self._factor = factor
+        self._points = DataBuffer()
+        # Rows of (index of min, index of max, min, max) for each level
+        self._levels = []
+
+    def get_npoints(self):
+        return len(self._points)
+
+    def get_nlevels(self):
+        return len(self._levels)
+
+    def append(self, x, y):
+        '''Append points with coordinates x and values y.'''
+
+        if len(y) == 0:
+            return
+        rows = numpy.column_stack((x, y)).astype(numpy.float64)
+        self._points.append(rows)
+        self._update_levels()
+
+    def _update_levels(self):
+        factor = self._factor
+        k = 0
+        while True:
+            if k == 0:
+                src = self._points.get_data()
+            else:
+                src = self._levels[k - 1].get_data()
+
+            if k == len(self._levels):
+                if len(src) < factor:
+                    return
+                self._levels.append(DataBuffer())
+
+            # Add the bins that were completed
+            level = self._levels[k]
+            start = len(level) * factor
+            stop = (len(src) / factor) * factor
+            if stop <= start:
+                return
+            level.append(self._reduce(src[start:stop], start, k == 0))
+            k += 1
+
+    def _reduce(self, src, offset, raw):
+        '''Combine every 'factor' rows of src into one bin.'''
+
+        factor = self._factor
+        if raw:
+            y = src[:, 1]
+            nans = numpy.isnan(y)
+            vmin = numpy.where(nans, numpy.inf, y).reshape((-1, factor))
+            vmax = numpy.where(nans, -numpy.inf, y).reshape((-1, factor))
+            imin = numpy.arange(offset, offset + len(src),
+                    dtype=numpy.float64).reshape((-1, factor))
+            imax = imin
+        else:
+            imin = src[:, 0].reshape((-1, factor))
+            imax = src[:, 1].reshape((-1, factor))
+            vmin = src[:, 2].reshape((-1, factor))
+            vmax = src[:, 3].reshape((-1, factor))
+
+        r = numpy.arange(len(vmin))
+        amin = vmin.argmin(axis=1)
+        amax = vmax.argmax(axis=1)
+        return numpy.column_stack((imin[r, amin], imax[r, amax],
+                vmin[r, amin], vmax[r, amax]))
+
+    def _minmax_points(self, start, stop):
+        '''Return indices of the minimum and maximum in points[start:stop].'''
+
+        if stop <= start:
+            return []
+        y = self._points.get_data()[start:stop, 1]
+        nans = numpy.isnan(y)
+        return [start + numpy.where(nans, numpy.inf, y).argmin(),
+                start + numpy.where(nans, -numpy.inf, y).argmax()]
+
+    def decimate(self, nbins, start=0, stop=None):
+        '''
+        Return the points in range [start, stop) reduced to the minimum and
+        maximum of each of 'nbins' bins, in their original order.
+
+        Output: (x, y) tuple of arrays with at most about 2 * nbins points
+        '''
+
+        points = self._points.get_data()
+        if stop is None or stop > len(points):
+            stop = len(points)
+        start = max(0, start)
+        if stop - start <= 2 * nbins:
+            return points[start:stop, 0], points[start:stop, 1]
+
+        # Coarsest level with bins not wider than a pixel column
+        width = float(stop - start) / nbins
+        k = 0
+        size = 1
+        while k < len(self._levels) and size * self._factor <= width:
+            k += 1
+            size *= self._factor
+        if k == 0:
+            # Every point is a bin
+            y = points[start:stop, 1]
+            nans = numpy.isnan(y)
+            i = numpy.arange(start, stop, dtype=numpy.float64)
+            bins = numpy.column_stack((i, i, numpy.where(nans, numpy.inf, y),
+                    numpy.where(nans, -numpy.inf, y)))
+            bstart = start
+            indices = []
+        else:
+            level = self._levels[k - 1].get_data()
+            b0 = (start + size - 1) / size
+            b1 = min(stop / size, len(level))
+            if b1 <= b0:
+                bins = None
+                indices = [self._minmax_points(start, stop)]
+            else:
+                bins = level[b0:b1]
+                bstart = b0 * size
+                # Parts at the start and end that are not a complete bin
+                indices = [self._minmax_points(start, b0 * size),
+                        self._minmax_points(b1 * size, stop)]
+
+        if bins is not None:
+            # Group the bins per pixel column
+            pix = ((numpy.arange(len(bins)) * size + bstart - start) /
+                    width).astype(int)
+            gstarts = numpy.concatenate(([0],
+                    numpy.nonzero(numpy.diff(pix))[0] + 1))
+            gids = numpy.cumsum(numpy.concatenate(([0], numpy.diff(pix) != 0)))
+            allbins = numpy.arange(len(bins))
+            for icol, vcol, func in ((0, 2, numpy.minimum),
+                    (1, 3, numpy.maximum)):
+                vals = bins[:, vcol]
+                gvals = func.reduceat(vals, gstarts)
+                first = numpy.where(vals == gvals[gids], allbins, len(bins))
+                sel = numpy.minimum.reduceat(first, gstarts)
+                indices.append(bins[sel, icol])
+
+        indices = numpy.unique(numpy.concatenate(indices)).astype(int)
+        return points[indices, 0], points[indices, 1]
+
+class DecimatedWindow(DataWindow):
+    '''
+    DataWindow that keeps a MinMaxPyramid for each of the last 'maxtraces'
+    blocks instead of the last points, so that complete traces can be
+    shown with a bounded number of points.
+
+    get_blocks() returns for each block an array with columns (x, y); if
+    no x column is given the point number within the block is used.
+    '''
+
+    def __init__(self, data, xcol, ycol, nbins=1000, maxtraces=5):
+        self._nbins = nbins
+        self._has_x = xcol is not None
+        if self._has_x:
+            cols = [xcol, ycol]
+        else:
+            cols = [ycol]
+        DataWindow.__init__(self, data, maxtraces=maxtraces, cols=cols)
+
+    def reset(self):
+        DataWindow.reset(self)
+        self._pyramids = [MinMaxPyramid()]
+
+    def set_limits(self, maxpoints, maxtraces):
+        '''Set the number of blocks, maxpoints does not apply.'''
+        if maxtraces > self._maxtraces:
+            self.reset()
+        self._maxtraces = maxtraces
+
+    def set_nbins(self, nbins):
+        self._nbins = nbins
+
+    def _get_start(self, f, size):
+        return self._find_start(f, size, self._maxtraces)
+
+    def _get_block_npoints(self):
+        return self._pyramids[-1].get_npoints()
+
+    def _new_block(self):
+        self._pyramids.append(MinMaxPyramid())
+        if len(self._pyramids) > self._maxtraces + 1:
+            del self._pyramids[:-self._maxtraces - 1]
+
+    def _add_rows(self, rows):
+        pyramid = self._pyramids[-1]
+        if self._has_x:
+            pyramid.append(rows[:, 0], rows[:, 1])
+        else:
+            n = pyramid.get_npoints()
+            pyramid.append(numpy.arange(n, n + len(rows)), rows[:, 0])
+
+    def get_blocks(self):
+        blocks = []
+        for pyramid in self._pyramids:
+            if pyramid.get_npoints() == 0:
+                continue
+            x, y = pyramid.decimate(self._nbins)
+            blocks.append(numpy.column_stack((x, y)))
+        return blocks[-self._maxtraces:]
+
+class GridWindow(DataWindow):
+    '''
+    DataWindow that reduces 3D data, a sweep with one block per line, to
+    a grid of at most 'nx' by 'ny' cells.
+
+    Each completed block is reduced to at most nx cells when it is read;
+    when there are more than 2 * ny lines, pairs of lines are merged.
+    Every cell keeps the sum of its coordinates and the minimum, maximum
+    and sum of its values, so merging is exact. The value shown for a
+    cell is its minimum or maximum, whichever is further from the mean,
+    so that peaks remain visible.
+
+    get_blocks() returns for each line an array with columns (x, y, z).
+    Only completed blocks are included.
+    '''
+
+    def __init__(self, data, cols, nx=500, ny=500):
+        self._nx = nx
+        self._ny = ny
+        DataWindow.__init__(self, data, cols=cols)
+
+    def reset(self):
+        DataWindow.reset(self)
+        self._parts = []
+        self._lines = []
+        self._xfactor = None
+
+    def set_limits(self, maxpoints, maxtraces):
+        pass
+
+    def _get_start(self, f, size):
+        # All lines are shown
+        return 0
+
+    def _get_block_npoints(self):
+        return sum([len(p) for p in self._parts])
+
+    def _add_rows(self, rows):
+        self._parts.append(rows)
+
+    def _new_block(self):
+        if len(self._parts) == 0:
+            return
+        rows = numpy.concatenate(self._parts)
+        self._parts = []
+        self._lines.append(self._reduce_line(rows))
+        if len(self._lines) > 2 * self._ny:
+            self._lines = self._merge_lines(self._lines)
+
+    def _reduce_line(self, rows):
+        '''
+        Reduce a line to cells of (sum x, sum y, min z, max z, sum z,
+        number of points, number of z values).
+        '''
+
+        if self._xfactor is None:
+            self._xfactor = max(1, (len(rows) + self._nx - 1) / self._nx)
+        starts = numpy.arange(0, len(rows), self._xfactor)
+        npoints = numpy.diff(numpy.append(starts, len(rows)))
+
+        z = rows[:, 2]
+        valid = ~numpy.isnan(z)
+        return numpy.column_stack((
+            numpy.add.reduceat(rows[:, 0], starts),
+            numpy.add.reduceat(rows[:, 1], starts),
+            numpy.fmin.reduceat(z, starts),
+            numpy.fmax.reduceat(z, starts),
+            numpy.add.reduceat(numpy.where(valid, z, 0), starts),
+            npoints,
+            numpy.add.reduceat(valid, starts),
+        ))
+
+    def _merge_lines(self, lines):
+        merged = []
+        for i in range(0, len(lines) - 1, 2):
+            n = min(len(lines[i]), len(lines[i + 1]))
+            a = lines[i][:n]
+            b = lines[i + 1][:n]
+            merged.append(numpy.column_stack((
+                a[:, 0] + b[:, 0],
+                a[:, 1] + b[:, 1],
+                numpy.fmin(a[:, 2], b[:, 2]),
+                numpy.fmax(a[:, 3], b[:, 3]),
+                a[:, 4] + b[:, 4],
+                a[:, 5] + b[:, 5],
+                a[:, 6] + b[:, 6],
+            )))
+        if len(lines) % 2 == 1:
+            merged.append(lines[-1])
+        return merged
+
+    def get_blocks(self):
+        blocks = []
+        for cells in self._lines:
+            mean = cells[:, 4] / numpy.maximum(cells[:, 6], 1)
+            mean[cells[:, 6] == 0] = numpy.nan
+            z = numpy.where(cells[:, 3] - mean > mean - cells[:, 2],
+                    cells[:, 3], cells[:, 2])
+            blocks.append(numpy.column_stack((cells[:, 0] / cells[:, 5],
+                    cells[:, 1] / cells[:, 5], z)))
+        return blocks
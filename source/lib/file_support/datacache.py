@@ -0,0 +1,164 @@
+# datacache.py, binary cache files for loaded QTLab data files
+# Reinier Heeres <reinier@heeres.eu>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+A parsed data file is stored as a .npy file containing the data array and
+a small pickled file containing the meta data. The meta data also stores
+the modification time and size of the source file, so that the cache is
+only used if the source file did not change.
+
+The cache files are placed either next to the data file, named after the
+full file name of the data file (e.g. 'data.dat.qtcache.npy'), or, if a
+cache directory is specified, in that directory with a name based on a
+hash of the full path of the data file. The meta data also records the
+size, shape and type of the cached array, so that a .npy file that was not
+written by save() is never used.
+
+Cached data is loaded as a copy-on-write memory map, so a reload is fast
+and several processes can share the pages.
+'''
+
+import os
+import logging
+import hashlib
+try:
+    import cPickle as pickle
+except:
+    import pickle
+import numpy
+
+VERSION = 2
+
+CACHE_SUFFIX = '.qtcache'
+
+def get_cache_paths(filepath, cachedir=None):
+    '''Return the paths of the (data, meta data) cache files.'''
+
+    filepath = os.path.abspath(filepath)
+    if cachedir is None:
+        base = filepath + CACHE_SUFFIX
+    else:
+        fn = os.path.splitext(os.path.basename(filepath))[0]
+        key = hashlib.md5(filepath).hexdigest()[:12]
+        base = os.path.join(cachedir, '%s_%s%s' % (fn, key, CACHE_SUFFIX))
+
+    return base + '.npy', base + '.meta'
+
+def _get_source_stat(filepath):
+    st = os.stat(filepath)
+    return (st.st_mtime, st.st_size)
+
+def load(filepath, cachedir=None):
+    '''
+    Load cached data for filepath.
+
+    Output:
+        (data, meta), where data is a numpy.memmap and meta the dictionary
+        of meta data stored with save(). None if no valid cache exists.
+    '''
+
+    datafn, metafn = get_cache_paths(filepath, cachedir)
+    if not os.path.exists(datafn) or not os.path.exists(metafn):
+        return None
+
+    try:
+        f = open(metafn, 'rb')
+        try:
+            meta = pickle.load(f)
+        finally:
+            f.close()
+
+        if meta.get('version') != VERSION or \
+                meta.get('source') != _get_source_stat(filepath) or \
+                meta.get('cache_size') != os.path.getsize(datafn):
+            logging.debug('Cache for %s outdated', filepath)
+            return None
+
+        data = numpy.load(datafn, mmap_mode='c')
+        if data.shape != meta.get('shape') or \
+                data.dtype.str != meta.get('dtype'):
+            logging.debug('Cache for %s does not match meta data', filepath)
+            return None
+    except Exception, e:
+        logging.warning('Unable to load cache for %s: %s', filepath, e)
+        return None
+
+    return data, meta
+
+def _replace(src, dst):
+    # Windows does not allow renaming to an existing file
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+def save(filepath, data, meta, cachedir=None):
+    '''
+    Store data and the meta data dictionary as cache for filepath.
+    Returns True if successful.
+    '''
+
+    datafn, metafn = get_cache_paths(filepath, cachedir)
+    meta = dict(meta)
+    meta['version'] = VERSION
+
+    try:
+        if cachedir is not None and not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+        meta['source'] = _get_source_stat(filepath)
+
+        # The old meta data should not validate the new data file
+        if os.path.exists(metafn):
+            os.remove(metafn)
+
+        # Write to temporary files first, so that other processes never
+        # see incomplete cache files.
+        data = numpy.ascontiguousarray(data)
+        tmpfn = '%s.%d.tmp' % (datafn, os.getpid())
+        f = open(tmpfn, 'wb')
+        try:
+            numpy.save(f, data)
+        finally:
+            f.close()
+        meta['cache_size'] = os.path.getsize(tmpfn)
+        meta['shape'] = data.shape
+        meta['dtype'] = data.dtype.str
+        _replace(tmpfn, datafn)
+
+        tmpfn = '%s.%d.tmp' % (metafn, os.getpid())
+        f = open(tmpfn, 'wb')
+        try:
+            pickle.dump(meta, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        _replace(tmpfn, metafn)
+
+    except Exception, e:
+        logging.warning('Unable to write cache for %s: %s', filepath, e)
+        return False
+
+    return True
+
+def remove(filepath, cachedir=None):
+    '''Remove the cache files for filepath.'''
+
+    for fn in get_cache_paths(filepath, cachedir):
+        try:
+            if os.path.exists(fn):
+                os.remove(fn)
+        except Exception, e:
+            logging.warning('Unable to remove cache file %s: %s', fn, e)
@@ -0,0 +1,150 @@
+# datareader.py, fast reading of QTLab text data files
+# Reinier Heeres <reinier@heeres.eu>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import re
+import numpy
+
+# Number of bytes parsed at once
+CHUNK_BYTES = 16 * 1024 * 1024
+
+_TRAILING_WS = re.compile('[ \t\r]+$', re.M)
+
+def read_header(f, parse_func):
+    '''
+    Read the header lines of a data file, starting at the current position
+    of file object 'f'. Every comment line is passed to parse_func(line).
+    The file is left positioned at the first data line.
+    '''
+
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if line == '':
+            return
+
+        line = line.rstrip(' \n\t\r')
+        if len(line) == 0:
+            continue
+        elif line[0] == '#':
+            parse_func(line)
+        else:
+            f.seek(pos)
+            return
+
+class _BodyParser():
+
+    def __init__(self):
+        self.ncols = None
+        self.npoints = 0
+        self.block_sizes = []
+        self.blocksize = 0
+        self.chunks = []
+
+    def parse(self, text):
+        '''
+        Parse a piece of text consisting of complete lines. Returns False
+        if the text can not be handled.
+        '''
+
+        if '#' in text:
+            return False
+        text = _TRAILING_WS.sub('', text)
+        if not text.endswith('\n'):
+            text += '\n'
+
+        buf = numpy.frombuffer(text, dtype=numpy.uint8)
+        ends = numpy.flatnonzero(buf == 10)
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+        blank = (ends == starts)
+        ndata = numpy.cumsum(~blank)
+
+        if self.ncols is None:
+            datalines = numpy.flatnonzero(~blank)
+            if len(datalines) == 0:
+                return True
+            i = datalines[0]
+            self.ncols = len(text[starts[i]:ends[i]].split())
+
+        # Every data line should have the same number of fields, the total
+        # count of values checked below does not catch ragged lines.
+        fields = (buf != 32) & (buf != 9) & (buf != 10) & (buf != 13)
+        fieldstarts = fields.copy()
+        fieldstarts[1:] &= ~fields[:-1]
+        counts = numpy.diff(numpy.concatenate(([0],
+                numpy.cumsum(fieldstarts)[ends])))
+        if numpy.any(counts[~blank] != self.ncols):
+            return False
+
+        # Note that fromstring() does not return an empty array for text
+        # consisting of whitespace only
+        if ndata[-1] > 0:
+            vals = numpy.fromstring(text, sep=' ')
+            if len(vals) != ndata[-1] * self.ncols:
+                return False
+            self.chunks.append(vals)
+
+        # A blank line ends a block, but only after the first data point
+        prev = 0
+        for i in numpy.flatnonzero(blank):
+            self.blocksize += ndata[i] - prev
+            prev = ndata[i]
+            if self.npoints + prev > 0:
+                self.block_sizes.append(int(self.blocksize))
+                self.blocksize = 0
+
+        self.blocksize += ndata[-1] - prev
+        self.npoints += ndata[-1]
+        return True
+
+    def get_data(self):
+        if self.ncols is None:
+            return numpy.array([])
+        data = numpy.concatenate(self.chunks)
+        return data.reshape((-1, self.ncols))
+
+def read_body(f, chunksize=CHUNK_BYTES):
+    '''
+    Read the numerical part of a data file in chunks, starting at the
+    current position of file object 'f'.
+
+    Output:
+        (data, block_sizes, last_block_size), where data is a 2d
+        numpy.array. None is returned if the data could not be parsed
+        (e.g. comments between the data, or lines with different numbers
+        of columns); the slow line-by-line parser should be used then.
+    '''
+
+    parser = _BodyParser()
+    rest = ''
+    while True:
+        text = f.read(chunksize)
+        if text == '':
+            if len(rest) > 0 and not parser.parse(rest):
+                return None
+            break
+
+        text = rest + text
+        cut = text.rfind('\n')
+        if cut == -1:
+            rest = text
+            continue
+
+        rest = text[cut+1:]
+        if not parser.parse(text[:cut+1]):
+            return None
+
+    return parser.get_data(), parser.block_sizes, int(parser.blocksize)
@@ -0,0 +1,199 @@
+# datawriter.py, buffered writing of QTLab text data files
+# Reinier Heeres <reinier@heeres.eu>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import gobject
+import time
+import types
+import numpy
+
+INT_TYPES = (
+        types.IntType, types.LongType,
+        numpy.int, numpy.int0, numpy.int8,
+        numpy.int16, numpy.int32, numpy.int64,
+)
+
+# Number of rows formatted in a single string operation
+CHUNK_ROWS = 4096
+
+class DataWriter():
+    '''
+    Writes data lines to a (text) data file.
+
+    The format of each column is determined once from the dimension info
+    (the 'format' and 'precision' options), integer values are always
+    written with '%d'. Arrays of points are formatted in chunks with a
+    single string operation.
+
+    Flushing the file is done according to a flush policy:
+        flush_lines (int): flush after this many lines, None to disable
+        flush_interval (float): flush pending lines after this many
+            seconds, None to disable
+    The file is always flushed by new_block(), flush() and close().
+    '''
+
+    def __init__(self, f, dimensions=None, precision=12,
+            flush_lines=1, flush_interval=None):
+        self._file = f
+        self._precision = precision
+        self._flush_lines = flush_lines
+        self._flush_interval = flush_interval
+        self._flush_hid = None
+        self._pending = 0
+        self._last_flush = time.time()
+        self.set_dimensions(dimensions)
+
+    def set_dimensions(self, dimensions):
+        '''Compile the per-column format plan from the dimension info.'''
+
+        if dimensions is None:
+            dimensions = []
+
+        default = '%%.%de' % self._precision
+        self._formats = []
+        for opts in dimensions:
+            if 'format' in opts:
+                self._formats.append(opts['format'])
+            elif 'precision' in opts:
+                self._formats.append('%%.%de' % opts['precision'])
+            else:
+                self._formats.append(default)
+
+        self._default_format = default
+        self._line_formats = {}
+
+    def get_file(self):
+        return self._file
+
+    def _get_line_format(self, intcols):
+        '''
+        Return the format string for a complete line. 'intcols' is a tuple
+        of booleans indicating which columns contain integers.
+        '''
+
+        fmt = self._line_formats.get(intcols, None)
+        if fmt is not None:
+            return fmt
+
+        fields = []
+        for colnum, isint in enumerate(intcols):
+            if isint:
+                fields.append('%d')
+            elif colnum < len(self._formats):
+                fields.append(self._formats[colnum])
+            else:
+                fields.append(self._default_format)
+        fmt = '\t'.join(fields) + '\n'
+
+        self._line_formats[intcols] = fmt
+        return fmt
+
+    def format_point(self, vals):
+        '''Return a formatted line for the values in 'vals'.'''
+
+        if not hasattr(vals, '__len__'):
+            vals = (vals, )
+        elif len(vals) == 0:
+            return '\n'
+
+        intcols = tuple([type(v) in INT_TYPES for v in vals])
+        return self._get_line_format(intcols) % tuple(vals)
+
+    def format_points(self, data):
+        '''
+        Return formatted lines for a 2d array of points. Arrays with a
+        numeric data type are formatted in chunks of CHUNK_ROWS lines.
+        '''
+
+        if not isinstance(data, numpy.ndarray):
+            return ''.join([self.format_point(row) for row in data])
+
+        if data.ndim == 1:
+            data = data.reshape((-1, 1))
+
+        npoints, ncols = data.shape
+        if data.dtype.kind == 'i':
+            fmt = self._get_line_format((True, ) * ncols)
+        elif data.dtype.kind == 'f':
+            fmt = self._get_line_format((False, ) * ncols)
+        else:
+            return ''.join([self.format_point(row) for row in data])
+
+        if npoints == 0 or ncols == 0:
+            return '\n' * npoints
+
+        lines = []
+        for start in xrange(0, npoints, CHUNK_ROWS):
+            chunk = data[start:start + CHUNK_ROWS]
+            lines.append((fmt * len(chunk)) % tuple(chunk.ravel()))
+        return ''.join(lines)
+
+    def write(self, text, nlines=0):
+        '''
+        Write raw text to the file, containing 'nlines' data lines which
+        count for the flush policy.
+        '''
+
+        self._file.write(text)
+        self._pending += nlines
+        self._check_flush()
+
+    def write_point(self, vals):
+        '''Write a single data point.'''
+        self.write(self.format_point(vals), 1)
+
+    def write_points(self, data):
+        '''Write multiple data points, given as a 2d array.'''
+        self.write(self.format_points(data), len(data))
+
+    def new_block(self):
+        '''Write a block separator and flush.'''
+        self._file.write('\n')
+        self.flush()
+
+    def _check_flush(self):
+        if self._pending == 0:
+            return
+
+        if self._flush_lines is not None and \
+                self._pending >= self._flush_lines:
+            self.flush()
+        elif self._flush_interval is not None:
+            if time.time() - self._last_flush >= self._flush_interval:
+                self.flush()
+            elif self._flush_hid is None:
+                self._flush_hid = gobject.timeout_add(
+                        int(self._flush_interval * 1000), self._flush_cb)
+
+    def _flush_cb(self):
+        self._flush_hid = None
+        self.flush()
+        return False
+
+    def flush(self):
+        '''Flush the file.'''
+        if self._flush_hid is not None:
+            gobject.source_remove(self._flush_hid)
+            self._flush_hid = None
+        if self._file is not None:
+            self._file.flush()
+        self._pending = 0
+        self._last_flush = time.time()
+
+    def close(self):
+        '''Flush and stop writing; the file itself is not closed.'''
+        self.flush()
+        self._file = None
@@ -5,14 +5,22 @@ import logging
 #### settings file
 ##################
 
+# Maximum number of base files to follow when resolving a delta file
+MAX_BASE_DEPTH = 10
+
 class SettingsFile():
     '''
     This class will read a settingsfile, and make it available as dict.
     For initializing both the <filename>.dat and the <filename>.set are
     allowed.
+
+    A settings file can be a delta against a base file, indicated by a
+    'Base:' line with the path of the base file relative to the settings
+    file. The settings of the base file are then included, unless
+    resolve_base is False.
     '''
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, resolve_base=True):
 
         path, ext = os.path.splitext(filepath)
         self._filepath = path + '.set'
@@ -25,6 +33,29 @@ class SettingsFile():
             return
 
         self._parse_settings_file()
+        if resolve_base and 'base' in self._metadata:
+            self._resolve_base()
+
+    def _resolve_base(self):
+        chain = []
+        sfile = self
+        while 'base' in sfile._metadata:
+            if len(chain) >= MAX_BASE_DEPTH:
+                logging.warning('Too many base files for "%s"' % self._filepath)
+                break
+            path = os.path.join(os.path.dirname(sfile._filepath),
+                    sfile._metadata['base'])
+            if not os.path.isfile(path):
+                logging.warning('Base file "%s" does not exist' % path)
+                break
+            sfile = SettingsFile(path, resolve_base=False)
+            chain.append(sfile)
+
+        settings = {}
+        for sfile in reversed(chain):
+            _update_settings(settings, sfile._settings)
+        _update_settings(settings, self._settings)
+        self._settings = settings
 
     def _parse_settings_file(self):
 
@@ -40,6 +71,8 @@ class SettingsFile():
                 self._metadata['filename'] = line[10:]
             elif line[:10] == 'Timestamp:':
                 self._metadata['timestamp'] = line[11:]
+            elif line[:5] == 'Base:':
+                self._metadata['base'] = line[6:]
             elif len(line) == 0:
                 pass
             elif line[:11] == 'Instrument:':
@@ -61,6 +94,9 @@ class SettingsFile():
 
         f.close()
 
+    def get_metadata(self):
+        return self._metadata
+
     def get_instruments(self):
         return self._settings.keys()
 
@@ -83,3 +119,152 @@ class SettingsFile():
         else:
             logging.warning('instrument %s does not exist in settingsfile' % instrument)
             return False
+
+def _update_settings(settings, new):
+    for insname, values in new.iteritems():
+        if insname in settings:
+            settings[insname].update(values)
+        else:
+            settings[insname] = dict(values)
+
+def write_settings_file(filepath, filename, timestamp, settings, base=None):
+    '''
+    Write a settings file.
+
+    Input:
+        filepath (string): path of the settings file
+        filename (string): name of the data file
+        timestamp (string): timestamp of the data file
+        settings (dict): instrument name -> dict of parameter -> value
+        base (string): path of the base file relative to 'filepath', if
+            this is a delta file
+    '''
+
+    f = open(filepath, 'w+')
+    f.write('Filename: %s\n' % filename)
+    f.write('Timestamp: %s\n' % timestamp)
+    if base is not None:
+        f.write('Base: %s\n' % base)
+    f.write('\n')
+
+    insnames = settings.keys()
+    insnames.sort()
+    for insname in insnames:
+        f.write('Instrument: %s\n' % insname)
+        values = settings[insname]
+        params = values.keys()
+        params.sort()
+        for param in params:
+            f.write('\t%s: %s\n' % (param, values[param]))
+
+    f.close()
+
+class SettingsTracker():
+    '''
+    Keep the parameter values of the last full settings file in memory, to
+    write settings files with only the changes with respect to it.
+
+    The current values are taken from the instrument snapshots each time a
+    file is written, so values set without a 'changed' signal (fast or
+    query=False sets, ramp steps) are included. A snapshot only returns
+    the values that are stored in the instruments, it does not query them.
+
+    When writing deltas, each full file becomes the base file for the next
+    ones; a full file is written again when more than 'max_delta_fraction'
+    of the parameters changed, or when instruments or parameters were
+    removed.
+
+    The base file is referred to by its path relative to the delta file,
+    which is usually in the directory of an earlier measurement. Delta
+    files can therefore only be read when they are kept together with
+    their base files, e.g. by moving or copying the whole data directory.
+    '''
+
+    def __init__(self, instruments, max_delta_fraction=0.5):
+        self._instruments = instruments
+        self._max_delta_fraction = max_delta_fraction
+        self._base_path = None
+        self._base_values = None
+
+    def close(self):
+        self._base_path = None
+        self._base_values = None
+
+    def get_settings(self):
+        '''
+        Return the current settings as a dictionary of instrument name ->
+        dict of parameter -> value string.
+        '''
+
+        settings = {}
+        instruments = self._instruments.get_instruments()
+        for insname, ins in instruments.iteritems():
+            values = {}
+            for param, val in ins.snapshot().iteritems():
+                values[param] = '%s' % (val, )
+            settings[insname] = values
+
+        return settings
+
+    def _get_delta(self, settings):
+        '''
+        Return the settings that differ from the base file, or None if a
+        full file should be written.
+        '''
+
+        if self._base_values is None or not os.path.isfile(self._base_path):
+            return None
+
+        for insname, base in self._base_values.iteritems():
+            if insname not in settings:
+                return None
+            for param in base:
+                if param not in settings[insname]:
+                    return None
+
+        delta = {}
+        nchanged = 0
+        ntotal = 0
+        for insname, values in settings.iteritems():
+            base = self._base_values.get(insname, {})
+            changes = {}
+            for param, val in values.iteritems():
+                if base.get(param, None) != val:
+                    changes[param] = val
+            if len(changes) > 0:
+                delta[insname] = changes
+                nchanged += len(changes)
+            ntotal += len(values)
+
+        if nchanged > ntotal * self._max_delta_fraction:
+            return None
+        return delta
+
+    def write(self, filepath, filename, timestamp):
+        '''
+        Write a settings file with the changes with respect to the last
+        full file, or a full file if needed.
+
+        Input:
+            filepath, filename, timestamp: see write_settings_file()
+        '''
+
+        settings = self.get_settings()
+        changes = self._get_delta(settings)
+        if changes is not None:
+            try:
+                base = os.path.relpath(self._base_path,
+                        os.path.dirname(os.path.abspath(filepath)))
+            except ValueError:
+                # On a different drive
+                base = None
+            if base is not None:
+                write_settings_file(filepath, filename, timestamp,
+                        changes, base=base)
+                return
+
+        write_settings_file(filepath, filename, timestamp, settings)
+        self._base_path = os.path.abspath(filepath)
+        self._base_values = {}
+        for insname, values in settings.iteritems():
+            self._base_values[insname] = dict(values)
@@ -20,7 +20,14 @@ try:
     import cPickle as pickle
 except:
     import pickle
+try:
+    import cStringIO as StringIO
+except:
+    import StringIO
 import socket
+import errno
+import select
+import struct
 import copy
 import random
 import inspect
@@ -28,9 +35,54 @@ import time
 import gobject
 import types
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 PORT = 12002
 BUFSIZE = 8192
 
+# Error numbers of a non-blocking socket operation that would block
+WOULDBLOCK_ERRNOS = (errno.EAGAIN, errno.EWOULDBLOCK,
+        getattr(errno, 'WSAEWOULDBLOCK', 10035))
+
+# Arrays of at least this many bytes are sent as raw buffers after the
+# pickled packet instead of being pickled themselves.
+RAW_BUFFER_MINSIZE = 65536
+
+# Minimum time in seconds between sending these signals to remote clients.
+# Signals emitted in between are merged into one notification, see
+# ObjectSharer.set_signal_rate_limit().
+SIGNAL_RATE_LIMITS = {
+    'changed': 0.1,
+    'new-data-point': 0.1,
+}
+
+def _coalesce_changed(pending, args, kwargs):
+    '''Merge the 'changed' dictionaries of subsequent 'changed' signals.'''
+    if len(args) == 0 or type(args[-1]) is not types.DictType:
+        return args, kwargs
+    if pending is None:
+        return args[:-1] + (dict(args[-1]), ), kwargs
+    pending[0][-1].update(args[-1])
+    return pending
+
+def _coalesce_count(pending, args, kwargs):
+    '''
+    Collapse subsequent signals into one. The number of emitted signals is
+    passed as the 'npoints' keyword argument to callbacks that asked for
+    it, see ObjectProxy.connect().
+    '''
+    if pending is None:
+        return args, kwargs
+    return pending
+
+_COALESCE_FUNCS = {
+    'changed': _coalesce_changed,
+    'new-data-point': _coalesce_count,
+}
+
 class RemoteException(Exception):
     pass
 
@@ -53,7 +105,6 @@ class ObjectSharer():
         self._last_hid = 0
         self._last_call_id = 0
         self._return_cbs = {}
-        self._return_vals = {}
 
         self._client_timeout = 60
 
@@ -62,9 +113,41 @@ class ObjectSharer():
         self._callbacks_name = {}
         self._event_callbacks = {}
 
-        # Buffers to store partly received packets
-        self._buffers = {}
+        # Packet readers to reassemble partly received packets
+        self._readers = {}
         self._send_queue = {}
+        self._send_hids = {}
+
+        # Transports doing the socket I/O of a connection in their own
+        # thread, see share_thread.py
+        self._transports = {}
+
+        # Per connection transport options, negotiated in add_client
+        self._protocols = {}
+        self._raw_buffers = {}
+
+        # Cache hits and misses of remote functions, indexed on
+        # (objname, funcname)
+        self._cache_stats = {}
+
+        # Signals subscribed to by remote connections, a set of
+        # (objname, signame) tuples indexed on connection. Peers that do
+        # not support subscriptions receive all signals.
+        self._subscriptions = {}
+        self._supports_subscriptions = {}
+        # Number of local callbacks for remote signals, indexed on
+        # (conn, objname, signame)
+        self._subscribed = {}
+        self._calling_conn = None
+
+        # Rate limited signals waiting to be sent, indexed on
+        # (objname, signame)
+        self._signal_intervals = dict(SIGNAL_RATE_LIMITS)
+        self._pending_signals = {}
+        self._pending_counts = {}
+        self._last_signal_time = {}
+        # Connections that accept the 'npoints' count of merged signals
+        self._signal_counts = {}
 
     def set_client_timeout(self, timeout):
         '''
@@ -81,6 +164,7 @@ class ObjectSharer():
         if info is None:
             logging.warning('Unable to get client root object')
             return None
+        self._negotiate_transport(conn, info)
         client = ObjectProxy(conn, info)
         self._clients.append(client)
         name = client.get_instance_name()
@@ -88,6 +172,34 @@ class ObjectSharer():
         self._do_event_callbacks('connect', client)
         return client
 
+    def _negotiate_transport(self, conn, info):
+        '''
+        Determine the pickle protocol and whether raw array buffers can be
+        used for connection 'conn'. 'info' is the object info of the root
+        object on the other side; peers that do not provide
+        get_transport_options() get pickle protocol 0.
+        '''
+
+        funcs = [f[0] for f in info['functions']]
+        if 'get_transport_options' not in funcs:
+            logging.info('Peer does not support transport options')
+            return
+
+        opts = self.call(conn, 'root', 'get_transport_options',
+            timeout=self._client_timeout)
+        if opts is None:
+            return
+
+        protocol = min(pickle.HIGHEST_PROTOCOL, opts.get('pickle_protocol', 0))
+        self._protocols[conn] = protocol
+        self._raw_buffers[conn] = (np is not None and protocol >= 2 and \
+                opts.get('raw_buffers', False))
+        self._supports_subscriptions[conn] = \
+                opts.get('signal_subscriptions', False)
+        self._signal_counts[conn] = opts.get('signal_counts', False)
+        logging.debug('Using pickle protocol %d, raw buffers: %s',
+                protocol, self._raw_buffers[conn])
+
     def get_client_for_socket(self, conn):
         for c in self.clients:
             if c.get_proxy_socket() == conn:
@@ -127,10 +239,31 @@ class ObjectSharer():
 
         if conn in self._send_queue:
             del self._send_queue[conn]
+        self._remove_send_watch(conn)
+
+        for d in (self._readers, self._protocols, self._raw_buffers,
+                self._subscriptions, self._supports_subscriptions,
+                self._signal_counts, self._transports):
+            if conn in d:
+                del d[conn]
+        for key in self._subscribed.keys():
+            if key[0] == conn:
+                del self._subscribed[key]
 
     def get_clients(self):
         return self._clients
 
+    def set_transport(self, conn, transport):
+        '''
+        Let 'transport' do the socket I/O for connection 'conn'. The
+        transport should provide:
+        - send(conn, chunks): send a list of strings or memoryviews; the
+          send queue and packet reader of 'conn' belong to the transport
+        - wait_for(call, timeout): handle incoming packets until AsyncCall
+          'call' is done, like ObjectSharer.wait_for()
+        '''
+        self._transports[conn] = transport
+
     def generate_objname(self):
         return 'obj_%d' % (random.randint(0, 1e6), )
 
@@ -254,26 +387,93 @@ class ObjectSharer():
 
         return self.find_remote_object(objname)
 
-    def _pickle_packet(self, info, data):
+    def _array_persistent_id(self, obj, buffers):
+        '''
+        Return a reference for large numpy arrays, which will be sent as a
+        raw buffer; the array is appended to 'buffers'.
+        '''
+
+        if type(obj) is not np.ndarray or obj.nbytes < RAW_BUFFER_MINSIZE:
+            return None
+        if obj.dtype.hasobject or obj.dtype.fields is not None:
+            return None
+
+        arr = np.ascontiguousarray(obj)
+        buffers.append(arr)
+        return ('ndarray', len(buffers) - 1, arr.dtype.str, arr.shape)
+
+    def _dumps(self, obj, protocol, persistent_id=None):
+        if persistent_id is None:
+            return pickle.dumps(obj, protocol)
+
+        f = StringIO.StringIO()
+        p = pickle.Pickler(f, protocol)
+        p.persistent_id = persistent_id
+        p.dump(obj)
+        return f.getvalue()
+
+    def _pickle_packet(self, info, data, conn=None):
+        '''
+        Pickle a packet for connection 'conn'.
+
+        Output: (pickled data, list of arrays to send as raw buffers)
+        '''
+
+        protocol = self._protocols.get(conn, 0)
+        buffers = []
+        if self._raw_buffers.get(conn, False):
+            persistent_id = lambda obj: \
+                    self._array_persistent_id(obj, buffers)
+        else:
+            persistent_id = None
+
         try:
-            retdata = pickle.dumps((info, data))
+            retdata = self._dumps((info, data), protocol, persistent_id)
         except Exception, e:
             msg = 'Unable to encode object: %s' % str(e)
-            retdata = pickle.dumps((info, msg))
-        return retdata
+            buffers = []
+            retdata = pickle.dumps((info, msg), protocol)
+        return retdata, buffers
 
-    def _unpickle_packet(self, data):
+    def _unpickle_packet(self, data, buffers=None):
         try:
-            return pickle.loads(data)
+            if not buffers:
+                return pickle.loads(data)
+
+            def persistent_load(pid):
+                kind, index, dtype, shape = pid
+                arr = np.frombuffer(buffers[index], dtype=dtype)
+                return arr.reshape(shape)
+
+            p = pickle.Unpickler(StringIO.StringIO(data))
+            p.persistent_load = persistent_load
+            return p.load()
+
         except Exception, e:
-            logging.warning('Unable to decode object: %s [%r]', str(e), data)
+            logging.warning('Unable to decode object: %s [%r]', str(e), data[:256])
             raise e
 
     def _send_return(self, conn, callid, retval):
         logging.debug('Returning for call %d: %r', callid, retval)
         retinfo = ('return', callid)
-        retdata = self._pickle_packet(retinfo, retval)
-        self.send_packet(conn, retdata)
+        retdata, buffers = self._pickle_packet(retinfo, retval, conn)
+        self.send_packet(conn, retdata, buffers)
+
+    def _handle_pickled(self, conn, packet, buffers=None):
+        try:
+            packet = self._unpickle_packet(packet, buffers)
+        except Exception, e:
+            logging.warning('Unable to unpickle packet')
+            return
+
+        self.handle_packet(conn, packet)
+
+    def _get_reader(self, conn):
+        reader = self._readers.get(conn, None)
+        if reader is None:
+            reader = PacketReader()
+            self._readers[conn] = reader
+        return reader
 
     def handle_data(self, conn, data):
         '''
@@ -282,35 +482,33 @@ class ObjectSharer():
         immediately.
         '''
 
-        if conn not in self._buffers:
-            self._buffers[conn] = ''
+        for packet, buffers in self._get_reader(conn).feed(data):
+            self._handle_pickled(conn, packet, buffers)
 
-        self._buffers[conn] = self._buffers[conn] + data
-
-        # Decode complete packets
-        while len(self._buffers[conn]) >= 6:
-            b = self._buffers[conn]
-
-            if b[0] != 'Q' or b[1] != 'T':
-                self._buffers[conn] = ''
-                logging.warning('Packet magic missing, dumping data')
-                return None
+    def receive(self, conn):
+        '''
+        Receive available data from socket 'conn' and handle complete
+        packets. Large packet bodies are received directly into their
+        preallocated buffers.
 
-            datalen = (ord(b[2]) << 24) + (ord(b[3]) << 16) + (ord(b[4]) << 8)  + ord(b[5])
-            if len(b) < datalen + 6:
-                logging.debug('Incomplete packet received')
-                return None
+        Output: False if the connection was closed, True otherwise.
+        '''
 
-            packet = b[6:6+datalen]
-            self._buffers[conn] = b[6+datalen:]
+        try:
+            packets = self._get_reader(conn).receive(conn)
+        except socket.error, e:
+            if e.errno in WOULDBLOCK_ERRNOS:
+                return True
+            logging.warning('Receive exception (%s), assuming client disconnected', e)
+            packets = None
 
-            try:
-                packet = self._unpickle_packet(packet)
-            except Exception, e:
-                logging.warning('Unable to unpickle packet')
-                return
+        if packets is None:
+            self._client_disconnected(conn)
+            return False
 
-            self.handle_packet(conn, packet)
+        for packet, buffers in packets:
+            self._handle_pickled(conn, packet, buffers)
+        return True
 
     def handle_packet(self, conn, packet):
         '''
@@ -353,12 +551,14 @@ class ObjectSharer():
 
         obj = self._objects[objname]
         func = getattr(obj, funcname)
+        self._calling_conn = conn
         try:
             ret = func(*args, **kwargs)
         except Exception, e:
             import traceback
             tb = traceback.format_exc(15)
             ret = RemoteException('%s\n%s' % (e, tb))
+        self._calling_conn = None
 
         if info[0] == 'signal':
             # No need to send return
@@ -375,7 +575,7 @@ class ObjectSharer():
         try:
             ret = conn.send(data)
         except socket.error, e:
-            if e.errno not in (10035, ):
+            if e.errno not in WOULDBLOCK_ERRNOS:
                 logging.warning('Send exception (%s), assuming client disconnected', e)
                 self._client_disconnected(conn)
                 return -1
@@ -389,116 +589,191 @@ class ObjectSharer():
         '''
 
         for conn in self._send_queue.keys():
-            datalist = self._send_queue[conn]
-            while len(datalist) > 0:
-                nsent = self._do_send_raw(conn, datalist[0])
-
-                # Ok
-                if nsent == len(datalist[0]):
-                    del datalist[0]
-
-                # Failed, signals disconnection so remove send queue
-                elif nsent == -1:
-                    if conn in self._send_queue:
-                        del self._send_queue[conn]
-                    break
-
-                # Partially sent
-                else:
-                    datalist[0] = datalist[0][nsent:]
-                    break
+            if conn not in self._transports:
+                self._process_conn_send_queue(conn)
 
         return True
 
-    def send_packet(self, conn, data):
+    def _process_conn_send_queue(self, conn):
+        '''
+        Send as much as possible of the queue for 'conn'. Queue items are
+        memoryviews, so that partial sends do not copy the data.
+
+        Output: True if data remains in the queue.
+        '''
+
+        datalist = self._send_queue.get(conn, None)
+        if datalist is None:
+            return False
+
+        while len(datalist) > 0:
+            nsent = self._do_send_raw(conn, datalist[0])
+
+            # Ok
+            if nsent == len(datalist[0]):
+                del datalist[0]
+
+            # Failed, signals disconnection so remove send queue
+            elif nsent == -1:
+                if conn in self._send_queue:
+                    del self._send_queue[conn]
+                return False
+
+            # Partially sent
+            else:
+                datalist[0] = datalist[0][nsent:]
+                break
+
+        return len(datalist) > 0
+
+    def _send_watch_cb(self, conn, condition):
+        if self._process_conn_send_queue(conn):
+            return True
+        self._send_hids.pop(conn, None)
+        return False
+
+    def _remove_send_watch(self, conn):
+        hid = self._send_hids.pop(conn, None)
+        if hid is not None:
+            gobject.source_remove(hid)
+
+    def send_packet(self, conn, data, buffers=None):
+        '''
+        Send pickled 'data' through 'conn', followed by the numpy arrays
+        in 'buffers' as raw data. Data that can not be sent immediately
+        is sent when the socket becomes writable.
+        '''
+
         dlen = len(data)
         if dlen > 0xffffffffL:
             logging.error('Trying to send too long packet: %d', dlen)
             return -1
 
-        tosend = 'QT%c%c%c%c' % ((dlen&0xff000000)>>24, \
-            (dlen&0x00ff0000)>>16, (dlen&0x0000ff00)>>8, (dlen&0x000000ff))
-        tosend += data
+        if buffers:
+            buflens = [arr.nbytes for arr in buffers]
+            header = 'QB' + struct.pack('>II', dlen, len(buffers)) + \
+                    struct.pack('>%dQ' % len(buffers), *buflens)
+        else:
+            header = 'QT%c%c%c%c' % ((dlen&0xff000000)>>24, \
+                (dlen&0x00ff0000)>>16, (dlen&0x0000ff00)>>8, (dlen&0x000000ff))
+
+        chunks = [memoryview(header + data)]
+        if buffers:
+            for arr in buffers:
+                chunks.append(memoryview(arr.reshape(-1).view(np.uint8)))
+
+        transport = self._transports.get(conn, None)
+        if transport is not None:
+            transport.send(conn, chunks)
+            return
 
         if conn not in self._send_queue:
             self._send_queue[conn] = []
-        self._send_queue[conn].append(tosend)
-        self._process_send_queue()
+        self._send_queue[conn].extend(chunks)
 
-    def _call_cb(self, callid, val):
-        if callid in self._return_vals:
-            logging.warning('Received late reply for call %d', callid)
-            del self._return_vals[callid]
-        else:
-            self._return_vals[callid] = val
+        if self._process_conn_send_queue(conn) and \
+                conn not in self._send_hids:
+            self._send_hids[conn] = gobject.io_add_watch(conn,
+                    gobject.IO_OUT, self._send_watch_cb)
+
+    def _late_reply_cb(self, callid, val):
+        logging.warning('Received late reply for call %d', callid)
+
+    def _send_call(self, conn, info, objname, funcname, args, kwargs):
+        logging.debug('Calling %s.%s(%r, %r), info=%r', objname, funcname, args, kwargs, info)
+        callinfo = (objname, funcname, args, kwargs)
+        cmd, buffers = self._pickle_packet(info, callinfo, conn)
+        self.send_packet(conn, cmd, buffers)
+
+    def _new_call_id(self):
+        self._last_call_id += 1
+        return self._last_call_id
 
     def call(self, conn, objname, funcname, *args, **kwargs):
         '''
         Call a function through connection 'conn'
+
+        Special keyword arguments:
+            callback: function to call with the return value; the call
+                does not block.
+            signal (bool): if True, do not expect a return value.
+            timeout (float): time to wait for the return value of a
+                blocking call, in seconds.
         '''
 
         cb = kwargs.pop('callback', None)
         is_signal = kwargs.pop('signal', False)
         timeout = kwargs.pop('timeout', self.TIMEOUT)
-        blocking = (cb is None and not is_signal)
 
-        if not is_signal:
-            self._last_call_id += 1
-            callid = self._last_call_id
-            if cb is not None:
-                self._return_cbs[callid] = cb
-            else:
-                self._return_cbs[callid] = lambda val: self._call_cb(callid, val)
+        if is_signal:
+            self._send_call(conn, ('signal', ), objname, funcname, args, kwargs)
+            return
 
-            info = ('call', callid)
-        else:
-            cb = None
-            info = ('signal', )
+        if cb is not None:
+            callid = self._new_call_id()
+            self._return_cbs[callid] = cb
+            self._send_call(conn, ('call', callid), objname, funcname, args, kwargs)
+            return
 
-        logging.debug('Calling %s.%s(%r, %r), info=%r, blocking=%r', objname, funcname, args, kwargs, info, blocking)
+        ret = self.call_async(conn, objname, funcname, *args, **kwargs)
+        return ret.result(timeout=timeout)
 
-        callinfo = (objname, funcname, args, kwargs)
-        cmd = self._pickle_packet(info, callinfo)
-        start_time = time.time()
-        self.send_packet(conn, cmd)
+    def call_async(self, conn, objname, funcname, *args, **kwargs):
+        '''
+        Call a function through connection 'conn' without waiting for the
+        return value. Several calls can be outstanding on a connection.
 
-        if not blocking:
-            return
+        Output: AsyncCall object; use its result() function to get the
+        return value.
+        '''
 
-        # Wait for return
-        while time.time() - start_time < timeout:
-            if callid in self._return_vals:
-                break
+        callid = self._new_call_id()
+        ret = AsyncCall(self, conn, callid)
+        self._return_cbs[callid] = ret._set_result
+        self._send_call(conn, ('call', callid), objname, funcname, args, kwargs)
+        return ret
 
-            # Don't depend on a main loop to receive data while blocking
-            import select
-            lists = select.select([conn], [], [], 0.1)
-            if len(lists[0]) > 0:
-                try:
-                    data = conn.recv(BUFSIZE)
-                except:
-                    # Cope with strange windows errors?
-                    time.sleep(0.002)
-                    continue
-
-                if len(data) == 0:
-                    self._client_disconnected(conn)
-                    return
-                self.handle_data(conn, data)
+    def wait_for(self, conn, call, timeout):
+        '''
+        Handle data of connection 'conn' until AsyncCall 'call' is done.
+        Does not depend on a main loop; returns as soon as the return
+        packet is handled.
+
+        Output: True if the call is done, False on timeout or disconnect.
+        '''
+
+        transport = self._transports.get(conn, None)
+        if transport is not None:
+            return transport.wait_for(call, timeout)
+
+        end_time = time.time() + timeout
+        while not call.done():
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return False
+
+            if len(self._send_queue.get(conn, [])) > 0:
+                wlist = [conn]
             else:
-                time.sleep(0.002)
-
-        if callid in self._return_vals:
-            ret = self._return_vals[callid]
-            del self._return_vals[callid]
-            if isinstance(ret, Exception):
-                raise Exception('Remote error: %s' % str(ret))
-            return ret
-        else:
-            logging.warning('Blocking call %d timed out', callid)
-            self._return_vals[callid] = None    # Mark as timed out
+                wlist = []
+            try:
+                lists = select.select([conn], wlist, [], remaining)
+            except select.error, e:
+                logging.warning('Select error: %s', e)
+                return False
 
-        return None
+            if len(lists[1]) > 0:
+                self._process_conn_send_queue(conn)
+            if len(lists[0]) > 0:
+                if not self.receive(conn):
+                    return False
+
+        return True
+
+    def _call_timed_out(self, callid):
+        if callid in self._return_cbs:
+            self._return_cbs[callid] = \
+                    lambda val: self._late_reply_cb(callid, val)
 
     def connect(self, objname, signame, callback, *args, **kwargs):
         '''
@@ -523,6 +798,14 @@ class ObjectSharer():
 
         return self._last_hid
 
+    def set_callback_counts(self, hid, counts):
+        '''
+        Set whether callback 'hid' receives the number of merged signals
+        as keyword argument 'npoints'.
+        '''
+        if hid in self._callbacks_hid:
+            self._callbacks_hid[hid]['counts'] = counts
+
     def disconnect(self, hid):
         if hid in self._callbacks_hid:
             del self._callbacks_hid[hid]
@@ -533,18 +816,158 @@ class ObjectSharer():
                     del self._callbacks_name[name][index]
                     break
 
+    def count_cache(self, objname, funcname, hit):
+        key = (objname, funcname)
+        if key not in self._cache_stats:
+            self._cache_stats[key] = [0, 0]
+        if hit:
+            self._cache_stats[key][0] += 1
+        else:
+            self._cache_stats[key][1] += 1
+
+    def get_cache_stats(self):
+        '''
+        Return the number of cache hits and misses of remote function
+        calls, as a dictionary of (objname, funcname) -> (hits, misses).
+        '''
+        ret = {}
+        for key, (hits, misses) in self._cache_stats.iteritems():
+            ret[key] = (hits, misses)
+        return ret
+
+    def reset_cache_stats(self):
+        self._cache_stats = {}
+
+    def get_calling_connection(self):
+        '''
+        Return the connection of the remote call that is being handled, or
+        None when not called from a remote call.
+        '''
+        return self._calling_conn
+
+    def subscribe(self, conn, objname, signame):
+        '''
+        Called by ObjectProxy instances to tell the remote side through
+        'conn' that signal 'signame' of 'objname' should be sent.
+        '''
+        key = (conn, objname, signame)
+        n = self._subscribed.get(key, 0)
+        self._subscribed[key] = n + 1
+        if n == 0 and self._supports_subscriptions.get(conn, False):
+            self.call(conn, 'root', 'subscribe_signal', objname, signame,
+                    signal=True)
+
+    def unsubscribe(self, conn, objname, signame):
+        key = (conn, objname, signame)
+        n = self._subscribed.get(key, 0)
+        if n > 1:
+            self._subscribed[key] = n - 1
+            return
+        if key in self._subscribed:
+            del self._subscribed[key]
+        if n == 1 and self._supports_subscriptions.get(conn, False):
+            self.call(conn, 'root', 'unsubscribe_signal', objname, signame,
+                    signal=True)
+
+    def add_subscription(self, conn, objname, signame):
+        '''Send signal 'signame' of 'objname' to connection 'conn'.'''
+        if conn not in self._subscriptions:
+            self._subscriptions[conn] = set()
+        self._subscriptions[conn].add((objname, signame))
+
+    def remove_subscription(self, conn, objname, signame):
+        if conn in self._subscriptions:
+            self._subscriptions[conn].discard((objname, signame))
+
+    def _get_signal_clients(self, objname, signame):
+        '''Return the clients that should receive a signal.'''
+        ret = []
+        key = (objname, signame)
+        for client in self._clients:
+            conn = client.get_connection()
+            if self._supports_subscriptions.get(conn, False) and \
+                    key not in self._subscriptions.get(conn, ()):
+                continue
+            ret.append(client)
+        return ret
+
+    def set_signal_rate_limit(self, signame, interval):
+        '''
+        Set the minimum time between sending signal 'signame' to remote
+        clients. Signals emitted within this interval are merged; this is
+        supported for 'changed' (the changed dictionaries are merged) and
+        'new-data-point' (one signal; callbacks connected with counts=True
+        get the number of signals as keyword argument 'npoints').
+
+        Input:
+            signame (string): signal name
+            interval (float): time in seconds, 0 or None to disable
+        '''
+
+        if signame not in _COALESCE_FUNCS:
+            raise ValueError('Signal %s can not be coalesced' % signame)
+        if interval:
+            self._signal_intervals[signame] = interval
+        elif signame in self._signal_intervals:
+            del self._signal_intervals[signame]
+            for key in self._pending_signals.keys():
+                if key[1] == signame:
+                    self._flush_signal(key)
+
     def emit_signal(self, objname, signame, *args, **kwargs):
+        interval = self._signal_intervals.get(signame, 0)
+        if interval == 0:
+            self._send_signal(objname, signame, args, kwargs)
+            return
+
+        key = (objname, signame)
+        pending = self._pending_signals.get(key, None)
+        if pending is None and \
+                len(self._get_signal_clients(objname, signame)) == 0:
+            return
+
+        self._pending_signals[key] = \
+                _COALESCE_FUNCS[signame](pending, args, kwargs)
+        self._pending_counts[key] = self._pending_counts.get(key, 0) + 1
+        if pending is not None:
+            # Already scheduled
+            return
+
+        delay = self._last_signal_time.get(key, 0) + interval - time.time()
+        if delay <= 0:
+            self._flush_signal(key)
+        else:
+            gobject.timeout_add(int(delay * 1000) + 1, self._flush_signal, key)
+
+    def _flush_signal(self, key):
+        pending = self._pending_signals.pop(key, None)
+        npoints = self._pending_counts.pop(key, None)
+        if pending is not None:
+            self._last_signal_time[key] = time.time()
+            self._send_signal(key[0], key[1], pending[0], pending[1],
+                    npoints=npoints)
+        return False
+
+    def _send_signal(self, objname, signame, args, kwargs, npoints=None):
+        clients = self._get_signal_clients(objname, signame)
         logging.debug('Emitting %s(%r, %r) for %s to %d clients',
-                signame, args, kwargs, objname, len(self._clients))
+                signame, args, kwargs, objname, len(clients))
 
+        kwargs = dict(kwargs)
         kwargs['signal'] = True
-        for client in self._clients:
-            client.receive_signal(objname, signame, *args, **kwargs)
+        for client in clients:
+            if npoints is not None and \
+                    self._signal_counts.get(client.get_connection(), False):
+                client.receive_signal(objname, signame, *args,
+                        **dict(kwargs, _npoints=npoints))
+            else:
+                client.receive_signal(objname, signame, *args, **kwargs)
 
     def receive_signal(self, objname, signame, *args, **kwargs):
         logging.debug('Received signal %s(%r, %r) from %s',
                 signame, args, kwargs, objname)
 
+        npoints = kwargs.pop('_npoints', None)
         ncalls = 0
         start = time.time()
         name = '%s__%s' % (objname, signame)
@@ -555,6 +978,8 @@ class ObjectSharer():
                     fargs = list(args)
                     fargs.extend(info['args'])
                     fkwargs = kwargs.copy()
+                    if npoints is not None and info.get('counts', False):
+                        fkwargs['npoints'] = npoints
                     fkwargs.update(info['kwargs'])
                     info['function'](*fargs, **fkwargs)
                     ncalls += 1
@@ -573,6 +998,197 @@ class ObjectSharer():
         for client in self._clients:
             client.get_connection().close()
 
+class AsyncCall():
+    '''
+    Outstanding remote call, as returned by ObjectSharer.call_async().
+    '''
+
+    def __init__(self, sharer, conn, callid):
+        self._sharer = sharer
+        self._conn = conn
+        self._callid = callid
+        self._done = False
+        self._value = None
+        self._callbacks = []
+
+    def __repr__(self):
+        return '<AsyncCall %d, done=%s>' % (self._callid, self._done)
+
+    def _set_result(self, val):
+        self._value = val
+        self._done = True
+        for cb in self._callbacks:
+            try:
+                cb(val)
+            except Exception, e:
+                logging.warning('Callback for call %d failed: %s',
+                        self._callid, e)
+        self._callbacks = []
+
+    def get_call_id(self):
+        return self._callid
+
+    def get_connection(self):
+        return self._conn
+
+    def done(self):
+        '''Return whether the return value has been received.'''
+        return self._done
+
+    def add_done_callback(self, cb):
+        '''
+        Call cb(return value) when the return value is received, or
+        immediately if it already is.
+        '''
+        if self._done:
+            cb(self._value)
+        else:
+            self._callbacks.append(cb)
+
+    def result(self, timeout=None):
+        '''
+        Wait for and return the return value. Raises an exception if the
+        remote function raised one. Returns None on timeout.
+
+        Input:
+            timeout (float): time to wait in seconds, default
+                ObjectSharer.TIMEOUT
+        '''
+
+        if timeout is None:
+            timeout = self._sharer.TIMEOUT
+        if not self._done and \
+                not self._sharer.wait_for(self._conn, self, timeout):
+            logging.warning('Blocking call %d timed out or connection lost',
+                    self._callid)
+            self._sharer._call_timed_out(self._callid)
+            return None
+
+        if isinstance(self._value, Exception):
+            raise Exception('Remote error: %s' % str(self._value))
+        return self._value
+
+class PacketReader():
+    '''
+    Reassemble packets from the data received on a connection.
+
+    The header is read first; after that the body and any raw buffers are
+    allocated at their full size and filled in place, so that receiving a
+    packet takes time proportional to its size.
+
+    Packets start with 'QT' and a 4-byte length, followed by the pickled
+    data. Packets with raw buffers start with 'QB', the 4-byte pickle
+    length, the 4-byte number of buffers and an 8-byte length for each
+    buffer, followed by the pickled data and the buffers.
+    '''
+
+    def __init__(self):
+        self._header = bytearray(10)
+        self._reset()
+
+    def _reset(self):
+        self._stage = 'header'
+        self._set_target(self._header, 0, 6)
+        self._body = None
+        self._buflens = []
+        self._buffers = []
+
+    def _set_target(self, buf, start, end):
+        self._target = memoryview(buf)[start:end]
+        self._pos = 0
+
+    def _target_done(self):
+        '''
+        Move to the next stage after the current target was filled.
+        Output: a packet (pickled data, buffers) if complete, else None
+        '''
+
+        while self._pos == len(self._target):
+            if self._stage == 'header':
+                magic = str(self._header[:2])
+                if magic == 'QT':
+                    datalen = struct.unpack('>I', str(self._header[2:6]))[0]
+                    self._start_body(datalen)
+                elif magic == 'QB':
+                    self._stage = 'qbheader'
+                    self._set_target(self._header, 6, 10)
+                else:
+                    logging.warning('Packet magic missing, dumping data')
+                    self._reset()
+                    return None
+
+            elif self._stage == 'qbheader':
+                nbufs = struct.unpack('>I', str(self._header[6:10]))[0]
+                self._stage = 'buflens'
+                self._set_target(bytearray(8 * nbufs), 0, 8 * nbufs)
+
+            elif self._stage == 'buflens':
+                n = len(self._target) / 8
+                self._buflens = list(struct.unpack('>%dQ' % n,
+                    self._target.tobytes()))
+                datalen = struct.unpack('>I', str(self._header[2:6]))[0]
+                self._start_body(datalen)
+
+            elif self._stage == 'body' or self._stage == 'buffers':
+                if len(self._buffers) < len(self._buflens):
+                    buf = bytearray(self._buflens[len(self._buffers)])
+                    self._buffers.append(buf)
+                    self._stage = 'buffers'
+                    self._set_target(buf, 0, len(buf))
+                else:
+                    packet = (str(self._body), self._buffers)
+                    self._reset()
+                    return packet
+
+        return None
+
+    def _start_body(self, datalen):
+        self._stage = 'body'
+        self._body = bytearray(datalen)
+        self._set_target(self._body, 0, datalen)
+
+    def feed(self, data):
+        '''
+        Process received data.
+        Output: list of complete packets (pickled data, raw buffers)
+        '''
+
+        packets = []
+        dpos = 0
+        while dpos < len(data):
+            n = min(len(self._target) - self._pos, len(data) - dpos)
+            self._target[self._pos:self._pos+n] = data[dpos:dpos+n]
+            self._pos += n
+            dpos += n
+            packet = self._target_done()
+            if packet is not None:
+                packets.append(packet)
+
+        return packets
+
+    def receive(self, sock):
+        '''
+        Receive data from 'sock'. When a large part of a body or raw
+        buffer is outstanding, receive directly into it.
+        Output: list of complete packets, or None if the connection closed
+        '''
+
+        remaining = len(self._target) - self._pos
+        if remaining < BUFSIZE:
+            data = sock.recv(BUFSIZE)
+            if len(data) == 0:
+                return None
+            return self.feed(data)
+
+        n = sock.recv_into(self._target[self._pos:], remaining)
+        if n == 0:
+            return None
+        self._pos += n
+        packet = self._target_done()
+        if packet is not None:
+            return [packet]
+        return []
+
 class SharedObject():
     '''
     Server side object that can be shared and emit signals.
@@ -710,16 +1326,82 @@ class _FunctionCall():
 
         self._cached_result = None
 
+        # Results cached per set of arguments, see cache_result()
+        self._use_cache = 'cache_invalidate' in self._share_options
+        self._cache = {}
+        self._generation = 0
+        self._invalidate_connected = False
+
+    def _get_cache_key(self, args, kwargs):
+        if 'callback' in kwargs or 'signal' in kwargs:
+            return None
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _connect_invalidate(self):
+        if self._invalidate_connected:
+            return
+        self._invalidate_connected = True
+        for signame in self._share_options['cache_invalidate']:
+            helper.connect(self._objname, signame, self._invalidate_cb)
+            helper.subscribe(self._conn, self._objname, signame)
+
+    def _invalidate_cb(self, *args, **kwargs):
+        self.clear_cache()
+
+    def clear_cache(self):
+        '''Drop cached results.'''
+        self._cached_result = None
+        self._cache = {}
+        self._generation += 1
+
     def __call__(self, *args, **kwargs):
         cache = self._share_options.get('cache_result', False) 
         if cache and self._cached_result is not None:
+            helper.count_cache(self._objname, self._funcname, True)
             return self._cached_result
 
+        key = None
+        if self._use_cache:
+            key = self._get_cache_key(args, kwargs)
+        if key is not None:
+            entry = self._cache.get(key, None)
+            if entry is not None and \
+                    (entry[0] is None or entry[0] > time.time()):
+                helper.count_cache(self._objname, self._funcname, True)
+                # Callers may modify the result, never hand out the cached one
+                return copy.deepcopy(entry[1])
+
+        if cache or key is not None:
+            helper.count_cache(self._objname, self._funcname, False)
+        if key is not None:
+            # Subscribe first, a signal during the call must invalidate
+            self._connect_invalidate()
+            generation = self._generation
+
         ret = helper.call(self._conn, self._objname, self._funcname, *args, **kwargs)
         if cache:
             self._cached_result = ret
+        elif key is not None and ret is not None and \
+                generation == self._generation:
+            ttl = self._share_options.get('cache_ttl', None)
+            if ttl is not None:
+                ttl = time.time() + ttl
+            self._cache[key] = (ttl, copy.deepcopy(ret))
         return ret
 
+    def call_async(self, *args, **kwargs):
+        '''
+        Call the remote function without waiting for the result.
+        Output: AsyncCall object
+        '''
+        return helper.call_async(self._conn, self._objname, self._funcname,
+                *args, **kwargs)
+
 class ObjectProxy():
     '''
     Client side object proxy.
@@ -743,11 +1425,26 @@ class ObjectProxy():
     def get_connection(self):
         return self.__conn
 
-    def connect(self, signame, func):
-        return helper.connect(self.__name, signame, func)
+    def connect(self, signame, func, counts=False):
+        '''
+        Connect func to signal 'signame' of the remote object.
+
+        If counts is True and the remote side merges subsequent signals
+        (see ObjectSharer.set_signal_rate_limit()), func is called with
+        the number of merged signals as keyword argument 'npoints'.
+        '''
+        hid = helper.connect(self.__name, signame, func)
+        helper.set_callback_counts(hid, counts)
+        self.__callbacks[hid] = signame
+        helper.subscribe(self.__conn, self.__name, signame)
+        return hid
 
     def disconnect(self, hid):
-        return helper.disconnect(hid)
+        ret = helper.disconnect(hid)
+        if hid in self.__callbacks:
+            helper.unsubscribe(self.__conn, self.__name, self.__callbacks[hid])
+            del self.__callbacks[hid]
+        return ret
 
     def get_proxy_client(self):
         '''Return the client where this proxy is pointing to'''
@@ -757,9 +1454,28 @@ class ObjectProxy():
         '''Return the connection this proxy is using'''
         return self.__conn
 
-def cache_result(f):
-    f._share_options = {'cache_result': True}
-    return f
+def cache_result(f=None, ttl=None, invalidate=()):
+    '''
+    Decorator to let remote clients cache the return value of a function.
+
+    Used as @cache_result the first return value is cached forever. Used
+    as @cache_result(ttl=10, invalidate=('parameter-added', )) the return
+    values are cached per set of arguments, for at most 'ttl' seconds
+    (None: no limit), and are dropped when the object emits one of the
+    signals in 'invalidate'.
+    '''
+
+    if f is not None:
+        f._share_options = {'cache_result': True}
+        return f
+
+    def decorator(f):
+        f._share_options = {
+            'cache_ttl': ttl,
+            'cache_invalidate': tuple(invalidate),
+        }
+        return f
+    return decorator
 
 class RootObject(SharedObject):
 
@@ -796,6 +1512,15 @@ class RootObject(SharedObject):
     def receive_signal(self, objname, signame, *args, **kwargs):
         helper.receive_signal(objname, signame, *args, **kwargs)
 
+    def subscribe_signal(self, objname, signame):
+        '''Send signal 'signame' of 'objname' to the calling connection.'''
+        helper.add_subscription(helper.get_calling_connection(),
+                objname, signame)
+
+    def unsubscribe_signal(self, objname, signame):
+        helper.remove_subscription(helper.get_calling_connection(),
+                objname, signame)
+
     def list_objects(self):
         return self._objects.keys()
 
@@ -803,6 +1528,18 @@ class RootObject(SharedObject):
     def get_id(self):
         return self._id
 
+    def get_transport_options(self):
+        '''
+        Return the transport features supported by this side, used to
+        negotiate the pickle protocol and raw array buffers.
+        '''
+        return {
+            'pickle_protocol': pickle.HIGHEST_PROTOCOL,
+            'raw_buffers': np is not None,
+            'signal_subscriptions': True,
+            'signal_counts': True,
+        }
+
     def hello_world(self, *args, **kwargs):
         return 'Hello world!'
 
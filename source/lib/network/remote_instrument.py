@@ -40,12 +40,11 @@ class InstrumentServer(objsh.SharedObject):
         return qt.instruments.get_instrument_names()
 
     def get_ins_parameters(self, insname):
-        params = copy.copy(qt.instruments[insname].get_parameters())
-        for name in params.keys():
-            params[name] = copy.copy(params[name])
-            params[name]['get_func'] = None
-            params[name]['set_func'] = None
-        return params
+        return qt.instruments[insname].snapshot(options=True)
+
+    def snapshot(self, options=False):
+        '''Return the parameter values of all instruments in one call.'''
+        return qt.instruments.snapshot(options=options)
 
     def get_ins_functions(self, insname):
         funcs = copy.copy(qt.instruments[insname].get_functions())
@@ -10,8 +10,16 @@ class Handler(tcpservergtk.GlibTCPHandler):
     def __init__(self, sock, client_address, server):
         tcpservergtk.GlibTCPHandler.__init__(self, sock, client_address, server,
                 packet_len=True)
+        # Send small packets (calls, return values) immediately
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.client = objsh.helper.add_client(self.socket, self)
 
+    def _handle_recv(self, sock, condition):
+        if not objsh.helper.receive(self.socket):
+            self._handle_hup()
+            return False
+        return True
+
     def handle(self, data):
         if len(data) > 0:
             data = objsh.helper.handle_data(self.socket, data)
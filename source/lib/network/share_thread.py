@@ -0,0 +1,465 @@
+# share_thread.py, object sharer transport doing socket I/O in a thread
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Alternative to share_gtk that keeps network traffic off the main loop.
+
+All sockets are handled by one I/O thread: it accepts connections,
+receives and reassembles packets, unpickles them and sends the queued
+data. The send queues and packet readers of the connections belong to
+the I/O thread; data to send is handed over through a queue. Decoded
+packets are passed to the main thread through another queue and handled
+from an idle callback, at most MAX_DISPATCH_TIME seconds at a time, so
+that a burst of requests does not delay a measurement loop.
+
+The wire protocol is the same as with share_gtk, both can be mixed.
+Select with config['network_backend'] = 'thread'.
+'''
+
+import object_sharer as objsh
+import socket
+import select
+import threading
+import Queue
+import time
+import re
+import logging
+import gobject
+
+# Maximum time to spend handling packets from one idle callback
+MAX_DISPATCH_TIME = 0.005
+
+def _make_wakeup_pair():
+    '''
+    Return a pair of connected sockets used to wake up the I/O thread.
+    socket.socketpair() is not available on Windows.
+    '''
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    wsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    wsock.connect(listener.getsockname())
+    rsock, addr = listener.accept()
+    listener.close()
+    wsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    rsock.setblocking(0)
+    return rsock, wsock
+
+class ThreadedTransport():
+    '''
+    Do the socket I/O of object sharer connections in a separate thread.
+    '''
+
+    def __init__(self):
+        # Needed to release the interpreter lock while the main loop is
+        # waiting and to call gobject.idle_add() from the I/O thread.
+        gobject.threads_init()
+
+        self._conns = []
+        self._servers = []
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        # Data to send, as (conn, chunks) items
+        self._outgoing = Queue.Queue()
+        # Only used by the I/O thread, indexed on connection
+        self._send_queues = {}
+        self._readers = {}
+        self._dispatch_hid = None
+        self._wakeup_pending = False
+        self._wake_r, self._wake_w = _make_wakeup_pair()
+        # Used to wake up a thread blocking in wait_for()
+        self._waiting = False
+        self._notify_r, self._notify_w = _make_wakeup_pair()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def add_server(self, server):
+        self._lock.acquire()
+        try:
+            self._servers.append(server)
+        finally:
+            self._lock.release()
+        self.wakeup()
+
+    def remove_server(self, server):
+        self._lock.acquire()
+        try:
+            if server in self._servers:
+                self._servers.remove(server)
+        finally:
+            self._lock.release()
+        self.wakeup()
+
+    def add_connection(self, conn):
+        '''
+        Start handling connection 'conn'. Should be called before adding
+        the client with ObjectSharer.add_client().
+        '''
+
+        conn.setblocking(0)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        objsh.helper.set_transport(conn, self)
+        self._lock.acquire()
+        try:
+            self._conns.append(conn)
+        finally:
+            self._lock.release()
+        self.wakeup()
+
+    def send(self, conn, chunks):
+        '''Queue a list of strings or memoryviews to send through conn.'''
+        self._outgoing.put((conn, chunks))
+        self.wakeup()
+
+    def wakeup(self):
+        '''Wake up the I/O thread, e.g. to send queued data.'''
+        self._lock.acquire()
+        try:
+            if self._wakeup_pending:
+                return
+            self._wakeup_pending = True
+        finally:
+            self._lock.release()
+        self._wake_w.send('x')
+
+    def _take_outgoing(self):
+        while True:
+            try:
+                conn, chunks = self._outgoing.get_nowait()
+            except Queue.Empty:
+                return
+            self._lock.acquire()
+            try:
+                if conn not in self._conns:
+                    continue
+            finally:
+                self._lock.release()
+            if conn not in self._send_queues:
+                self._send_queues[conn] = []
+            self._send_queues[conn].extend(chunks)
+
+    def _run(self):
+        while True:
+            self._lock.acquire()
+            try:
+                conns = list(self._conns)
+                servers = list(self._servers)
+            finally:
+                self._lock.release()
+
+            self._take_outgoing()
+            wlist = []
+            for conn in conns:
+                if len(self._send_queues.get(conn, [])) > 0:
+                    wlist.append(conn)
+
+            rlist = [self._wake_r] + conns + [s.socket for s in servers]
+            try:
+                rlist, wlist, xlist = select.select(rlist, wlist, [])
+            except (select.error, socket.error), e:
+                # A socket was closed from another thread
+                self._remove_closed()
+                continue
+
+            if self._wake_r in rlist:
+                self._lock.acquire()
+                try:
+                    self._wakeup_pending = False
+                    self._wake_r.recv(4096)
+                finally:
+                    self._lock.release()
+
+            for conn in wlist:
+                self._send(conn)
+
+            for server in servers:
+                if server.socket in rlist:
+                    self._accept(server)
+
+            for conn in conns:
+                if conn in rlist:
+                    self._receive(conn)
+
+    def _remove_closed(self):
+        self._lock.acquire()
+        try:
+            closed = []
+            for conn in list(self._conns):
+                try:
+                    conn.fileno()
+                    select.select([conn], [], [], 0)
+                except (select.error, socket.error), e:
+                    self._conns.remove(conn)
+                    closed.append(conn)
+            for server in list(self._servers):
+                try:
+                    select.select([server.socket], [], [], 0)
+                except (select.error, socket.error), e:
+                    self._servers.remove(server)
+        finally:
+            self._lock.release()
+
+        for conn in closed:
+            self._send_queues.pop(conn, None)
+            self._readers.pop(conn, None)
+            self._put(('disconnect', conn))
+
+    def _accept(self, server):
+        try:
+            sock, addr = server.socket.accept()
+        except socket.error, e:
+            return
+        if not server.allow_client(addr[0]):
+            logging.warning('Not allowing connection from %s', addr)
+            sock.close()
+            return
+
+        logging.info('Allowing connection from %s', addr)
+        self.add_connection(sock)
+        self._put(('connect', sock))
+
+    def _receive(self, conn):
+        try:
+            if conn not in self._readers:
+                self._readers[conn] = objsh.PacketReader()
+            packets = self._readers[conn].receive(conn)
+        except socket.error, e:
+            if e.errno in objsh.WOULDBLOCK_ERRNOS:
+                return
+            logging.warning('Receive exception (%s), assuming client disconnected', e)
+            packets = None
+
+        if packets is None:
+            self._close(conn)
+            return
+
+        for data, buffers in packets:
+            try:
+                packet = objsh.helper._unpickle_packet(data, buffers)
+            except Exception, e:
+                logging.warning('Unable to unpickle packet')
+                continue
+            self._put(('packet', conn, packet))
+
+    def _send(self, conn):
+        queue = self._send_queues.get(conn, None)
+        while queue:
+            try:
+                nsent = conn.send(queue[0])
+            except socket.error, e:
+                if e.errno in objsh.WOULDBLOCK_ERRNOS:
+                    return
+                logging.warning('Send exception (%s), assuming client disconnected', e)
+                self._close(conn)
+                return
+
+            if nsent == len(queue[0]):
+                del queue[0]
+            else:
+                queue[0] = queue[0][nsent:]
+                return
+
+    def _close(self, conn):
+        self._lock.acquire()
+        try:
+            if conn in self._conns:
+                self._conns.remove(conn)
+        finally:
+            self._lock.release()
+        self._send_queues.pop(conn, None)
+        self._readers.pop(conn, None)
+        try:
+            conn.close()
+        except socket.error, e:
+            pass
+        self._put(('disconnect', conn))
+
+    def _put(self, item):
+        self._queue.put(item)
+        self._lock.acquire()
+        try:
+            if self._waiting:
+                self._waiting = False
+                self._notify_w.send('x')
+            if self._dispatch_hid is None:
+                self._dispatch_hid = gobject.idle_add(self._dispatch_cb)
+        finally:
+            self._lock.release()
+
+    def _wait_for_item(self, timeout):
+        '''Block until an item is put in the queue, or for 'timeout' s.'''
+        self._lock.acquire()
+        try:
+            if not self._queue.empty():
+                return
+            self._waiting = True
+        finally:
+            self._lock.release()
+
+        select.select([self._notify_r], [], [], timeout)
+        self._lock.acquire()
+        try:
+            self._waiting = False
+            try:
+                self._notify_r.recv(4096)
+            except socket.error, e:
+                pass
+        finally:
+            self._lock.release()
+
+    def _handle_item(self, item):
+        if item[0] == 'packet':
+            objsh.helper.handle_packet(item[1], item[2])
+        elif item[0] == 'connect':
+            objsh.helper.add_client(item[1], self)
+        elif item[0] == 'disconnect':
+            objsh.helper._client_disconnected(item[1])
+
+    def dispatch(self, timeout=None):
+        '''
+        Handle queued packets in the calling (main) thread.
+
+        Input:
+            timeout (float): maximum time to spend, or None to handle all
+                packets
+
+        Output: True if packets remain in the queue
+        '''
+
+        if timeout is not None:
+            tend = time.time() + timeout
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                return False
+            self._handle_item(item)
+            if timeout is not None and time.time() > tend:
+                return not self._queue.empty()
+
+    def _dispatch_cb(self):
+        self._lock.acquire()
+        try:
+            self._dispatch_hid = None
+        finally:
+            self._lock.release()
+
+        if self.dispatch(MAX_DISPATCH_TIME):
+            self._lock.acquire()
+            try:
+                if self._dispatch_hid is None:
+                    self._dispatch_hid = gobject.idle_add(self._dispatch_cb)
+            finally:
+                self._lock.release()
+        return False
+
+    def wait_for(self, call, timeout):
+        '''
+        Handle queued packets until AsyncCall 'call' is done.
+
+        Output: True if the call is done, False on timeout or when the
+        connection of the call is closed.
+        '''
+
+        conn = call.get_connection()
+        end_time = time.time() + timeout
+        while not call.done():
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                self._lock.acquire()
+                try:
+                    connected = conn in self._conns
+                finally:
+                    self._lock.release()
+                remaining = end_time - time.time()
+                if not connected or remaining <= 0:
+                    return False
+                self._wait_for_item(remaining)
+                continue
+            self._handle_item(item)
+            if item[0] == 'disconnect' and item[1] is conn:
+                return call.done()
+        return True
+
+class ThreadedTCPServer():
+    '''
+    Listening socket for the ThreadedTransport, same interface as
+    tcpservergtk.GlibTCPServer.
+    '''
+
+    def __init__(self, server_address, transport, allowed_ip=None):
+        self._transport = transport
+        self._allowed_ips = []
+        if allowed_ip:
+            self.add_allowed_ip(allowed_ip)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(server_address)
+        self.socket.setblocking(0)
+        self.socket.listen(5)
+        transport.add_server(self)
+
+    def close(self):
+        self._transport.remove_server(self)
+        self.socket.close()
+
+    def add_allowed_ip(self, ip_regexp):
+        logging.info('Adding allowed ip %s', ip_regexp)
+        self._allowed_ips.append(re.compile(ip_regexp))
+
+    def allow_client(self, client):
+        for regexp in self._allowed_ips:
+            if regexp.match(client):
+                return True
+        return False
+
+_transport = None
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        _transport = ThreadedTransport()
+    return _transport
+
+def start_server(host='', port=objsh.PORT):
+    try:
+        server = ThreadedTCPServer((host, port), get_transport(), '127.0.0.1')
+        objsh.SharedObject.server = server
+        return True
+    except Exception, e:
+        logging.warning('Failed to start sharing server: %s', str(e))
+        return False
+
+def start_client(host, port=objsh.PORT, nretry=1):
+    while nretry > 0:
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect((host, port))
+            transport = get_transport()
+            transport.add_connection(sock)
+            return objsh.helper.add_client(sock, transport)
+        except Exception, e:
+            logging.warning('Failed to start sharing client: %s', str(e))
+            nretry -= 1
+            if nretry > 0:
+                logging.info('Retrying in 2 seconds...')
+                time.sleep(2)
+    return False
@@ -0,0 +1,349 @@
+# ramp.py, engine to ramp several instrument parameters at the same time
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import gobject
+import logging
+import threading
+import time
+import sys
+
+from lib.misc import exact_time
+
+class Ramp():
+    '''
+    A ramp: call 'func' for each item in 'values', with 'delay' ms
+    between the calls. Step i is performed at time tstart + i * delay, so
+    that the timing does not drift.
+
+    Ramps are created by the RampEngine, use RampEngine.add().
+    '''
+
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_ABORTED = 'aborted'
+    STATE_FAILED = 'failed'
+
+    def __init__(self, keys, func, values, delay, done_cb=None):
+        self._keys = keys
+        self._func = func
+        self._values = values
+        self._delay = delay / 1000.0
+        self._done_cb = done_cb
+        self._index = 0
+        self._tstart = exact_time()
+        self._state = Ramp.STATE_RUNNING
+        self._error = None
+
+    def get_keys(self):
+        return self._keys
+
+    def get_state(self):
+        return self._state
+
+    def is_done(self):
+        '''Return whether the ramp is finished, aborted or failed.'''
+        return self._state != Ramp.STATE_RUNNING
+
+    def raise_error(self):
+        '''Raise the exception that made the ramp fail, if any.'''
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+
+    def get_next_time(self):
+        '''Return the time at which the next step should be performed.'''
+        return self._tstart + self._index * self._delay
+
+    def get_end_time(self):
+        '''Return the time at which the last step should be performed.'''
+        return self._tstart + (len(self._values) - 1) * self._delay
+
+    def _do_step(self):
+        try:
+            self._func(self._values[self._index])
+        except Exception, e:
+            logging.error('Ramp of %s failed: %s', self._keys, e)
+            self._error = sys.exc_info()
+            self._finish(Ramp.STATE_FAILED)
+            return
+
+        self._index += 1
+        if self._index >= len(self._values):
+            self._finish(Ramp.STATE_DONE)
+
+    def _finish(self, state):
+        self._state = state
+        if self._done_cb is not None:
+            try:
+                self._done_cb(self)
+            except Exception, e:
+                logging.error('Error in ramp done callback: %s', e)
+
+class RampHandle():
+    '''
+    Handle to one or more ramps, as returned by Instrument.set(...,
+    wait=False).
+    '''
+
+    def __init__(self, engine, ramps):
+        self._engine = engine
+        self._ramps = ramps
+
+    def __repr__(self):
+        return '<RampHandle, %d ramp(s), done=%s>' % \
+                (len(self._ramps), self.is_done())
+
+    def get_ramps(self):
+        return self._ramps
+
+    def is_done(self):
+        '''Return whether all ramps are finished.'''
+        for r in self._ramps:
+            if not r.is_done():
+                return False
+        return True
+
+    def succeeded(self):
+        '''Return whether all ramps finished successfully.'''
+        for r in self._ramps:
+            if r.get_state() != Ramp.STATE_DONE:
+                return False
+        return True
+
+    def wait(self, timeout=None):
+        '''
+        Wait until all ramps are finished.
+
+        Input:
+            timeout (float): maximum time to wait in seconds, or None
+
+        Output:
+            True if all ramps finished, False on timeout
+        '''
+        return self._engine.wait(self._ramps, timeout=timeout)
+
+    def raise_error(self):
+        '''Raise the exception of the first ramp that failed, if any.'''
+        for r in self._ramps:
+            r.raise_error()
+
+    def abort(self):
+        '''Abort all ramps; parameters stay at their last step.'''
+        for r in self._ramps:
+            self._engine.abort(r)
+
+class RampEngine():
+    '''
+    Perform steps of many ramps at the same time. Steps are executed from
+    a gobject timeout on the main loop, or by a thread that is waiting
+    for a ramp to finish.
+    '''
+
+    def __init__(self):
+        self._ramps = []
+        self._keys = {}
+        self._lock = threading.RLock()
+        self._hid = None
+        self._hid_time = None
+        self._idle_func = time.sleep
+
+    def set_idle_func(self, func):
+        '''
+        Set the function called with the time in seconds to wait between
+        steps in wait(), e.g. a function that runs the main loop. The
+        default is time.sleep.
+        '''
+        self._idle_func = func
+
+    def add(self, keys, func, values, delay, done_cb=None):
+        '''
+        Start a new ramp. A running ramp that uses one of 'keys' is
+        aborted. The first step is performed immediately.
+
+        Input:
+            keys (list): identifiers of the ramped quantities, e.g.
+                (instrument name, parameter name) tuples
+            func (function): function called with each value
+            values (list): values to step through
+            delay (float): delay between steps in ms
+            done_cb (function): called with the Ramp when it is finished,
+                aborted or failed
+
+        Output:
+            Ramp object
+        '''
+
+        self._lock.acquire()
+        try:
+            for key in keys:
+                if key in self._keys:
+                    self.abort(self._keys[key])
+
+            ramp = Ramp(keys, func, values, delay, done_cb)
+            if len(values) == 0:
+                ramp._finish(Ramp.STATE_DONE)
+                return ramp
+
+            self._ramps.append(ramp)
+            for key in keys:
+                self._keys[key] = ramp
+            self.run_pending()
+        finally:
+            self._lock.release()
+
+        return ramp
+
+    def abort(self, ramp):
+        '''Abort a ramp.'''
+        self._lock.acquire()
+        try:
+            if ramp.is_done():
+                return
+            self._remove(ramp)
+            ramp._finish(Ramp.STATE_ABORTED)
+        finally:
+            self._lock.release()
+
+    def abort_all(self):
+        '''Abort all running ramps.'''
+        self._lock.acquire()
+        try:
+            for ramp in list(self._ramps):
+                self.abort(ramp)
+        finally:
+            self._lock.release()
+
+    def get_ramps(self):
+        '''Return the list of running ramps.'''
+        return list(self._ramps)
+
+    def is_ramping(self, key):
+        '''Return whether the quantity 'key' is being ramped.'''
+        return key in self._keys
+
+    def _remove(self, ramp):
+        if ramp in self._ramps:
+            self._ramps.remove(ramp)
+        for key in ramp.get_keys():
+            if self._keys.get(key, None) is ramp:
+                del self._keys[key]
+
+    def run_pending(self):
+        '''
+        Perform all steps that are due.
+
+        Output: time of the next step, or None if no ramps are running.
+        '''
+
+        self._lock.acquire()
+        try:
+            now = exact_time()
+            tnext = None
+            for ramp in list(self._ramps):
+                while not ramp.is_done() and ramp.get_next_time() <= now:
+                    ramp._do_step()
+                if ramp.is_done():
+                    self._remove(ramp)
+                else:
+                    t = ramp.get_next_time()
+                    if tnext is None or t < tnext:
+                        tnext = t
+
+            self._schedule(tnext)
+            return tnext
+        finally:
+            self._lock.release()
+
+    def _schedule(self, tnext):
+        if tnext == self._hid_time:
+            return
+        if self._hid is not None:
+            gobject.source_remove(self._hid)
+            self._hid = None
+        self._hid_time = tnext
+        if tnext is not None:
+            ms = max(0, int((tnext - exact_time()) * 1000))
+            self._hid = gobject.timeout_add(ms, self._timeout_cb)
+
+    def _timeout_cb(self):
+        self._lock.acquire()
+        try:
+            self._hid = None
+            self._hid_time = None
+            self.run_pending()
+        finally:
+            self._lock.release()
+        return False
+
+    def wait(self, ramps=None, timeout=None):
+        '''
+        Perform ramp steps until 'ramps' (default: all) are finished.
+
+        Input:
+            ramps (list of Ramp): ramps to wait for
+            timeout (float): maximum time to wait in seconds, or None
+
+        Output:
+            True if the ramps finished, False on timeout or if the ramps
+            can not finish
+
+        If the idle function raises an exception, e.g. because the
+        measurement is aborted, the ramps are aborted as well.
+        '''
+
+        if ramps is None:
+            ramps = self.get_ramps()
+        if timeout is not None:
+            tend = exact_time() + timeout
+        else:
+            tend = None
+
+        while True:
+            tnext = self.run_pending()
+
+            done = True
+            for r in ramps:
+                if not r.is_done():
+                    done = False
+                    break
+            if done:
+                return True
+
+            if tnext is None:
+                # None of the ramps is running in this engine
+                return False
+
+            now = exact_time()
+            if tend is not None:
+                if now >= tend:
+                    return False
+                tnext = min(tnext, tend)
+
+            if tnext > now:
+                try:
+                    self._idle_func(tnext - now)
+                except:
+                    for r in ramps:
+                        self.abort(r)
+                    raise
+
+try:
+    _ramp_engine
+except NameError:
+    _ramp_engine = RampEngine()
+
+def get_ramp_engine():
+    global _ramp_engine
+    return _ramp_engine
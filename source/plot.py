@@ -29,6 +29,8 @@ config = get_config()
 from data import Data
 from lib import namedlist
 from lib.misc import get_dict_keys
+from lib.datawindow import DataWindow
+from lib.decimate import DecimatedWindow, GridWindow
 from lib.network.object_sharer import SharedGObject, cache_result
 
 def _convert_arrays(args):
@@ -53,18 +55,139 @@ class _PlotList(namedlist.NamedList):
     def remove(self, name, send_quit=True):
         '''Remove a plot (should be cleared and closed).'''
         if name in self:
+            _scheduler.remove(self[name])
             self[name].clear()
             if send_quit:
                 self[name].quit()
         namedlist.NamedList.remove(self, name)
 
+class _PlotScheduler():
+    '''
+    Schedules automatic plot updates.
+
+    A plot is redrawn at most once every 'mintime' seconds. Based on the
+    measured duration of its updates, including the time the plot engine
+    needs to draw, it is also redrawn no more often than needed to keep
+    the time spent on all active plots below config['plot_time_share']
+    of the wall time. Update requests for a plot that arrive while it is
+    waiting are merged into one redraw.
+    '''
+
+    # Interval to check whether plots finished drawing
+    POLL_INTERVAL = 0.02
+
+    # Plots updated within this many seconds count as active
+    ACTIVE_TIME = 10
+
+    def __init__(self):
+        self._pending = {}
+        self._running = set()
+        self._last_run = {}
+        self._hid = None
+        self._hid_time = None
+
+    def request(self, plot, kwargs, force=False):
+        '''
+        Request an update of 'plot'. If force is True it is done as soon
+        as the previous update of the plot finished.
+        '''
+
+        if plot in self._pending:
+            force = force or self._pending[plot][1]
+        self._pending[plot] = (kwargs, force)
+        self._schedule()
+
+    def started(self, plot):
+        '''Register an update of 'plot' started outside the scheduler.'''
+        self._pending.pop(plot, None)
+        self._last_run[plot] = time.time()
+        self._running.add(plot)
+        self._schedule()
+
+    def remove(self, plot):
+        self._pending.pop(plot, None)
+        self._running.discard(plot)
+        self._last_run.pop(plot, None)
+
+    def _get_nactive(self, now):
+        active = set(self._pending.keys())
+        for plot, t in self._last_run.items():
+            if now - t < self.ACTIVE_TIME:
+                active.add(plot)
+        return max(1, len(active))
+
+    def get_next_time(self, plot, now):
+        '''Return the earliest time at which 'plot' may be updated again.'''
+
+        if self._pending[plot][1]:
+            tnext = now
+        else:
+            share = config.get('plot_time_share', 0.2)
+            interval = plot.get_update_cost() * self._get_nactive(now) / share
+            tnext = plot.get_last_update() + \
+                    max(plot.get_mintime(), interval)
+
+        # A plot that is still drawing is only checked every POLL_INTERVAL
+        if plot in self._running:
+            tnext = max(tnext, now + self.POLL_INTERVAL)
+        return tnext
+
+    def _schedule(self):
+        now = time.time()
+        times = [self.get_next_time(p, now) for p in self._pending]
+        if len(self._running) > 0:
+            times.append(now + self.POLL_INTERVAL)
+        if len(times) == 0:
+            return
+
+        tnext = min(times)
+        if self._hid is not None:
+            if self._hid_time <= tnext:
+                return
+            gobject.source_remove(self._hid)
+        self._hid_time = tnext
+        delay = max(0, tnext - now)
+        self._hid = gobject.timeout_add(int(delay * 1000), self._run)
+
+    def _run(self):
+        self._hid = None
+
+        # Check which updates finished, this records their duration
+        for plot in list(self._running):
+            if not plot.is_busy():
+                self._running.discard(plot)
+
+        now = time.time()
+        for plot, (kwargs, force) in self._pending.items():
+            if self.get_next_time(plot, now) > now:
+                continue
+            if plot.is_busy():
+                self._running.add(plot)
+                continue
+            del self._pending[plot]
+            self._last_run[plot] = now
+            try:
+                plot._run_update(**kwargs)
+            except Exception, e:
+                logging.warning('Failed to update plot %s: %s',
+                        plot.get_name(), str(e))
+                continue
+            if plot.is_busy():
+                self._running.add(plot)
+
+        self._schedule()
+        return False
+
+_scheduler = _PlotScheduler()
+
 class Plot(SharedGObject):
     '''
     Base class / interface for plot implementations.
 
     Implementing _do_update will make sure the plot is updated when new data
-    is available (only when the global qt auto_update flag is set and the
-    plot was last updated longer than mintime (sec) ago.
+    is available (only when the global qt auto_update flag is set). The
+    updates are scheduled by _PlotScheduler, based on 'mintime' (sec) and
+    the measured duration of previous updates.
     '''
 
     _plot_list = _PlotList()
@@ -87,6 +210,10 @@ class Plot(SharedGObject):
             in a temporary file.
             supportbin (bool), default False. Whether the temporary file can
             be in binary format.
+            decimate (int), number of bins (about the number of pixel
+            columns) to reduce traces to, keeping the minimum and maximum
+            of each bin. Default is 'plot_decimate' from config, or 0 to
+            disable.
         '''
 
         maxpoints = kwargs.get('maxpoints', 10000)
@@ -95,6 +222,7 @@ class Plot(SharedGObject):
         autoupdate = kwargs.get('autoupdate', None)
         needtempfile = kwargs.get('needtempfile', False)
         supportbin = kwargs.get('supportbin', False)
+        decimate = kwargs.get('decimate', config.get('plot_decimate', 0))
         name = kwargs.get('name', '')
         self._name = Plot._plot_list.new_item_name(self, name)
         SharedGObject.__init__(self, 'plot_%s' % self._name, replace=True)
@@ -110,9 +238,11 @@ class Plot(SharedGObject):
         self._autoupdate = autoupdate
         self._needtempfile = needtempfile
         self._supportbin = supportbin
+        self._decimate = decimate
 
         self._last_update = 0
-        self._update_hid = None
+        self._update_cost = None
+        self._update_running = False
 
         data_args = get_dict_keys(kwargs, ('coorddim', 'coorddims', 'valdim',
             'title', 'offset', 'ofs', 'traceofs', 'surfofs'))
@@ -179,6 +309,42 @@ class Plot(SharedGObject):
     def get_maxpoints(self):
         return self._maxpoints
 
+    def set_decimate(self, nbins, update=True):
+        '''
+        Set the number of bins to reduce traces to, 0 to disable. For 3D
+        plots this is the maximum number of cells in each direction.
+        '''
+        self._decimate = nbins
+        for datadict in self._data:
+            datadict.pop('window', None)
+        if update:
+            self.update()
+
+    def get_decimate(self):
+        return self._decimate
+
+    def _create_window(self, datadict, cols):
+        return DataWindow(datadict['data'], self._maxpoints, self._maxtraces,
+                cols=cols)
+
+    def get_window(self, datadict, cols):
+        '''
+        Return the DataWindow for data item 'datadict', updated with the
+        points added since the last call.
+
+        Input:
+            datadict (dict): item from the data list
+            cols (list of int): columns to use
+        '''
+
+        window = datadict.get('window', None)
+        if window is None:
+            window = self._create_window(datadict, cols)
+            datadict['window'] = window
+        window.set_limits(self._maxpoints, self._maxtraces)
+        window.update()
+        return window
+
     def set_property(self, prop, val, update=False):
         self._properties[prop] = val
         if update:
@@ -310,46 +476,57 @@ class Plot(SharedGObject):
         Update the plot.
 
         Input:
-            force (bool): if True force an update, else check whether we
-                would like to autoupdate and whether the last update is longer
-                than 'mintime' ago.
+            force (bool): if True update now, or as soon as the previous
+                update finished drawing. Else, if we would like to
+                autoupdate, let the scheduler update the plot when
+                'mintime' and the plotting time budget allow it.
         '''
 
-        dt = time.time() - self._last_update
-
         if not force and self._autoupdate is not None and not self._autoupdate:
             return
 
-        if self._update_hid is not None:
-            if force:
-                gobject.source_remove(self._update_hid)
-                self._update_hid = None
-            else:
-                return
-
-        cfgau = config.get('live-plot', True)
-        if force or (cfgau and dt > self._mintime):
+        if force:
             if self.is_busy():
-                self._queue_update(force=force, **kwargs)
+                _scheduler.request(self, kwargs, force=True)
                 return
+            self._run_update(**kwargs)
+            _scheduler.started(self)
 
-            self._last_update = time.time()
-            self._do_update(**kwargs)
+        elif config.get('live-plot', True):
+            _scheduler.request(self, kwargs)
 
-        # Auto-update later
-        elif cfgau:
-            self._queue_update(force=force, **kwargs)
+    def _run_update(self, **kwargs):
+        self._last_update = time.time()
+        self._update_running = True
+        self._do_update(**kwargs)
+        if not self.is_busy():
+            self._update_done()
+
+    def _update_done(self):
+        '''
+        Record the duration of the last update. Called when drawing
+        finished, for engines that draw asynchronously from is_busy().
+        '''
 
-    def _queue_update(self, force=False, **kwargs):
-        if self._update_hid is not None:
+        if not self._update_running:
             return
-        self._update_hid = gobject.timeout_add(int(self._mintime * 1000),
-                self._delayed_update, force, **kwargs)
+        self._update_running = False
 
-    def _delayed_update(self, force=True, **kwargs):
-        self._update_hid = None
-        self.update(force=force, **kwargs)
-        return False
+        dt = time.time() - self._last_update
+        if self._update_cost is None:
+            self._update_cost = dt
+        else:
+            self._update_cost = 0.7 * self._update_cost + 0.3 * dt
+
+    def get_last_update(self):
+        '''Return the time at which the last update started.'''
+        return self._last_update
+
+    def get_update_cost(self):
+        '''Return the average duration of an update in seconds.'''
+        if self._update_cost is None:
+            return 0
+        return self._update_cost
 
     def _new_data_point_cb(self, sender):
         try:
@@ -380,7 +557,10 @@ class Plot(SharedGObject):
         return self._supportbin
 
     def is_busy(self):
-        '''Return whether the graph is being updated.'''
+        '''
+        Return whether the graph is being updated. Should not block, it is
+        used to poll for the end of an update.
+        '''
         return False
 
     def _process_plot_options(self, kwargs):
@@ -414,6 +594,22 @@ class Plot2DBase(Plot):
     def get_ndimensions(self):
         return 2
 
+    def _create_window(self, datadict, cols):
+        '''
+        Create a DecimatedWindow if decimation is enabled, for traces
+        without error bars.
+        '''
+
+        if not self._decimate or datadict.get('yerrdim', None) is not None:
+            return Plot._create_window(self, datadict, cols)
+
+        if len(datadict['coorddims']) > 0:
+            xcol = datadict['coorddims'][0]
+        else:
+            xcol = None
+        return DecimatedWindow(datadict['data'], xcol, datadict['valdim'],
+                nbins=self._decimate, maxtraces=self._maxtraces)
+
     def add_data(self, data, coorddim=None, valdim=None, **kwargs):
         '''
         Add Data object to 2D plot.
@@ -567,6 +763,13 @@ class Plot3DBase(Plot):
     def get_ndimensions(self):
         return 3
 
+    def _create_window(self, datadict, cols):
+        '''Create a GridWindow if decimation is enabled.'''
+        if not self._decimate:
+            return Plot._create_window(self, datadict, cols)
+        return GridWindow(datadict['data'], cols,
+                nx=self._decimate, ny=self._decimate)
+
     def add_data(self, data, coorddims=None, valdim=None, **kwargs):
         '''
         Add data to 3D plot.
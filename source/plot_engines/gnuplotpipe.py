@@ -18,10 +18,9 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import subprocess
-import select
+import threading
 import re
 import time
-import ctypes
 import logging
 import sys
 import types
@@ -35,54 +34,129 @@ def on_windows():
 def is_64bit_windows():
     return 'PROGRAMFILES(X86)' in os.environ
 
-class WinPipe():
+class _OutputReader(threading.Thread):
     '''
-    Class to perform line-based, non-blocking reads from a win32 file.
+    Thread that reads the output of gnuplot, so that no other thread ever
+    has to block on it.
+
+    Acknowledgments (lines starting with 'prefix' followed by a number)
+    are counted; other lines are stored tagged with the number of the
+    first acknowledgment that follows them, so that the output of a
+    command can be separated from earlier output.
     '''
 
-    def __init__(self, fd):
-        self._peek_named_pipe = ctypes.windll.kernel32.PeekNamedPipe
+    # Maximum number of unread lines to keep
+    MAX_LINES = 1000
+
+    def __init__(self, f, prefix, nack=0):
+        threading.Thread.__init__(self, name='gnuplot-reader')
+        self.setDaemon(True)
+        self._file = f
+        self._prefix = prefix
+        self._nack = nack
+        self._done = False
+
+        # Protects the lines and the waiter list
+        self._lock = threading.Lock()
+        self._lines = []
+        self._waiters = []
+
+    def run(self):
+        while True:
+            try:
+                line = self._file.readline()
+            except (IOError, ValueError), e:
+                break
+            if line == '':
+                break
 
-        self._fd = fd
-        self._buf = ''
-        self._maxsize = 1024
+            line = line.rstrip('\r\n') + '\n'
+            self._lock.acquire()
+            try:
+                if line.startswith(self._prefix):
+                    try:
+                        # Replies are in order, but a resent command can
+                        # repeat an old one
+                        self._nack = max(self._nack,
+                                int(line[len(self._prefix):]))
+                    except ValueError:
+                        pass
+                    self._wake_waiters()
+                else:
+                    self._lines.append((self._nack + 1, line))
+                    if len(self._lines) > self.MAX_LINES:
+                        del self._lines[:-self.MAX_LINES]
+            finally:
+                self._lock.release()
 
-    def _get_buffer(self):
+        self._lock.acquire()
         try:
-            import msvcrt
-            handle = msvcrt.get_osfhandle(self._fd.fileno())
-            avail = ctypes.c_ulong(0)
-            self._peek_named_pipe(handle, None, 0, None, ctypes.byref(avail), None)
-            avail = avail.value
-            avail = min(avail, self._maxsize)
-            if avail > 0:
-                data = self._fd.read(avail)
-                self._buf += data
-                return True
-            return False
-        except Exception, e:
-            print 'Error: %s' % str(e)
-            return False
+            self._done = True
+            self._wake_waiters()
+        finally:
+            self._lock.release()
+
+    def _wake_waiters(self):
+        for entry in self._waiters[:]:
+            if self._done or self._nack >= entry[0]:
+                self._waiters.remove(entry)
+                entry[1].release()
+
+    def _remove_waiter(self, entry):
+        self._lock.acquire()
+        try:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                entry[1].release()
+        finally:
+            self._lock.release()
 
-    def readline(self, timeout=0):
-        '''Return a \n terminated line, if available.'''
+    def get_nack(self):
+        '''Return the number of the last acknowledgment received.'''
+        return self._nack
 
-        start = time.time()
-        firsttime = True
+    def wait_ack(self, ack_id, timeout):
+        '''
+        Wait at most <timeout> seconds for acknowledgment <ack_id>.
 
-        while firsttime or (time.time() - start) < timeout:
-            self._get_buffer()
-            index = self._buf.find('\n')
-            if index != -1:
-                ret = self._buf[:index]
-                self._buf = self._buf[index+1:]
-                ret = ret.rstrip('\r\n')
-                ret += '\n'
-                return ret
-            firsttime = False
-            time.sleep(timeout / 10.0)
+        Output: True if it was received
+        '''
 
-        return None
+        # Block on a lock released by the reader or by the timer
+        waiter = threading.Lock()
+        waiter.acquire()
+        entry = [ack_id, waiter]
+        self._lock.acquire()
+        try:
+            if self._nack >= ack_id or self._done:
+                return self._nack >= ack_id
+            self._waiters.append(entry)
+        finally:
+            self._lock.release()
+
+        timer = threading.Timer(timeout, self._remove_waiter, (entry,))
+        timer.start()
+        waiter.acquire()
+        timer.cancel()
+        return self._nack >= ack_id
+
+    def get_lines(self, ack_id=None):
+        '''
+        Remove and return the lines received before acknowledgment
+        <ack_id> (default all lines) as a list of (ack_id, line) tuples.
+        '''
+
+        self._lock.acquire()
+        try:
+            if ack_id is None:
+                ret = self._lines
+                self._lines = []
+            else:
+                ret = [l for l in self._lines if l[0] <= ack_id]
+                self._lines = [l for l in self._lines if l[0] > ack_id]
+            return ret
+        finally:
+            self._lock.release()
 
 class GnuplotPipe():
     '''
@@ -100,6 +174,7 @@ class GnuplotPipe():
     _RE_RANGE = re.compile('set .*range \[ (.*) : (.*) \] .*\n')
     _RE_LOG = re.compile('(\w+) \(base ([^\)]*)\)')
     _RE_LABEL = re.compile('.*label is "[\"]"')
+    _ACK_PREFIX = 'qtlab-ack '
 
     def __init__(self, termtitle='QTGnuplot', persist=False, noraise=True,
                     default_terminal=None):
@@ -108,6 +183,8 @@ class GnuplotPipe():
         self._noraise = noraise
         self._reopen_cb = None
         self._popen = None
+        self._reader = None
+        self._ack_sent = 0
 
         if type(default_terminal) in (types.StringType, types.UnicodeType):
             self._default_terminal = (default_terminal, '')
@@ -132,9 +209,13 @@ class GnuplotPipe():
         except:
             pass
         self._popen.stdin.close()
+        self._popen.wait()
+        # The reader stops at the end of the output
+        if self._reader is not None:
+            self._reader.join(1.0)
+            self._reader = None
         self._popen.stdout.close()
         self._popen.stderr.close()
-        self._popen.wait()
         self._popen = None
 
     def _open_gnuplot(self):
@@ -150,8 +231,10 @@ class GnuplotPipe():
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE)
 
-        if subprocess.mswindows:
-            self._winpipe = WinPipe(self._popen.stderr)
+        # Acknowledgments sent to a previous instance will never arrive
+        self._reader = _OutputReader(self._popen.stderr, self._ACK_PREFIX,
+                self._ack_sent)
+        self._reader.start()
 
         self._wait_start()
 
@@ -186,62 +269,61 @@ class GnuplotPipe():
         '''Check whether the gnuplot instance is alive.'''
         return self._popen.poll() == None
 
-    if subprocess.mswindows:
-        def readline(self, timeout=0):
-            line = self._winpipe.readline(timeout)
-            return line
-
-    else:
-        def readline(self, timeout=0):
-            rlist = [self._popen.stderr]
-            elist = []
-            lists = select.select(rlist, elist, elist, timeout)
-            if len(lists[0]) == 0:
-                return None
-            line = self._popen.stderr.readline()
-            return line
-
     def get_output(self, timeout=DEFAULT_TIMEOUT):
-        '''Read output from gnuplot, waiting at most <timeout> seconds.'''
+        '''
+        Return the output received from gnuplot. If timeout > 0, first
+        wait at most <timeout> seconds until gnuplot has executed all
+        commands sent so far.
+        '''
 
         if not self._popen:
             return None
 
-        ret = ''
-        i = 0
-        while i < 1000:
-            line = self.readline(timeout)
-            if line is None:
-                break
-            ret += line
-            i += 1
-
-        return ret
+        if timeout > 0:
+            self._reader.wait_ack(self.request_ack(), timeout)
+        return ''.join([l[1] for l in self._reader.get_lines()])
 
     def flush_output(self, timeout=0):
         '''Flush gnuplot stdout.'''
         self.get_output(timeout)
 
+    def _ack_cmd(self):
+        self._ack_sent += 1
+        return 'print "%s%d"\n' % (self._ACK_PREFIX, self._ack_sent)
+
     def cmd(self, cmd, retoutput=False, timeout=DEFAULT_TIMEOUT, retry=True):
-        '''Execute a gnuplot command, optionally returning output.'''
+        '''
+        Execute a gnuplot command, optionally returning output.
+
+        The output of a command is recognized by the acknowledgments sent
+        before and after it; if gnuplot does not reply within <timeout>
+        seconds the output received so far is returned and the rest is
+        discarded when it arrives.
+        '''
 
         # End with newline
         if len(cmd) > 0 and cmd[-1] != '\n':
             cmd += '\n'
 
         try:
-            if retoutput:
-                self.flush_output()
             if not self._popen:
                 self._open_gnuplot()
-            ret = self._popen.stdin.write(cmd)
-            if retoutput:
-                return self.get_output(timeout)
+            if not retoutput:
+                self._popen.stdin.write(cmd)
+                return None
+
+            s = self._ack_cmd() + cmd + self._ack_cmd()
+            ack_id = self._ack_sent
+            self._popen.stdin.write(s)
+            self._reader.wait_ack(ack_id, timeout)
+            lines = self._reader.get_lines(ack_id)
+            return ''.join([l[1] for l in lines if l[0] == ack_id])
         except IOError, e:
             if retry:
                 logging.error('Gnuplot communication failed; reopening')
                 self._open_gnuplot()
-                self.cmd(cmd, retoutput=retoutput, timeout=timeout, retry=False)
+                return self.cmd(cmd, retoutput=retoutput, timeout=timeout,
+                        retry=False)
             else:
                 logging.error('Gnuplot communication failed but not reopening')
 
@@ -249,12 +331,34 @@ class GnuplotPipe():
 
     def is_responding(self, timeout=DEFAULT_TIMEOUT):
         '''Check whether gnuplot is responding within <timeout> seconds.'''
-        self.flush_output()
         ret = self.cmd('print 0', True, timeout)
         if ret != '0\n':
             return False
         return True
 
+    def request_ack(self):
+        '''
+        Ask gnuplot to report when it has executed all commands sent so
+        far. Use is_acknowledged() to check for the reply without waiting.
+
+        Output: id of the acknowledgment
+        '''
+
+        self.cmd(self._ack_cmd())
+        return self._ack_sent
+
+    def is_acknowledged(self, ack_id=None):
+        '''
+        Return whether acknowledgment 'ack_id' (default the last one
+        requested) was received, without waiting.
+        '''
+
+        if ack_id is None:
+            ack_id = self._ack_sent
+        if self._reader is None:
+            return True
+        return self._reader.get_nack() >= ack_id
+
     def get_terminal(self):
         '''Set terminal info as (type, options) tuple.'''
 
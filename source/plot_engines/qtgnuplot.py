@@ -27,10 +27,15 @@ from lib.config import get_config
 config = get_config()
 from lib.namedlist import NamedList
 from lib.network.object_sharer import cache_result
+from lib.decimate import DecimatedWindow
 import plot
 
 import gnuplotpipe
 
+# Time to wait for gnuplot to finish an update before assuming the reply
+# was lost
+ACK_TIMEOUT = 60
+
 class _GnuPlotList(NamedList):
 
     def __init__(self):
@@ -139,6 +144,8 @@ class _QTGnuPlot():
         name = self.get_name()
         self._gnuplot = self._gnuplot_list[name]
         self._gnuplot.set_reopen_cb(lambda x: self.reset())
+        self._ack_id = None
+        self._use_tempfiles = config.get('gnuplot_tempfile', False)
         self.cmd('reset')
         self.cmd('clear')
 
@@ -196,7 +203,9 @@ class _QTGnuPlot():
     def get_first_filepath(self):
         '''Return filepath of first data item.'''
         if len(self._data) > 0:
-            return self._data[0]['data'].get_filepath()
+            # Not get_filepath(), that would write a temporary file
+            data = self._data[0]['data']
+            return os.path.join(data.get_dir(), data.get_filename())
         else:
             return ''
 
@@ -253,10 +262,10 @@ class _QTGnuPlot():
         self.update()
         self._gnuplot.set_terminal(terminal)
         self._gnuplot.cmd('set output "%s"' % filepath)
-        self._gnuplot.cmd('replot')
+        self._replot()
         self._gnuplot.reset_default_terminal()
         self._gnuplot.cmd('set output')
-        self._gnuplot.cmd('replot')
+        self._replot()
 
     @cache_result
     def get_save_as_types(self):
@@ -352,8 +361,134 @@ class _QTGnuPlot():
         '''
         cmd = self.create_plot_command()
         self.cmd(cmd)
+        if self._gnuplot is not None:
+            self._ack_id = self._gnuplot.request_ack()
         return True
 
+    def _replot(self):
+        '''
+        Redraw the plot. 'replot' can not be used with inline data, gnuplot
+        would try to read the data from stdin again.
+        '''
+        if self.uses_inline_data():
+            self._do_update()
+        else:
+            self._gnuplot.cmd('replot')
+
+    def uses_inline_data(self):
+        '''Return whether the plot command contains inline data.'''
+        for datadict in self._data:
+            if 'data' in datadict and self._from_memory(datadict['data']):
+                return True
+        return False
+
+    def _from_memory(self, data):
+        '''
+        Return whether a Data object is sent to gnuplot from memory instead
+        of being read from its file: arrays passed to plot(), unless
+        config option 'gnuplot_tempfile' is set, and in-memory data sets
+        without a data file.
+        '''
+
+        if data.is_tempfile():
+            return not self._use_tempfiles
+        return data.is_inmem() and data.get_filename() == ''
+
+    def _get_memory_blocks(self, data, cols, maxpoints=None, maxtraces=None,
+            complete=False):
+        '''
+        Return the data of an in-memory Data object as a list of 2D arrays,
+        one for each block.
+
+        Input:
+            data (Data): the data object
+            cols (list of int): columns to include
+            maxpoints (int): only include the last maxpoints of each block
+            maxtraces (int): only include the last maxtraces blocks
+            complete (bool): only include complete blocks
+        Output:
+            list of arrays
+        '''
+
+        rows = data.get_data()
+        if rows is None or len(rows) == 0:
+            return []
+        if rows.ndim == 1:
+            rows = rows.reshape((len(rows), 1))
+
+        sizes = [data.get_block_size(i) for i in range(data.get_nblocks())]
+        if sum(sizes) != len(rows):
+            # set_data() and update_data() do not keep track of blocks,
+            # split them as they would be written to a file.
+            sizes = data.get_detected_block_sizes()
+        elif complete:
+            sizes = sizes[:data.get_nblocks_complete()]
+
+        start = 0
+        if maxtraces is not None:
+            start = max(0, len(sizes) - maxtraces)
+        ofs = sum(sizes[:start])
+        blocks = []
+        for n in sizes[start:]:
+            block = rows[ofs:ofs+n]
+            if maxpoints is not None:
+                block = block[-maxpoints:]
+            if len(block) > 0:
+                blocks.append(np.take(block, cols, axis=1))
+            ofs += n
+        return blocks
+
+    def _format_binary_data(self, blocks, grid=False):
+        '''
+        Format a list of 2D arrays as gnuplot binary inline data, which
+        gnuplot reads a lot faster than text.
+
+        Input:
+            blocks (list of arrays): the data
+            grid (bool): whether blocks of equal length can be sent as a
+                grid, otherwise only a single block is sent as binary.
+        Output:
+            (options, data) tuple, or None if the blocks can not be sent
+            as binary data.
+        '''
+
+        if not self.get_support_binary() or gnuplotpipe.on_windows():
+            # gnuplot reads stdin in text mode on windows
+            return None
+        if len(blocks) == 0:
+            return None
+
+        npoints = len(blocks[0])
+        ncols = blocks[0].shape[1]
+        if len(blocks) == 1:
+            record = '%d' % npoints
+        elif not grid:
+            return None
+        else:
+            for block in blocks:
+                if len(block) != npoints:
+                    return None
+            record = '%dx%d' % (npoints, len(blocks))
+
+        opts = " binary record=%s format='%s'" % \
+                (record, '%float64' * ncols)
+        data = ''.join([np.asarray(b, dtype=np.float64).tostring()
+                for b in blocks])
+        return opts, data
+
+    def _format_inline_data(self, blocks):
+        '''
+        Format a list of 2D arrays as gnuplot inline data, with a blank
+        line between the blocks and terminated by 'e'.
+        '''
+
+        fmt = '%%.%dg' % config.get('default_precision', 12)
+        lines = []
+        for block in blocks:
+            linefmt = ' '.join([fmt] * block.shape[1]) + '\n'
+            lines.append((linefmt * len(block)) % tuple(block.ravel()))
+        return '\n'.join(lines) + 'e\n'
+
     def cmd(self, cmdstr):
         '''Send command to gnuplot instance directly.'''
         if self._gnuplot is not None:
@@ -363,7 +498,22 @@ class _QTGnuPlot():
         self._gnuplot.live()
 
     def is_busy(self):
-        return not self._gnuplot.is_responding()
+        '''
+        Return whether gnuplot is still drawing the last update. Does not
+        wait for gnuplot.
+        '''
+
+        if self._ack_id is None:
+            return False
+        if not self._gnuplot.is_acknowledged(self._ack_id):
+            if time.time() - self.get_last_update() < ACK_TIMEOUT:
+                return True
+            logging.warning('No reply from gnuplot for plot %s',
+                    self.get_name())
+
+        self._ack_id = None
+        self._update_done()
+        return False
 
     def set_grid(self, on=True, update=True):
         self.set_property('grid', on, update=update)
@@ -497,6 +647,8 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
     def __init__(self, *args, **kwargs):
         kwargs['needtempfile'] = True
         kwargs['supportbin'] = config.get('gnuplot_binary', True)
+        self._incremental = kwargs.get('incremental',
+                config.get('gnuplot_incremental', False))
         plot.Plot2DBase.__init__(self, *args, **kwargs)
         _QTGnuPlot.__init__(self)
 
@@ -543,15 +695,58 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
             self.set_property(k, v, update=False)
         self.set_property('style', style, update=update)
 
-    def create_plot_command(self, fullpath=True, data_entry=None):
+    def set_incremental(self, val, update=True):
+        '''
+        Enable or disable incremental updates.
+
+        In incremental mode Data objects are sent to gnuplot as inline data
+        holding only the last 'maxtraces' blocks of 'maxpoints' points,
+        instead of letting gnuplot read the complete data file. Only the
+        points added since the last update are read from the Data object,
+        so the cost of an update does not grow with the file size.
+        '''
+        self._incremental = val
+        if update:
+            self.update()
+
+    def get_incremental(self):
+        return self._incremental
+
+    def uses_inline_data(self):
+        return self._incremental or bool(self._decimate) or \
+                _QTGnuPlot.uses_inline_data(self)
+
+    def _create_using(self, coorddims, valdim, yerrdim, ofs, traceofs):
+        if len(coorddims) == 0:
+            using = '($%d+%f+%f*column(-1))' % (valdim + 1, ofs, traceofs)
+        elif len(coorddims) == 1:
+            using = '%d:($%d+%f+%f*column(-1))' % (coorddims[0] + 1, valdim + 1, ofs, traceofs)
+        else:
+            return None
+        if yerrdim is not None:
+            using += ':%d' % (yerrdim+1)
+        return using
+
+    def create_plot_command(self, fullpath=True, data_entry=None,
+            inline=None):
         '''
         Create a gnuplot plot command.
         If data_entry is given only that item will be used, otherwise
         all items are included.
+        If inline is True (default: incremental mode or decimation
+        enabled) Data objects are included as inline data. Data kept
+        only in memory is always sent as inline data, unless inline is
+        False; if possible as binary data.
         '''
 
         s = 'plot '
         first = True
+        inline_data = ''
+        if inline is None:
+            inline = self._incremental or bool(self._decimate)
+            from_memory = True
+        else:
+            from_memory = inline
 
         if data_entry is not None:
             items = [data_entry]
@@ -578,42 +773,78 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
             traceofs = datadict.get('traceofs', 0)
             self._check_style_options(datadict)
 
-            if fullpath:
-                filepath = data.get_filepath()
-            else:
-                filepath = data.get_filename()
-            filepath = filepath.replace('\\','/')
-
-            if len(coorddims) == 0:
-                using = '($%d+%f+%f*column(-1))' % (valdim + 1, ofs, traceofs)
-            elif len(coorddims) == 1:
-                using = '%d:($%d+%f+%f*column(-1))' % (coorddims[0] + 1, valdim + 1, ofs, traceofs)
-            else:
+            if len(coorddims) > 1:
                 logging.error('Need 0 or 1 coordinate dimensions!')
                 continue
-            if yerrdim is not None:
-                using += ':%d' % (yerrdim+1)
 
-            npoints = data.get_npoints()
             if datadict.get('with', None) in ['lines']:
                 min_npoints = 2
             else:
                 min_npoints = 1
-            if npoints < min_npoints:
-                continue
 
-            nblocks = data.get_nblocks()
-            npoints_last_block = data.get_block_size(nblocks - 1)
-            if npoints_last_block < 2:
-                nblocks -= 1
-                npoints_last_block = data.get_block_size(nblocks - 1)
+            trace_opts = datadict
+            use_memory = from_memory and self._from_memory(data)
+            if use_memory or (inline and not data.is_tempfile()):
+                # Send only the used columns, renumbered from 0
+                cols = list(coorddims) + [valdim]
+                if yerrdim is not None:
+                    cols.append(yerrdim)
+                ncoord = len(coorddims)
+                if data.is_tempfile():
+                    blocks = self._get_memory_blocks(data, cols,
+                            self._maxpoints, self._maxtraces)
+                else:
+                    window = self.get_window(datadict, cols)
+                    blocks = window.get_blocks()
+                    if isinstance(window, DecimatedWindow):
+                        # Decimated blocks always have an x column
+                        ncoord = 1
+                if sum([len(b) for b in blocks]) < min_npoints:
+                    continue
+
+                if yerrdim is not None:
+                    yerrdim = ncoord + 1
+                using = self._create_using(range(ncoord), ncoord, yerrdim,
+                        ofs, traceofs)
+                binary = None
+                if datadict.get('binary', True):
+                    binary = self._format_binary_data(blocks)
+                if binary is not None:
+                    source = "'-'%s using %s" % (binary[0], using)
+                    inline_data += binary[1]
+                else:
+                    source = "'-' using %s" % using
+                    inline_data += self._format_inline_data(blocks)
+                trace_opts = datadict.copy()
+                trace_opts.pop('binary', None)
 
-            startpoint = max(0, npoints_last_block - self._maxpoints)
-            startblock = max(0, nblocks - self._maxtraces)
-            if len(coorddims) == 0:
-                every = "::%d" % (startpoint)
             else:
-                every = '::%d:%d' % (startpoint, startblock)
+                if data.get_npoints() < min_npoints:
+                    continue
+
+                # Also writes a temporary file if needed
+                filepath = data.get_filepath()
+                if not fullpath:
+                    filepath = data.get_filename()
+                filepath = filepath.replace('\\','/')
+
+                using = self._create_using(coorddims, valdim, yerrdim,
+                        ofs, traceofs)
+
+                nblocks = data.get_nblocks()
+                npoints_last_block = data.get_block_size(nblocks - 1)
+                if npoints_last_block < 2:
+                    nblocks -= 1
+                    npoints_last_block = data.get_block_size(nblocks - 1)
+
+                startpoint = max(0, npoints_last_block - self._maxpoints)
+                startblock = max(0, nblocks - self._maxtraces)
+                if len(coorddims) == 0:
+                    every = "::%d" % (startpoint)
+                else:
+                    every = '::%d:%d' % (startpoint, startblock)
+                source = '"%s" using %s every %s' % \
+                    (str(filepath), using, every)
 
             if 'top' in datadict:
                 axes = 'x2'
@@ -629,20 +860,21 @@ class Plot2D(plot.Plot2DBase, _QTGnuPlot):
             else:
                 first = False
 
-            s += '"%s" using %s every %s' % \
-                (str(filepath), using, every)
-            s += self._get_trace_options(datadict)
+            s += source
+            s += self._get_trace_options(trace_opts)
             s += ' axes %s' % axes
 
         if first:
             return ''
+        elif inline_data != '':
+            return s + '\n' + inline_data
         else:
             return s
 
     def save_gp(self, filepath=None, **kwargs):
         '''Save file that can be opened with gnuplot.'''
         s = self.get_commands()
-        s += self.create_plot_command(fullpath=False)
+        s += self.create_plot_command(fullpath=False, inline=False)
         self._write_gp(s, filepath=filepath, **kwargs)
 
     def is_busy(self):
@@ -852,15 +1084,29 @@ class Plot3D(plot.Plot3DBase, _QTGnuPlot):
         self.set_property('palette', dict(name=pal, gamma=gamma), \
                 update=update)
 
-    def create_plot_command(self, fullpath=True, data_entry=None):
+    def uses_inline_data(self):
+        return bool(self._decimate) or _QTGnuPlot.uses_inline_data(self)
+
+    def create_plot_command(self, fullpath=True, data_entry=None,
+            inline=None):
         '''
         Create a gnuplot splot command.
         If data_entry is given only that item will be used, otherwise
         all items are included.
+        If inline is True (default: decimation enabled) Data objects are
+        included as a decimated grid of inline data. Data kept only in
+        memory is always sent as inline data, unless inline is False; if
+        possible as binary data.
         '''
 
         s = 'splot '
         first = True
+        inline_data = ''
+        if inline is None:
+            inline = bool(self._decimate)
+            from_memory = True
+        else:
+            from_memory = inline
 
         if data_entry is not None:
             items = [data_entry]
@@ -888,16 +1134,49 @@ class Plot3D(plot.Plot3DBase, _QTGnuPlot):
                 logging.error('Unable to plot without two coordinate columns')
                 continue
 
-            if fullpath:
-                filepath = data.get_filepath()
-            else:
+            style = self.get_property('style')
+            use_memory = from_memory and self._from_memory(data)
+            use_inline = use_memory or (inline and not data.is_tempfile())
+            if use_inline:
+                cols = list(coorddims) + [valdim]
+                if inline and not data.is_tempfile():
+                    blocks = self.get_window(datadict, cols).get_blocks()
+                else:
+                    blocks = self._get_memory_blocks(data, cols,
+                            complete=(style == self.STYLE_IMAGE))
+                if len(blocks) < 2 and data.is_tempfile() and \
+                        style in ('image', 'image3d'):
+                    # Not a grid, let gnuplot read the temporary file
+                    use_inline = False
+                elif len(blocks) == 0 or \
+                        (len(blocks) < 2 and style == self.STYLE_IMAGE):
+                    continue
+            if use_inline:
+                binary = None
+                if datadict.get('binary', True):
+                    binary = self._format_binary_data(blocks, grid=True)
+                if binary is not None:
+                    source = "'-'%s" % binary[0]
+                    inline_data += binary[1]
+                else:
+                    source = "'-'"
+                    inline_data += self._format_inline_data(blocks)
+                coorddims = (0, 1)
+                valdim = 2
                 filepath = data.get_filename()
+            else:
+                # Also writes a temporary file if needed
+                filepath = data.get_filepath()
+                if not fullpath:
+                    filepath = data.get_filename()
+                source = '"%s"' % str(filepath)
             filepath = filepath.replace('\\','/')
 
             using = '%d:%d:($%d+%f+%f*column(-1)+%f*column(-2))' % (coorddims[0] + 1, coorddims[1] + 1, valdim + 1, ofs, traceofs, surfofs)
 
-            style = self.get_property('style')
-            if style == self.STYLE_IMAGE:
+            if source.startswith("'-'"):
+                everystr = ''
+            elif style == self.STYLE_IMAGE:
                 stopblock = data.get_nblocks_complete() - 1
                 if stopblock < 1:
                     #logging.warning('Unable to plot in style "image" with <=1 block')
@@ -911,12 +1190,17 @@ class Plot3D(plot.Plot3DBase, _QTGnuPlot):
                 s += ', '
             else:
                 first = False
-            s += '"%s" using %s %s' % (str(filepath), using, everystr)
+            s += '%s using %s %s' % (source, using, everystr)
 
             defaults = {
                 'with': self._default_with
             }
-            s += self._get_trace_options(datadict, defaults)
+            if source.startswith("'-'"):
+                trace_opts = datadict.copy()
+                trace_opts.pop('binary', None)
+            else:
+                trace_opts = datadict
+            s += self._get_trace_options(trace_opts, defaults)
 
         # gnuplot (version 4.3 november) has bug for placing keys (legends)
         # here we put ugly hack as a temporary fix
@@ -926,13 +1210,15 @@ class Plot3D(plot.Plot3DBase, _QTGnuPlot):
 
         if first:
             return ''
+        elif inline_data != '':
+            return s + '\n' + inline_data
         else:
             return s
 
     def save_gp(self, filepath=None, **kwargs):
         '''Save file that can be opened with gnuplot.'''
         s = self.get_commands()
-        s += self.create_plot_command(fullpath=False)
+        s += self.create_plot_command(fullpath=False, inline=False)
         self._write_gp(s, filepath=filepath, **kwargs)
 
     def _new_data_point_cb(self, sender):
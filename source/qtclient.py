@@ -101,3 +101,28 @@ def format_parameter_value(opt, val):
 
     return '%s%s' % (valstr, unitstr)
 
+def format_parameter_range(opt):
+    '''Format the range allowed for a parameter with options <opt>.'''
+    text = ''
+    if 'minval' in opt or 'maxval' in opt:
+        format = opt.get('format', '%s')
+        text = '['
+        if 'minval' in opt:
+            text += format % opt['minval']
+        text += ' : '
+        if 'maxval' in opt:
+            text += format % opt['maxval']
+        text += ']'
+    return text
+
+def format_parameter_rate(opt):
+    '''Format the rate allowed for a parameter with options <opt>.'''
+    text = ''
+    if opt.get('maxstep', None) is not None:
+        text += '%s' % opt['maxstep']
+        if opt.get('stepdelay', None) is not None:
+            text += ' / %sms' % opt['stepdelay']
+        else:
+            text += ' / 100ms'
+    return text
+
@@ -316,4 +316,5 @@ def qtlab_exit():
 
     import qt
     qt.flow.exit_request()
+    qt.config.flush()
 
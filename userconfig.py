@@ -21,6 +21,10 @@ config['allowed_ips'] = (
 #    '145.94.*.*',
 )
 
+# Network backend: 'gtk' handles remote clients on the main loop, 'thread'
+# does the network I/O in a separate thread to reduce measurement jitter.
+#config['network_backend'] = 'thread'
+
 # Start instrument server to share with instruments with remote QTLab?
 config['instrument_server'] = False
 
@@ -64,3 +68,33 @@ config['startgui'] = True
 
 # Enter a filename here to log all IPython commands
 config['ipython_logfile'] = ''      #e.g. 'command.log'
+
+## Minimum time in seconds between sending 'changed' and 'new-data-point'
+## signals to remote clients such as the GUI; signals emitted in between
+## are merged. Use 0 to send every signal.
+#config['signal_rate_limits'] = {'changed': 0.1, 'new-data-point': 0.1}
+
+## How to write the settings (.set) file of each data file: 'direct' gets all
+## values from the instruments and 'delta' writes only the changes with
+## respect to the last full settings file. A delta file refers to its base
+## file in the directory of an earlier measurement by a relative path, so
+## keep the data directory together when moving or copying it.
+#config['settings_file_mode'] = 'delta'
+
+## Update live 2D plots incrementally: send only the last maxtraces /
+## maxpoints window to gnuplot as inline data, instead of having gnuplot
+## read the complete data file on every update.
+#config['gnuplot_incremental'] = True
+
+## Reduce plotted traces to the minimum and maximum in this many bins (about
+## the number of pixel columns), and 3D plots to a grid of at most this many
+## cells in each direction. 0 disables decimation.
+#config['plot_decimate'] = 1000
+
+## Maximum share of the wall time spent on automatic plot updates; plots
+## that take long to draw are updated less often.
+#config['plot_time_share'] = 0.2
+
+## Write arrays passed to plot() and plot3() to temporary files for gnuplot
+## to read, instead of sending them from memory as inline (binary) data.
+#config['gnuplot_tempfile'] = True